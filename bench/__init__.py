@@ -0,0 +1,3 @@
+'''
+Benchmarks of the audio pipeline and metadata handling. Run ``python -m bench --help`` for options.
+'''
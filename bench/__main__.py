@@ -0,0 +1,96 @@
+'''
+Run benchmarks, every case is executed in a separate process so that peak memory usage can be measured.
+
+    python -m bench suite [--quick] [--codec flac] [--only merge] [--output results.json]
+    python -m bench case merge_streams --framerate 96000 --sampwidth 3
+'''
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+import fire
+
+def _suite(quick: bool):
+    # long enough for stable numbers, quick mode only checks that everything works
+    scale = 0.05 if quick else 1.
+    suite = []
+    for framerate, sampwidth in [(44100, 2), (96000, 3), (192000, 3)]:
+        suite.append(("merge_streams", dict(framerate=framerate, sampwidth=sampwidth, seconds=300 * scale)))
+    for streaming in [False, True]:
+        suite.append(("convert_track", dict(seconds=300 * scale, streaming=streaming)))
+    suite.append(("convert_track", dict(framerate=96000, sampwidth=3, seconds=300 * scale)))
+    suite.append(("merge_tracks_dry", dict(ntracks=20, repeats=max(int(20 * scale), 1))))
+    suite.append(("merge_tracks_full", dict(seconds=600 * scale, ntracks=12)))
+    suite.append(("cuesheet", dict(ntracks=30, repeats=max(int(200 * scale), 1))))
+    suite.append(("metadata", dict(nfiles=max(int(50 * scale), 1))))
+    for module in ["fluss.codecs", "fluss.utils"]:
+        suite.append(("import_time", dict(module=module, repeats=max(int(10 * scale), 1))))
+    return suite
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # not available on Windows
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS and KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20)
+
+def case(name: str, codec: str = "stub", **params):
+    '''
+    Run a single case in this process and print the result as JSON
+    '''
+    from .cases import cases, setup
+
+    setup(codec)
+    if name in ("convert_track", "merge_tracks_dry", "merge_tracks_full"):
+        params["codec"] = codec
+    result = cases[name](**params)
+    result["rss_mb"], result["children_rss_mb"] = _peak_rss_mb()
+    print(json.dumps(result))
+
+def _format(name: str, params: dict, result: dict) -> str:
+    desc = ", ".join("%s=%s" % (k, v) for k, v in params.items() if k != "repeats")
+    metrics = []
+    if "bytes" in result:
+        metrics.append("%8.1f MB/s" % (result["bytes"] / result["seconds"] / 2 ** 20))
+    if "items" in result:
+        metrics.append("%8.1f items/s" % (result["items"] / result["seconds"]))
+    if result.get("rss_mb") is not None:
+        metrics.append("peak RSS %6.1f MB (children %.1f MB)" % (result["rss_mb"], result["children_rss_mb"]))
+    return "%-18s %-50s %s" % (name, desc, "  ".join(metrics))
+
+def suite(quick: bool = False, codec: str = "stub", only: Optional[str] = None, output: Optional[str] = None):
+    '''
+    Run the benchmark suite
+
+    :param quick: Use small inputs, only for checking that the benchmarks work
+    :param codec: Audio codec preset in config used for encoding and decoding, "stub" copies wave data with external processes
+    :param only: Only run cases whose name contains this string
+    :param output: Save the results as JSON
+    '''
+    results = []
+    for name, params in _suite(quick):
+        if only and only not in name:
+            continue
+        args = [sys.executable, "-m", "bench", "case", name, "--codec", codec]
+        for k, v in params.items():
+            args += ["--" + k, json.dumps(v)]
+        proc = subprocess.run(args, stdout=subprocess.PIPE, cwd=Path(__file__).parent.parent)
+        if proc.returncode != 0:
+            print("%-18s FAILED (return code %d)" % (name, proc.returncode))
+            continue
+
+        result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+        results.append(dict(case=name, params=params, **result))
+        print(_format(name, params, result))
+
+    if output:
+        with Path(output).open("w") as fout:
+            json.dump(results, fout, indent=2)
+
+if __name__ == "__main__":
+    fire.Fire({"suite": suite, "case": case})
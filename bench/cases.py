@@ -0,0 +1,144 @@
+'''
+Benchmark cases. Each case prepares its inputs in a temporary directory, then times the operation
+and returns the amount of processed data as "bytes" and/or "items" along with the best "seconds".
+'''
+
+import asyncio
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict
+
+from fluss import codecs
+from fluss.config import global_config
+from fluss.cuesheet import Cuesheet
+from fluss.meta import DiscMeta
+from fluss.pcm import MappedPCM
+from fluss import utils
+
+from . import stub
+from .synth import cuesheet_text, multifile_cuesheet_text, write_flac_header, write_wave
+
+cases: Dict[str, Callable[..., dict]] = {}
+
+def _case(func):
+    cases[func.__name__] = func
+    return func
+
+def _best_of(repeats: int, func: Callable[[], None]) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _prepare_audio(folder: Path, name: str, codec: str, **wave_args) -> Path:
+    '''
+    Generate an audio file encoded with the codec preset, or stored by the stub codec if codec is "stub"
+    '''
+    fwav = folder / (name + ".wav")
+    write_wave(fwav, **wave_args)
+    if codec == "stub":
+        return fwav.rename(fwav.with_suffix(".stub"))
+
+    codec_t = codecs.codec_from_name[global_config.audio_codecs[codec].type.lower()]
+    fout = folder / (name + "." + codec_t.suffix)
+    with MappedPCM(fwav, delete=True) as wave_in:
+        asyncio.run(codec_t(global_config.audio_codecs[codec].encode).encode_stream_async(
+            fout, codecs.MergedWaveStream([wave_in])))
+    return fout
+
+def _output_name(codec: str, name: str) -> str:
+    if codec == "stub":
+        return name + ".stub"
+    return name + "." + codecs.codec_from_name[global_config.audio_codecs[codec].type.lower()].suffix
+
+@_case
+def merge_streams(framerate=44100, sampwidth=2, seconds=60, ntracks=4, repeats=3, **_):
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        inputs = [tmp / ("%d.wav" % i) for i in range(ntracks)]
+        nbytes = sum(write_wave(f, seconds / ntracks, framerate, sampwidth, seed=i) for i, f in enumerate(inputs))
+
+        def run():
+            with (tmp / "merged.wav").open("wb") as fout:
+                codecs.merge_streams([MappedPCM(f) for f in inputs], fout)
+        return dict(bytes=nbytes, seconds=_best_of(repeats, run))
+
+@_case
+def convert_track(framerate=44100, sampwidth=2, seconds=60, streaming=False, codec="stub", repeats=3, **_):
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        fin = _prepare_audio(tmp, "track", codec, seconds=seconds, framerate=framerate, sampwidth=sampwidth)
+        fout = tmp / _output_name(codec, "converted")
+        codec_out = None if codec == "stub" else codec
+
+        def run():
+            asyncio.run(utils.convert_track(fin, fout, meta=DiscMeta(), codec_out=codec_out, streaming=streaming))
+        nbytes = int(seconds * framerate) * 2 * sampwidth
+        return dict(bytes=nbytes, seconds=_best_of(repeats, run))
+
+@_case
+def merge_tracks_dry(ntracks=20, repeats=20, codec="stub", **_):
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        inputs = [_prepare_audio(tmp, "%02d" % i, codec, seconds=0.1, seed=i) for i in range(ntracks)]
+        fout = tmp / _output_name(codec, "merged")
+        codec_out = None if codec == "stub" else codec
+        cue = multifile_cuesheet_text([f.name for f in inputs])
+
+        def run():
+            asyncio.run(utils.merge_tracks(inputs, fout, cuesheet=Cuesheet.parse(cue), codec_out=codec_out, dry_run=True))
+        return dict(items=ntracks, seconds=_best_of(repeats, run))
+
+@_case
+def merge_tracks_full(framerate=44100, sampwidth=2, seconds=60, ntracks=10, codec="stub", repeats=1, **_):
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        inputs = [_prepare_audio(tmp, "%02d" % i, codec, seconds=seconds / ntracks,
+                                 framerate=framerate, sampwidth=sampwidth, seed=i) for i in range(ntracks)]
+        fout = tmp / _output_name(codec, "merged")
+        codec_out = None if codec == "stub" else codec
+        cue = multifile_cuesheet_text([f.name for f in inputs])
+
+        def run():
+            asyncio.run(utils.merge_tracks(inputs, fout, cuesheet=Cuesheet.parse(cue), codec_out=codec_out))
+        nbytes = ntracks * int(seconds / ntracks * framerate) * 2 * sampwidth
+        return dict(bytes=nbytes, items=ntracks, seconds=_best_of(repeats, run))
+
+@_case
+def cuesheet(ntracks=30, repeats=200, **_):
+    text = cuesheet_text(ntracks)
+    def run():
+        str(Cuesheet.parse(text))
+    return dict(bytes=len(text.encode()), items=ntracks, seconds=_best_of(3, lambda: [run() for _ in range(repeats)]) / repeats)
+
+@_case
+def metadata(nfiles=20, ntracks=12, **_):
+    from mutagen.flac import FLAC
+
+    with TemporaryDirectory() as tmp:
+        files = [Path(tmp, "%02d.flac" % i) for i in range(nfiles)]
+        for f in files:
+            write_flac_header(f, ntracks)
+
+        def run():
+            for f in files:
+                meta = DiscMeta.from_mutagen(FLAC(str(f)))
+                meta.to_mutagen(FLAC(str(f)))
+        return dict(items=nfiles, seconds=_best_of(3, run))
+
+@_case
+def import_time(module="fluss.codecs", repeats=10, **_):
+    # each import runs in a fresh interpreter, the startup of the interpreter itself is subtracted
+    def run(stmt):
+        return _best_of(repeats, lambda: subprocess.run([sys.executable, "-c", stmt], check=True))
+    return dict(items=1, seconds=max(run("import " + module) - run("pass"), 1e-6))
+
+def setup(codec: str = "stub") -> None:
+    stub.register()
+    if codec != "stub" and codec not in global_config.audio_codecs:
+        raise ValueError("Unknown audio codec preset: %s" % codec)
@@ -0,0 +1,79 @@
+'''
+A codec storing wave data as is through external processes. It mimics the IO pattern of real
+codecs (pipes, temporary files and process spawning) without requiring any encoder binary.
+'''
+
+import asyncio
+import struct
+import subprocess
+import sys
+
+from mutagen import StreamInfo
+from mutagen.apev2 import APEv2File
+
+from fluss import codecs
+from fluss.codecs import AudioCodec, _map_decoded, _resolve_pathstr, joint_command_args
+
+_COPY_SCRIPT = ("import sys, shutil;"
+                "fin = sys.stdin.buffer if sys.argv[1] == '-' else open(sys.argv[1], 'rb');"
+                "fout = sys.stdout.buffer if sys.argv[2] == '-' else open(sys.argv[2], 'wb');"
+                "shutil.copyfileobj(fin, fout, 1 << 20)")
+
+def _copy_args(fin: str, fout: str):
+    return [sys.executable, "-S", "-c", _COPY_SCRIPT, fin, fout]
+
+class _WaveInfo(StreamInfo):
+    ''' stream info read from the wave header at the beginning of the file '''
+    def __init__(self, fileobj):
+        header = fileobj.read(44)
+        if len(header) < 44 or header[:4] != b'RIFF':
+            self.length = 0.
+            self.sample_rate = self.channels = self.bits_per_sample = 0
+            return
+
+        self.channels, self.sample_rate = struct.unpack_from('<HI', header, 22)
+        self.bits_per_sample, = struct.unpack_from('<H', header, 34)
+        datasize, = struct.unpack_from('<I', header, 40)
+        self.length = datasize / (self.channels * self.bits_per_sample // 8) / self.sample_rate
+
+    def pprint(self):
+        return "Stub wave, %.2f seconds, %d Hz" % (self.length, self.sample_rate)
+
+class StubFile(APEv2File):
+    ''' wave data with APEv2 tags appended, so that metadata can be written like real codecs '''
+    _Info = _WaveInfo
+
+class stub(AudioCodec):
+    suffix = "stub"
+
+    def _encode_pipe_args(self, fout: str):
+        return _copy_args("-", fout)
+
+    def _decode_pipe_args(self, fin: str):
+        return _copy_args(fin, "-")
+
+    async def encode_async(self, fout, wavein, progress_callback=None):
+        proc = await self.encode_pipe_async(fout)
+        proc.stdin.write(wavein)
+        await proc.stdin.drain()
+        proc.stdin.close()
+        self._assert_retcode("stub encoder", await proc.wait())
+        if progress_callback is not None:
+            progress_callback(1.0)
+
+    async def _decode_async(self, fin, progress_callback=None):
+        ftmp = await self._allocate_decoded(fin)
+        proc = await asyncio.create_subprocess_shell(
+            joint_command_args(*_copy_args(_resolve_pathstr(fin), str(ftmp))), stderr=subprocess.DEVNULL)
+        await self._wait_process("stub decoder", proc, cleanup=[ftmp])
+        if progress_callback is not None:
+            progress_callback(1.0)
+        return _map_decoded(ftmp)
+
+    @classmethod
+    def mutagen(cls, fin):
+        return StubFile(fin)
+
+def register() -> None:
+    ''' make files with suffix .stub recognized by fluss '''
+    codecs.codec_from_name['stub'] = stub
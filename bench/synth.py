@@ -0,0 +1,72 @@
+'''
+Generation of synthetic inputs for benchmarks. Audio content is pseudo random noise, which is the worst case
+for compression but doesn't matter for the stub codec.
+'''
+
+import random
+import struct
+from pathlib import Path
+from typing import List
+
+from mutagen.flac import FLAC
+
+from fluss.codecs import _wave_header
+
+_BLOCK = 2 ** 20
+
+def write_wave(path: Path, seconds: float, framerate: int = 44100, sampwidth: int = 2,
+               nchannels: int = 2, seed: int = 0) -> int:
+    '''
+    Write a wave file with noise, the content is generated block by block to keep memory usage low
+
+    :return: size of the PCM data in bytes
+    '''
+    nframes = int(seconds * framerate)
+    datasize = nframes * nchannels * sampwidth
+    block = random.Random(seed).randbytes(_BLOCK)
+    with path.open("wb") as fout:
+        fout.write(_wave_header(nchannels, sampwidth, framerate, nframes))
+        remaining = datasize
+        while remaining > 0:
+            fout.write(block[:remaining])
+            remaining -= _BLOCK
+    return datasize
+
+def cuesheet_text(ntracks: int, filename: str = "image.wav", track_seconds: int = 200) -> str:
+    lines = ['REM GENRE Electronic', 'REM DATE 2021', 'PERFORMER "Benchmark Artist"',
+             'TITLE "Benchmark Album"', 'FILE "%s" WAVE' % filename]
+    for i in range(ntracks):
+        start = i * track_seconds
+        lines += ['  TRACK %02d AUDIO' % (i + 1),
+                  '    TITLE "Track %d"' % (i + 1),
+                  '    PERFORMER "Benchmark Artist"',
+                  '    INDEX 01 %02d:%02d:00' % (start // 60, start % 60)]
+    return "\n".join(lines) + "\n"
+
+def multifile_cuesheet_text(filenames: List[str]) -> str:
+    ''' cuesheet with one track in each file, like those ripped in track mode '''
+    lines = ['PERFORMER "Benchmark Artist"', 'TITLE "Benchmark Album"']
+    for i, filename in enumerate(filenames):
+        lines += ['FILE "%s" WAVE' % filename,
+                  '  TRACK %02d AUDIO' % (i + 1),
+                  '    TITLE "Track %d"' % (i + 1),
+                  '    INDEX 01 00:00:00']
+    return "\n".join(lines) + "\n"
+
+def write_flac_header(path: Path, ntracks: int = 12, framerate: int = 44100, seconds: int = 2400) -> None:
+    '''
+    Write a FLAC file that contains only metadata blocks (no audio frames) with album tags and a cuesheet
+    '''
+    # STREAMINFO: block sizes, frame sizes, then 64 bits of rate, channels, bits and total samples
+    packed = (framerate << 44) | ((2 - 1) << 41) | ((16 - 1) << 36) | (framerate * seconds)
+    streaminfo = struct.pack('>HH', 4096, 4096) + (0).to_bytes(6, 'big') + packed.to_bytes(8, 'big') + bytes(16)
+    path.write_bytes(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+
+    meta = FLAC(str(path))
+    meta.add_tags()
+    meta.tags['ALBUM'] = "Benchmark Album"
+    meta.tags['ALBUM ARTIST'] = ["Benchmark Artist", "Featured Artist"]
+    meta.tags['DATE'] = "2021"
+    meta.tags['GENRE'] = "Electronic"
+    meta.tags['CUESHEET'] = cuesheet_text(ntracks, path.name, seconds // max(ntracks, 1))
+    meta.save()
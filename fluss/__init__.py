@@ -1 +1,14 @@
-from . import config
\ No newline at end of file
+'''
+Submodules are imported on first access, so that importing fluss (or one of its submodules) doesn't
+pull in the heavy dependencies of the others.
+'''
+
+import importlib
+
+_submodules = {"accurip", "analysis", "cache", "codecs", "config", "cuesheet", "jobs", "logs", "meta",
+               "pcm", "probe", "progress", "scheduler", "scratch", "tools", "transport", "utils"}
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -2,9 +2,13 @@
 # A large part of the code comes from https://github.com/lintweaker/python-dsd-tools/blob/master/dsdlib.py
 # DSF file specs: https://dsd-guide.com/sites/default/files/white-papers/DSFFileFormatSpec_E.pdf
 
-from chunk import Chunk
-import struct
 import builtins
+import io
+import mmap
+import struct
+from collections import namedtuple
+from pathlib import Path
+from typing import Union
 
 dsf_data = {
     'hdr' : '<4sQQQ',
@@ -20,6 +24,14 @@ for x in dsf_data:
     dsf_length[x] = struct.calcsize(dsf_data[x])
     dsf_unpacked[x] = struct.Struct(dsf_data[x]).unpack_from
 
+_dsf_params = namedtuple('_dsf_params', 'nchannels sampwidth framerate nframes comptype compname')
+
+# lookup table for reversing bit order of LSB first data
+_bit_reverse = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+# idle pattern of DSD stream, which has zero DC
+_dsd_silence = 0x69
+
 def getmaxdsd() -> int:
     '''
     Returns max supported DSD rate. DSD64 = 1, DSD128 = 2, etc
@@ -102,16 +114,209 @@ class Dsf_read:
             raise RuntimeError("Expect data chunk after fmt")
 
         self._data_pos = f.tell()
+        self._data_size = db[1] - dsf_length['data']
 
     def __init__(self, f):
         self._i_opened_the_file = None
-        if isinstance(f, str):
+        if isinstance(f, (str, Path)):
             f = builtins.open(f, 'rb')
             self._i_opened_the_file = f
 
         try:
             self.initfp(f)
+            self._map_data(f)
         except:
             if self._i_opened_the_file:
                 f.close()
             raise
+
+    def _map_data(self, f):
+        # sample data is accessed through a memory map, or loaded into memory if the file cannot be mapped
+        try:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buffer_pos = self._data_pos
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            f.seek(self._data_pos)
+            self._buffer = f.read(self._data_size)
+            self._buffer_pos = 0
+        self._soundpos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(getattr(self, '_buffer', None), mmap.mmap):
+            self._buffer.close()
+        self._buffer = None
+        if self._i_opened_the_file:
+            self._i_opened_the_file.close()
+            self._i_opened_the_file = None
+
+    # A frame contains one byte (8 DSD samples, MSB first) for each channel, so that DSD data can
+    # be handled like 8 bit PCM with framerate of DSD rate / 8
+
+    def getnchannels(self) -> int:
+        return self._nchannels
+
+    def getsampwidth(self) -> int:
+        return self._samplewidth
+
+    def getframerate(self) -> int:
+        return self._dsf_rate // 8
+
+    def getnframes(self) -> int:
+        return (self._nframes + 7) // 8
+
+    def getdsdrate(self) -> int:
+        return self._dsf_rate
+
+    def getnsamples(self) -> int:
+        ''' number of DSD samples in each channel '''
+        return self._nframes
+
+    def getchanneltype(self) -> int:
+        return self._channel_type
+
+    def getcomptype(self) -> str:
+        return 'DSD'
+
+    def getcompname(self) -> str:
+        return 'DSD (1 bit)'
+
+    def getparams(self) -> _dsf_params:
+        return _dsf_params(self.getnchannels(), self.getsampwidth(), self.getframerate(),
+                           self.getnframes(), self.getcomptype(), self.getcompname())
+
+    def rewind(self):
+        self._soundpos = 0
+
+    def tell(self) -> int:
+        return self._soundpos
+
+    def setpos(self, pos: int):
+        if pos < 0 or pos > self.getnframes():
+            raise RuntimeError('position not in range')
+        self._soundpos = pos
+
+    def readframes(self, nframes: int) -> bytearray:
+        '''
+        Read frames interleaved by channel. DSF stores each channel in separate blocks of 4096 bytes,
+        the blocks covering the requested range are scattered into the output with strided copies.
+        '''
+        start = self._soundpos
+        end = min(start + nframes, self.getnframes())
+        nchannels = self._nchannels
+        frames = bytearray((end - start) * nchannels)
+
+        pos = start
+        while pos < end:
+            block, offset = divmod(pos, self._block_size)
+            count = min(self._block_size - offset, end - pos)
+            src = self._buffer_pos + block * self._block_size * nchannels + offset
+            dst = (pos - start) * nchannels
+            for ch in range(nchannels):
+                chsrc = src + ch * self._block_size
+                frames[dst + ch:dst + count * nchannels:nchannels] = self._buffer[chsrc:chsrc + count]
+            pos += count
+
+        if self._lsbfirst:
+            frames = frames.translate(_bit_reverse)
+        self._soundpos = end
+        return frames
+
+def open(f, mode=None):
+    if mode not in (None, 'r', 'rb'):
+        raise RuntimeError("Only reading DSF is supported")
+    return Dsf_read(f)
+
+def dsd_pcm_rate(dsd_rate: int, pcm_rate: int = 88200) -> int:
+    '''
+    Get the PCM rate to convert a DSD stream to, pcm_rate is given for DSD rates based on 44.1kHz
+    and scaled for those based on 48kHz
+    '''
+    if dsd_rate % 48000 == 0:
+        return pcm_rate // 44100 * 48000 if pcm_rate % 44100 == 0 else pcm_rate
+    return pcm_rate
+
+def _lowpass(ntaps: int, cutoff: float):
+    ''' windowed sinc lowpass filter with unit DC gain, cutoff is in cycles per sample '''
+    import numpy as np
+
+    n = np.arange(ntaps) - (ntaps - 1) / 2
+    h = np.sinc(2 * cutoff * n) * np.kaiser(ntaps, 8.)
+    return h / h.sum()
+
+class DsdDecimator:
+    '''
+    Convert DSD frames (as returned by :meth:`Dsf_read.readframes`) to PCM samples in [-1, 1] with two FIR stages.
+    The first stage decimates by 8, its output is computed by summing lookup tables indexed by DSD bytes, so that
+    individual bits are never expanded. The second stage is a windowed sinc lowpass evaluated only at the output samples.
+
+    The decimator is stateful, frames of a stream should be passed in order and :meth:`flush` should be called at the end.
+    Output is aligned with the input and has exactly :meth:`output_length` samples.
+    '''
+    def __init__(self, nchannels: int, dsd_rate: int, pcm_rate: int, stage1_bytes: int = 8, stage2_taps_per_phase: int = 16) -> None:
+        import numpy as np
+
+        if dsd_rate % (8 * pcm_rate) != 0:
+            raise ValueError("DSD rate %d cannot be decimated to %d" % (dsd_rate, pcm_rate))
+        self._nchannels = nchannels
+        self._ratio = dsd_rate // 8 // pcm_rate
+
+        # first stage: FIR over bits at DSD rate, one output per byte
+        h1 = _lowpass(8 * stage1_bytes, 1 / 32).reshape(stage1_bytes, 8)
+        bits = ((np.arange(256)[:, None] >> np.arange(7, -1, -1)) & 1) * 2. - 1.
+        self._tables = h1 @ bits.T # (stage1_bytes, 256)
+        self._hist1 = np.full((stage1_bytes - 1, nchannels), _dsd_silence, dtype=np.uint8)
+
+        # second stage: lowpass at 0.45 * pcm_rate, prefilled so that the output is centered to input
+        self._h2 = _lowpass(stage2_taps_per_phase * self._ratio + 1, 0.45 / self._ratio)
+        delay = (len(self._h2) - 1) // 2 - stage1_bytes // 2
+        self._hist2 = np.zeros((max(delay, 0), nchannels))
+
+        self._consumed = 0
+        self._produced = 0
+
+    def output_length(self, nframes: int) -> int:
+        ''' number of PCM samples converted from nframes DSD frames '''
+        return -(-nframes // self._ratio)
+
+    def _filter(self, frames):
+        import numpy as np
+        from numpy.lib.stride_tricks import sliding_window_view
+
+        x = np.concatenate([self._hist1, np.frombuffer(frames, dtype=np.uint8).reshape(-1, self._nchannels)])
+        nstage1 = len(x) - len(self._tables) + 1
+        y = np.zeros((nstage1, self._nchannels))
+        for k, table in enumerate(self._tables):
+            y += table[x[k:k + nstage1]]
+        self._hist1 = x[nstage1:].copy()
+
+        buf = np.concatenate([self._hist2, y])
+        ntaps = len(self._h2)
+        noutput = (len(buf) - ntaps) // self._ratio + 1 if len(buf) >= ntaps else 0
+        if noutput == 0:
+            self._hist2 = buf
+            return np.zeros((0, self._nchannels))
+        windows = sliding_window_view(buf, ntaps, axis=0)[:noutput * self._ratio:self._ratio]
+        self._hist2 = buf[noutput * self._ratio:].copy()
+        return windows @ self._h2
+
+    def process(self, frames: Union[bytes, bytearray, memoryview]):
+        ''' convert DSD frames, return float array with shape (nsamples, nchannels) '''
+        self._consumed += len(frames) // self._nchannels
+        samples = self._filter(frames)
+        samples = samples[:self.output_length(self._consumed) - self._produced]
+        self._produced += len(samples)
+        return samples
+
+    def flush(self):
+        ''' feed silence to push out the samples delayed by the filters '''
+        remaining = self.output_length(self._consumed) - self._produced
+        padding = (remaining * self._ratio + len(self._h2) + len(self._tables)) * self._nchannels
+        samples = self._filter(bytes([_dsd_silence]) * padding)[:remaining]
+        self._produced += len(samples)
+        return samples
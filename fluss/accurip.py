@@ -1,23 +1,32 @@
 # AccurateRip support is based on CUETools
 
 import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
 import subprocess
 from pathlib import Path
-from typing import Union
+from typing import Callable, Dict, List, Optional, Union
 
 import parse
 from addict import Dict as edict
 
+from .cache import hash_file
 from .config import global_config
+from .tools import get_tool_registry
 
+_logger = logging.getLogger("fluss.accurip")
 
 async def verify_accurip(input_file: Union[str, Path]) -> str:
-    args = f'"{global_config.path.arcue}" -v "{input_file}"'
+    arcue = get_tool_registry().require("arcue").path
+    args = f'"{arcue}" -v "{input_file}"'
     process = await asyncio.create_subprocess_shell(args, stdout=subprocess.PIPE)
-    rt = await process.wait()
-    if rt != 0:
+    stdout, _ = await process.communicate() # read while waiting, long logs could fill the pipe
+    if process.returncode != 0:
         raise RuntimeError("ARCue returned non-zero!")
-    return await process.stdout.read()
+    return stdout
 
 def parse_accurip(accurip_log: Union[str, bytes]) -> dict:
     '''
@@ -51,3 +60,151 @@ def parse_accurip(accurip_log: Union[str, bytes]) -> dict:
             result.fail = True
 
     return result
+
+def accurip_key(input_file: Union[str, Path]) -> str:
+    '''
+    Identify the content to be verified. A cuesheet refers to other audio files in the folder,
+    so their contents are covered as well.
+    '''
+    input_file = Path(input_file)
+    digests = [hash_file(input_file)]
+    if input_file.suffix.lower() == ".cue":
+        from .codecs import codec_from_name
+        suffixes = set('.' + c.suffix for c in codec_from_name.values())
+        for sibling in sorted(input_file.parent.iterdir()):
+            if sibling.suffix.lower() in suffixes:
+                digests.append(hash_file(sibling))
+    return hashlib.blake2b("|".join(digests).encode("ascii"), digest_size=20).hexdigest()
+
+class AccurateRipCache:
+    '''
+    Parsed AccurateRip results and logs keyed by :func:`accurip_key`, stored in a JSON file
+    '''
+    def __init__(self, path: Union[str, Path]) -> None:
+        self._path = Path(path)
+        self._entries: Dict[str, dict] = {}
+        self._dirty = False
+        if self._path.exists():
+            try:
+                with self._path.open("r", encoding="utf-8") as fin:
+                    self._entries = json.load(fin)
+            except (OSError, ValueError):
+                _logger.warning("Failed to load AccurateRip cache %s, it will be rebuilt", str(self._path))
+
+    def get(self, key: str) -> Optional[edict]:
+        '''
+        Return the cached result in the same form of :func:`parse_accurip` with the log stored in field "log"
+        '''
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        result = edict(fail=entry["fail"], log=entry["log"])
+        for ctdbid, (conf, status) in entry["tracks"].items():
+            result[int(ctdbid, 16)] = conf, status
+        return result
+
+    def put(self, key: str, log: Union[str, bytes], parsed: dict) -> None:
+        if isinstance(log, bytes):
+            log = log.decode()
+        tracks = {"%08x" % k: list(v) for k, v in parsed.items() if isinstance(k, int)}
+        self._entries[key] = dict(fail=parsed["fail"], tracks=tracks, log=log)
+        self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_name("%s.%x.tmp" % (self._path.name, random.getrandbits(32)))
+        with tmp.open("w", encoding="utf-8") as fout:
+            json.dump(self._entries, fout)
+        os.replace(tmp, self._path)
+        self._dirty = False
+
+_accurip_cache = None
+
+def get_accurip_cache() -> AccurateRipCache:
+    '''
+    Get the result cache configured by accurip.cache_path in global config
+    '''
+    global _accurip_cache
+    path = Path(global_config.accurip.cache_path or Path("~/.cache/fluss/accurip.json").expanduser())
+    if _accurip_cache is None or _accurip_cache._path != path:
+        _accurip_cache = AccurateRipCache(path)
+    return _accurip_cache
+
+async def verify_accurip_cached(input_file: Union[str, Path], cache: AccurateRipCache = None) -> edict:
+    '''
+    Verify the file with ARCue unless its result is cached
+
+    :return: Parsed result as :func:`parse_accurip`, with the log in field "log" and whether it's a cache hit in field "cached"
+    '''
+    if cache is None:
+        log = await verify_accurip(input_file)
+        result = parse_accurip(log)
+        result.log = log.decode()
+        result.cached = False
+        return result
+
+    key = await asyncio.get_running_loop().run_in_executor(None, accurip_key, input_file)
+    result = cache.get(key)
+    if result is not None:
+        _logger.debug("AccurateRip result of %s is cached", str(input_file))
+        result.cached = True
+        return result
+
+    log = await verify_accurip(input_file)
+    result = parse_accurip(log)
+    cache.put(key, log, result)
+    result.log = log.decode()
+    result.cached = False
+    return result
+
+async def verify_accurip_batch(input_files: List[Union[str, Path]],
+                               max_workers: int = None,
+                               cache: AccurateRipCache = None,
+                               progress_callback: Callable[[int, int], None] = None) -> dict:
+    '''
+    Verify multiple files with at most max_workers ARCue processes running concurrently.
+    Errors of individual files are recorded rather than raised.
+
+    :param progress_callback: called as progress_callback(finished, total) after each file
+    :return: JSON serializable summary with counts and result of each file
+    '''
+    max_workers = max_workers or os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(max_workers)
+    finished = 0
+
+    async def verify(input_file: Path) -> dict:
+        nonlocal finished
+        record = dict(file=str(input_file), status="error", cached=False, tracks={}, error=None)
+        async with semaphore:
+            try:
+                result = await verify_accurip_cached(input_file, cache)
+                record["status"] = "fail" if result.fail else "pass"
+                record["cached"] = result.cached
+                record["tracks"] = {"%08x" % k: dict(confidence=v[0], status=v[1])
+                                    for k, v in result.items() if isinstance(k, int)}
+            except Exception as e:
+                _logger.exception("AccurateRip verification of %s failed", str(input_file))
+                record["error"] = str(e)
+
+        finished += 1
+        if progress_callback is not None:
+            progress_callback(finished, len(input_files))
+        return record
+
+    try:
+        records = await asyncio.gather(*[verify(Path(f)) for f in input_files])
+    finally:
+        if cache is not None:
+            cache.save()
+
+    return dict(
+        total=len(records),
+        passed=sum(r["status"] == "pass" for r in records),
+        failed=sum(r["status"] == "fail" for r in records),
+        errors=sum(r["status"] == "error" for r in records),
+        cached=sum(r["cached"] for r in records),
+        results=records
+    )
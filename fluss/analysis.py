@@ -0,0 +1,271 @@
+'''
+Analysis of PCM streams in a single pass: MD5 of the frames, sample peak and integrated loudness
+(ITU-R BS.1770-4 / EBU R128), from which ReplayGain 2.0 gains are derived. NumPy is required.
+'''
+
+import hashlib
+import logging
+import math
+from functools import lru_cache
+from typing import List, Optional, Union
+
+from fluss.pcm import frames_to_array
+
+_logger = logging.getLogger("fluss.analysis")
+
+REPLAYGAIN_REFERENCE = -18.
+''' reference loudness of ReplayGain 2.0 in LUFS '''
+
+_absolute_gate = -70.
+_relative_gate = -10.
+
+def _k_weighting_biquads(framerate: int):
+    ''' coefficients (b, a) of the two stages of K-weighting filter for any sample rate (from libebur128) '''
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / framerate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+             [1., 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / framerate)
+    a0 = 1 + k / q + k * k
+    highpass = ([1., -2., 1.], [1., 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf, highpass
+
+@lru_cache(maxsize=8)
+def _k_weighting_response(framerate: int, tolerance: float = 1e-9, max_length: int = 2 ** 17):
+    '''
+    Impulse response of K-weighting filter, truncated where the remaining energy is negligible. The filter is
+    applied as FIR by FFT convolution so that it's vectorized without SciPy.
+    '''
+    import numpy as np
+
+    response = [0.] * max_length
+    response[0] = 1.
+    for b, a in _k_weighting_biquads(framerate):
+        x1 = x2 = y1 = y2 = 0.
+        for n, x in enumerate(response):
+            y = b[0] * x + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            x2, x1, y2, y1 = x1, x, y1, y
+            response[n] = y
+
+    response = np.array(response)
+    tail_energy = np.cumsum((response ** 2)[::-1])[::-1]
+    length = int(np.searchsorted(-tail_energy, -tail_energy[0] * tolerance))
+    return response[:max(length, 1)]
+
+def _channel_weights(nchannels: int) -> List[float]:
+    if nchannels == 5: # L, R, C, Ls, Rs
+        return [1., 1., 1., 1.41, 1.41]
+    if nchannels == 6: # L, R, C, LFE, Ls, Rs
+        return [1., 1., 1., 0., 1.41, 1.41]
+    return [1.] * nchannels
+
+def _integrated_loudness(powers) -> Optional[float]:
+    ''' gated loudness from mean square of 400ms blocks (weighted sum over channels), None if it's silent '''
+    import numpy as np
+
+    powers = np.asarray(powers)
+    powers = powers[powers > 10 ** ((_absolute_gate + 0.691) / 10)]
+    if len(powers) == 0:
+        return None
+    threshold = 10 ** ((-0.691 + 10 * math.log10(powers.mean()) + _relative_gate + 0.691) / 10)
+    powers = powers[powers > threshold]
+    return -0.691 + 10 * math.log10(powers.mean())
+
+class AudioAnalysis:
+    '''
+    Analysis result of a track or an album
+    '''
+    md5: str
+    peak: float
+    loudness: Optional[float]
+    tracks: List["AudioAnalysis"]
+
+    def __init__(self, md5: str, peak: float, loudness: Optional[float]) -> None:
+        self.md5 = md5
+        self.peak = peak
+        self.loudness = loudness
+        self.tracks = []
+
+    @property
+    def gain(self) -> Optional[float]:
+        ''' ReplayGain 2.0 gain in dB '''
+        if self.loudness is None:
+            return None
+        return REPLAYGAIN_REFERENCE - self.loudness
+
+    @classmethod
+    def from_dict(cls, obj: dict) -> "AudioAnalysis":
+        ''' load the result saved by :meth:`to_dict` '''
+        result = cls(obj['md5'], obj['peak'], obj.get('loudness'))
+        result.tracks = [cls.from_dict(t) for t in obj.get('tracks', [])]
+        return result
+
+    def to_dict(self) -> dict:
+        obj = dict(md5=self.md5, peak=round(self.peak, 6))
+        if self.loudness is not None:
+            obj['loudness'] = round(self.loudness, 2)
+            obj['gain'] = round(self.gain, 2)
+        if self.tracks:
+            obj['tracks'] = [t.to_dict() for t in self.tracks]
+        return obj
+
+class StreamAnalyzer:
+    '''
+    Incrementally analyze interleaved PCM frames. Tracks are split at the given frame offsets, loudness of
+    the album is gated over the blocks of all tracks.
+
+    :param track_starts: first frame of each track except the first one
+    '''
+    def __init__(self, nchannels: int, sampwidth: int, framerate: int, track_starts: List[int] = ()) -> None:
+        import numpy as np
+
+        self._nchannels = nchannels
+        self._sampwidth = sampwidth
+        self._framesize = nchannels * sampwidth
+        self._step = framerate // 10 # blocks are 400ms long with 75% overlap
+        self._weights = np.array(_channel_weights(nchannels))
+
+        self._response = _k_weighting_response(framerate)
+        self._spectrums = {}
+        self._tail = np.zeros((len(self._response) - 1, nchannels))
+
+        self._boundaries = sorted(s for s in track_starts if s > 0)
+        self._position = 0
+        self._album_md5 = hashlib.md5()
+        self._tracks: List[AudioAnalysis] = []
+        self._album_powers = []
+        self._start_track()
+
+    def _start_track(self) -> None:
+        self._md5 = hashlib.md5()
+        self._peak = 0
+        self._segments = [] # mean square of each 100ms segment
+        self._partial_sum = 0.
+        self._partial_count = 0
+
+    def _finish_track(self) -> None:
+        import numpy as np
+
+        segments = np.array(self._segments).reshape(-1)
+        powers = np.convolve(segments, np.full(4, 0.25), mode='valid') if len(segments) >= 4 else np.array([])
+        self._album_powers.append(powers)
+
+        full_scale = 2 ** (8 * self._sampwidth - 1)
+        self._tracks.append(AudioAnalysis(self._md5.hexdigest(), self._peak / full_scale, _integrated_loudness(powers)))
+        self._start_track()
+
+    def _filter(self, samples):
+        ''' apply K-weighting with overlap-add, filter state is kept between calls '''
+        import numpy as np
+
+        length = len(samples) + len(self._response) - 1
+        nfft = 1 << (length - 1).bit_length()
+        if nfft not in self._spectrums:
+            self._spectrums[nfft] = np.fft.rfft(self._response, nfft)[:, None]
+        filtered = np.fft.irfft(np.fft.rfft(samples, nfft, axis=0) * self._spectrums[nfft], nfft, axis=0)[:length]
+        filtered[:len(self._tail)] += self._tail
+        self._tail = filtered[len(samples):]
+        return filtered[:len(samples)]
+
+    def _feed(self, data: memoryview) -> None:
+        import numpy as np
+
+        self._md5.update(data)
+        self._album_md5.update(data)
+        samples = frames_to_array(data, self._sampwidth, self._nchannels)
+        if self._sampwidth == 3: # 24 bit samples are scaled to full range of int32
+            samples = samples >> 8
+        self._peak = max(self._peak, int(np.abs(samples.astype(np.int64)).max()))
+
+        # mean square of 100ms segments, weighted over channels
+        scale = 2. ** (8 * self._sampwidth - 1)
+        power = (self._filter(samples / scale) ** 2) @ self._weights
+        pos = 0
+        if self._partial_count:
+            fill = min(self._step - self._partial_count, len(power))
+            self._partial_sum += power[:fill].sum()
+            self._partial_count += fill
+            pos = fill
+            if self._partial_count == self._step:
+                self._segments.append(self._partial_sum / self._step)
+                self._partial_sum, self._partial_count = 0., 0
+        nsegments = (len(power) - pos) // self._step
+        if nsegments:
+            end = pos + nsegments * self._step
+            self._segments.extend(power[pos:end].reshape(nsegments, self._step).mean(axis=1))
+            pos = end
+        if pos < len(power):
+            self._partial_sum += power[pos:].sum()
+            self._partial_count += len(power) - pos
+
+    def update(self, frames: Union[bytes, memoryview]) -> None:
+        ''' analyze next block of frames '''
+        frames = memoryview(frames).cast('B')
+        while len(frames) >= self._framesize:
+            nframes = len(frames) // self._framesize
+            if self._boundaries:
+                nframes = min(nframes, self._boundaries[0] - self._position)
+            if nframes > 0:
+                self._feed(frames[:nframes * self._framesize])
+                frames = frames[nframes * self._framesize:]
+                self._position += nframes
+            if self._boundaries and self._position >= self._boundaries[0]:
+                self._boundaries.pop(0)
+                self._finish_track()
+
+    def result(self) -> AudioAnalysis:
+        ''' finish the analysis and return the result of the album, with results of tracks in it '''
+        import numpy as np
+
+        self._finish_track()
+        for _ in self._boundaries: # tracks starting after the end of stream
+            self._finish_track()
+        tracks = self._tracks
+
+        album = AudioAnalysis(self._album_md5.hexdigest(), max(t.peak for t in tracks),
+                              _integrated_loudness(np.concatenate(self._album_powers)))
+        album.tracks = tracks
+        return album
+
+class AnalyzingWaveStream:
+    '''
+    Pass a wave stream through while analyzing its frames, the result is available
+    as :attr:`result` after the stream is exhausted. It only supports asynchronous iteration.
+
+    :param track_starts: first frame of each track except the first one
+    '''
+    def __init__(self, stream, track_starts: List[int] = ()) -> None:
+        self._stream = stream
+        self._track_starts = track_starts
+        self.params = stream.params
+        self.nframes = stream.nframes
+        self.header = stream.header
+        self.result: AudioAnalysis = None
+
+    @property
+    def nbytes(self) -> int:
+        return self._stream.nbytes
+
+    async def __aiter__(self):
+        yield self.header
+        async for chunk in self.aiter_frames():
+            yield chunk
+
+    async def aiter_frames(self):
+        ''' yield blocks of frames without the wave header '''
+        analyzer = StreamAnalyzer(self.params.nchannels, self.params.sampwidth, self.params.framerate, self._track_starts)
+        if hasattr(self._stream, "aiter_frames"):
+            async for chunk in self._stream.aiter_frames():
+                analyzer.update(chunk)
+                yield chunk
+        else:
+            for chunk in self._stream.iter_frames():
+                analyzer.update(chunk)
+                yield chunk
+        self.result = analyzer.result()
+        _logger.debug("Analysis done, loudness %s LUFS, peak %.6f", self.result.loudness, self.result.peak)
@@ -1,10 +1,40 @@
-from .organizer.main import entry_with_args as orgainzer_entry
+import sys
+
+def _load_batch():
+    from .batch import batch_entry
+    return batch_entry
+
+def _load_verify():
+    from .verify import verify_entry
+    return verify_entry
+
+def _load_tools():
+    from .tools import tools_entry
+    return tools_entry
+
+def _load_organizer():
+    from .organizer.main import entry_with_args
+    return entry_with_args
+
+_commands = {"batch": _load_batch, "verify": _load_verify, "tools": _load_tools, "organizer": _load_organizer}
 
 def apps_entry():
     import fire
-    fire.Fire({"organizer": orgainzer_entry})
+    from fluss.logs import setup_logging
+
+    setup_logging()
+
+    # only the module of the requested command is imported, all of them are needed for the help message
+    requested = [sys.argv[1]] if len(sys.argv) > 1 and sys.argv[1] in _commands else list(_commands)
+    commands = {}
+    for name in requested:
+        try:
+            commands[name] = _commands[name]()
+        except ImportError: # GUI dependencies are not available on headless machines
+            if len(requested) == 1:
+                raise
+    fire.Fire(commands)
 
 # TODO: add functionality
 # - batch cover embedding
-# - batch accurip test
 # - batch codec change (image and audio)
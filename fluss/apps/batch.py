@@ -0,0 +1,251 @@
+'''
+Headless batch conversion of album folders. Every folder containing audio files is regarded as an album,
+its targets are generated from a recipe and executed concurrently across all albums.
+
+Recipe is a YAML or JSON file, all fields are optional:
+
+    merge: true                         # merge tracks of each album into one image, otherwise transcode track by track
+    audio_codec: wavpack_hybrid_high    # preset name in audio_codecs of config
+    image_codec: png                    # preset name in image_codecs of config, empty to copy images as is
+    copy_suffixes: [log, txt, pdf]      # suffixes of other files copied to output
+    config: {pipeline: {verify: true}}  # overrides of config for this batch
+
+The config of a batch is layered as defaults <- ~/.fluss.yaml <- .fluss.yaml in input_dir <- config in the recipe,
+and it's frozen when the recipe is loaded. Sections of shared resources (e.g. scratch) are only read from
+~/.fluss.yaml. Targets are tracked in the job queue, running the same batch again resumes it, skipping targets
+that are done.
+'''
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+import yaml
+from addict import Dict as edict
+
+from fluss.codecs import codec_from_name
+from fluss.config import snapshot
+from fluss.jobs import DONE, FAILED, JobQueue, get_job_queue, keep_alive
+from fluss.progress import ProgressBus, ProgressEvent
+from fluss.scratch import current_job
+from .organizer.targets import (AUDIO_SUFFIXES, PILLOW_SUFFIXES, CopyTarget,
+                                MergeTracksTarget, OrganizeTarget,
+                                TranscodePictureTarget, TranscodeTrackTarget,
+                                _split_name)
+
+_logger = logging.getLogger("fluss.batch")
+
+_COVER_STEMS = ['cover', 'front', 'folder']
+
+def load_recipe(path: Union[str, Path] = None, library: Union[str, Path] = None) -> edict:
+    '''
+    Load batch recipe from YAML or JSON file, missing fields are filled with defaults from config.
+    The config snapshot of the batch is stored as recipe.config.
+
+    :param library: root of the input library, whose .fluss.yaml is layered into the config
+    '''
+    loaded = {}
+    if path:
+        path = Path(path)
+        with path.open("r", encoding="utf-8-sig") as fin:
+            if path.suffix.lower() == ".json":
+                loaded = json.load(fin)
+            else:
+                loaded = yaml.safe_load(fin) or {}
+    config = snapshot(loaded.pop('config', None), library=library)
+
+    recipe = edict(
+        merge=True,
+        audio_codec=config.organizer.output_codec.audio,
+        image_codec=config.organizer.output_codec.image,
+        copy_suffixes=['log', 'txt', 'pdf']
+    )
+    recipe.update(edict(loaded))
+
+    if recipe.audio_codec not in config.audio_codecs:
+        raise ValueError("Unknown audio codec preset: %s" % recipe.audio_codec)
+    codec_t = codec_from_name[config.audio_codecs[recipe.audio_codec].type.lower()]
+    if not codec_t.available(config):
+        raise ValueError("Binaries of audio codec %s are not available: %s" % (recipe.audio_codec, ", ".join(codec_t.binaries)))
+    if recipe.image_codec and recipe.image_codec not in config.image_codecs:
+        raise ValueError("Unknown image codec preset: %s" % recipe.image_codec)
+    recipe.copy_suffixes = [s.lower().lstrip('.') for s in (recipe.copy_suffixes or [])]
+    recipe.config = config
+    return recipe
+
+def find_albums(input_root: Path) -> List[Path]:
+    '''
+    Find folders that directly contain audio files
+    '''
+    albums = set()
+    for dirpath, _, filenames in os.walk(input_root):
+        if any(_split_name(f)[1] in AUDIO_SUFFIXES for f in filenames):
+            albums.add(Path(dirpath))
+    return sorted(albums)
+
+def plan_album(album_dir: Path, recipe: edict) -> List[OrganizeTarget]:
+    '''
+    Generate targets for an album folder according to the recipe
+    '''
+    config = recipe.get('config') # global config is used if the recipe is not loaded by load_recipe
+    files = sorted(p.name for p in album_dir.iterdir() if p.is_file())
+    audio_files = [f for f in files if _split_name(f)[1] in AUDIO_SUFFIXES]
+    cue_files = [f for f in files if _split_name(f)[1] == 'cue']
+    image_files = [f for f in files if _split_name(f)[1] in PILLOW_SUFFIXES]
+
+    targets = []
+    if recipe.merge:
+        inputs = list(audio_files)
+        if len(cue_files) == 1:
+            inputs.append(cue_files[0])
+        covers = [f for f in image_files if _split_name(f)[0].lower() in _COVER_STEMS]
+        if covers:
+            inputs.append(covers[0])
+        targets.append(MergeTracksTarget(inputs, codec=recipe.audio_codec, config=config))
+    else:
+        targets.extend(TranscodeTrackTarget(f, codec=recipe.audio_codec, config=config) for f in audio_files)
+
+    for f in image_files:
+        if recipe.image_codec:
+            targets.append(TranscodePictureTarget(f, codec=recipe.image_codec, config=config))
+        else:
+            targets.append(CopyTarget(f, config=config))
+
+    for f in files:
+        suffix = _split_name(f)[1]
+        if suffix in recipe.copy_suffixes and suffix not in AUDIO_SUFFIXES and suffix not in PILLOW_SUFFIXES:
+            if recipe.merge and suffix == 'cue':
+                continue # cuesheet is embedded into merged image
+            targets.append(CopyTarget(f, config=config))
+
+    return targets
+
+async def _apply_target(target: OrganizeTarget, input_root: Path, output_root: Path,
+                        progress_callback: Callable[[float], None] = None) -> None:
+    output_root.mkdir(parents=True, exist_ok=True)
+    if isinstance(target, MergeTracksTarget) and not target.initialized:
+        await target.load_meta(input_root, output_root)
+    if isinstance(target, (MergeTracksTarget, TranscodeTrackTarget)):
+        await target.apply(input_root, output_root, progress_callback)
+    else:
+        await target.apply(input_root, output_root)
+
+async def run_batch(input_root: Path, output_root: Path, recipe: edict,
+                    jobs: int = None, dry_run: bool = False, retry_failed: bool = False,
+                    queue: JobQueue = None, bus: ProgressBus = None) -> List[Tuple[Path, OrganizeTarget, Exception]]:
+    '''
+    Execute targets of all albums under input_root concurrently. Targets are registered as jobs of the batch
+    identified by output_root, so that an interrupted batch resumes from unfinished targets when it's run again.
+    Targets whose inputs or settings changed since the last run are executed again.
+
+    :param jobs: maximum number of targets executed at the same time, default to number of CPU cores
+    :param retry_failed: give targets that failed in previous runs another attempt
+    :param queue: job queue of the batch, default to the queue given by config
+    :param bus: bus to publish progress of the targets, which are identified by their job keys
+    :return: list of failed targets with their exceptions
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    plan = []
+    for album_dir in find_albums(input_root):
+        album_output = output_root / album_dir.relative_to(input_root)
+        plan.extend((album_dir, album_output, t) for t in plan_album(album_dir, recipe))
+    _logger.info("Planned %d targets under %s", len(plan), str(input_root))
+
+    if dry_run:
+        for album_dir, album_output, target in plan:
+            print("%s: %s" % (album_output, str(target)))
+        return []
+
+    # keys are taken before the metadata of merged albums is loaded, so that they are the same in every run
+    queue = queue if queue is not None else get_job_queue()
+    batch = str(output_root.resolve())
+    keys = []
+    for album_dir, album_output, target in plan:
+        output_file = album_output / target.output_name
+        key = output_file.relative_to(output_root).as_posix()
+        payload = dict(target=repr(target), fingerprint=target.fingerprint(album_dir))
+        job = queue.sync(batch, key, payload=payload, output=output_file)
+        if job.status == DONE and not (job.output and Path(job.output).exists()):
+            queue.add(batch, key, payload=payload, output=output_file, reset=True) # the output has been removed
+        keys.append(key)
+    queue.recover(batch) # only expired leases, other jobs could be running in another worker
+    if retry_failed:
+        queue.retry(batch)
+
+    semaphore = asyncio.Semaphore(jobs)
+    failures = []
+    finished = 0
+
+    async def run(album_dir: Path, album_output: Path, target: OrganizeTarget, key: str):
+        nonlocal finished
+        async with semaphore:
+            job = queue.claim(batch, key=key)
+            if job is not None:
+                current_job.set(key) # account scratch space to the target
+                heartbeat = asyncio.ensure_future(keep_alive(queue, job.id))
+                publish = None
+                if bus is not None:
+                    stage = "encode" if isinstance(target, (MergeTracksTarget, TranscodeTrackTarget)) else "execute"
+                    publish = bus.reporter(key, stage, target.input_size(album_dir))
+                try:
+                    await _apply_target(target, album_dir, album_output, publish)
+                    queue.complete(job.id, album_output / target.output_name)
+                    if publish is not None:
+                        publish(1.)
+                    status = "done"
+                except asyncio.CancelledError:
+                    queue.release(job.id)
+                    raise
+                except Exception as e:
+                    _logger.exception("Target %s in %s failed", repr(target), str(album_dir))
+                    queue.fail(job.id, str(e) or type(e).__name__)
+                    failures.append((album_dir, target, e))
+                    status = "FAILED (%s)" % str(e)
+                finally:
+                    heartbeat.cancel()
+            else:
+                job = queue.find(batch, key)
+                if job.status == DONE:
+                    status = "skipped (done in a previous run)"
+                elif job.status == FAILED:
+                    failures.append((album_dir, target, RuntimeError(job.error)))
+                    status = "FAILED in a previous run (%s)" % job.error
+                else:
+                    status = "skipped (executed by another worker)"
+        finished += 1
+        print("[%d/%d] %s: %s %s" % (finished, len(plan), album_output, str(target), status))
+
+    await asyncio.gather(*[run(*item, key) for item, key in zip(plan, keys)])
+    return failures
+
+def batch_entry(input_dir: str,
+                output_dir: str,
+                recipe: Optional[str] = None,
+                jobs: Optional[int] = None,
+                dry_run: Optional[bool] = False,
+                retry_failed: Optional[bool] = False):
+    '''
+    :param input_dir: Root directory of album folders
+    :param output_dir: Output directory, the folder structure under input_dir will be kept
+    :param recipe: Path to the recipe file (YAML or JSON)
+    :param jobs: Maximum number of concurrent targets, default to the number of CPU cores
+    :param dry_run: Only print the planned targets
+    :param retry_failed: Execute the targets that failed in previous runs again
+    '''
+    # progress of running targets is printed every few seconds, the finished ones are printed by run_batch
+    bus = ProgressBus()
+    def print_progress(event: ProgressEvent):
+        if event.fraction < 1:
+            eta = ", %ds left" % event.eta if event.eta else ""
+            print("  %s: %s %d%%%s" % (event.target, event.stage, int(event.fraction * 100), eta))
+    bus.subscribe(print_progress, interval=5.)
+
+    failures = asyncio.run(run_batch(Path(input_dir), Path(output_dir), load_recipe(recipe, library=input_dir),
+                                     jobs=jobs, dry_run=dry_run, retry_failed=retry_failed, bus=bus))
+    if failures:
+        print("%d targets failed, see log for details" % len(failures))
+        sys.exit(1)
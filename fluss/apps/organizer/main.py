@@ -12,8 +12,14 @@ from typing import Dict, List, Optional
 import yaml
 from addict import Dict as edict
 from dateutil.parser import parse as date_parse
-from fluss.config import global_config
+from fluss.analysis import AudioAnalysis
+from fluss.config import global_config, snapshot
+from fluss.jobs import DONE, FAILED, PENDING, get_job_queue, keep_alive
+from fluss.logs import setup_logging
+from fluss.progress import ProgressBus, ProgressEvent
 from fluss.meta import AlbumMeta, FolderMeta
+from fluss.scheduler import GraphScheduler
+from fluss.scratch import current_job
 from networkx import DiGraph, topological_sort
 from PySide6.QtCore import QModelIndex, QPoint, Qt, QUrl
 from PySide6.QtGui import QAction, QBrush, QDesktopServices, QKeyEvent
@@ -24,7 +30,9 @@ from qasync import QEventLoop, asyncSlot
 
 from . import main_rc
 from .main_ui import Ui_MainWindow
-from .targets import MergeTracksTarget, OrganizeTarget, target_types
+from .manifest import TargetManifest
+from .targets import (MergeTracksTarget, OrganizeTarget, TranscodeTrackTarget,
+                      target_types)
 from .widgets import (PRED_COLOR, USED_COLOR, TargetListModel, _get_icon,
                       editTarget)
 
@@ -71,6 +79,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.btn_del_folder.clicked.connect(self.removeOutputFolder)
         self.btn_reset.clicked.connect(lambda: self.txt_input_path.clear() or self.reset())
         self.btn_apply.clicked.connect(self.applyRequested)
+        self.btn_cancel.clicked.connect(self.cancelRequested)
         self.btn_apply.enterEvent = self.applyButtonEnter
         self.btn_apply.leaveEvent = self.applyButtonLeave
         self.txt_input_path.textChanged.connect(self.inputChanged)
@@ -578,17 +587,33 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.statusbar.showMessage("Starting execution...")
         self._task = asyncio.ensure_future(self.executeTargets())
         self._status_owner = self._task
-        await self._task
-        self._task = None
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+
+    def cancelRequested(self):
+        # running codec processes are killed and partial outputs are removed by the cancelled coroutines
+        if self._task is not None:
+            self.statusbar.showMessage("Cancelling execution...")
+            self._task.cancel()
 
     async def executeTargets(self):
         self._executing = True
+        self.btn_apply.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
 
         files_to_remove = []
         try:
-            # sort targets
-            order = topological_sort(self._network)
-            order = [t for t in order if isinstance(t, OrganizeTarget)]
+            # collect targets, the dependencies between targets are kept in the subgraph
+            graph = self._network.subgraph(t for t in self._network.nodes if isinstance(t, OrganizeTarget))
+
+            # targets are executed with a frozen config, so that editing the config doesn't affect running targets
+            config = snapshot(library=self._input_folder)
+            for target in graph.nodes:
+                target.config = config
 
             # get output folder
             folder_map = {}
@@ -609,25 +634,131 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             # execute targets
             output_path = Path(self.txt_output_path.text(), self.formattedOutputName)
             output_path.mkdir(exist_ok=True, parents=True)
-            for i, target in enumerate(order):
-                self._status_owner = target
-                self.statusbar.showMessage("(%d/%d) Executing: %s" % (i, len(order), str(target)))
-                if isinstance(target, str):
-                    continue
-
+            finished = set()
+            manifest = TargetManifest(output_path)
+
+            # register the targets as jobs, so that the status of a long execution survives restarts
+            queue = get_job_queue()
+            batch = str(output_path)
+            # jobs are reset only if their targets changed, jobs left running are recovered once their lease expires
+            job_keys = {t: "%s/%s" % (folder_map[t], t.output_name) for t in graph.nodes}
+            for target in topological_sort(graph):
+                fingerprint = target.fingerprint(self._input_folder)
+                queue.sync(batch, job_keys[target], payload=dict(target=repr(target), fingerprint=fingerprint),
+                           output=output_path / job_keys[target],
+                           depends=[job_keys[t] for t in graph.predecessors(target)])
+            queue.recover(batch)
+            queue.retry(batch) # applying again is an explicit request to retry failed targets
+
+            # progress of concurrent targets is coalesced by the bus, the status bar is refreshed at most 10 times a second
+            bus = ProgressBus()
+
+            async def run_target(target: OrganizeTarget, progress_callback):
                 output_folder_root = output_path / folder_map[target]
                 output_folder_root.mkdir(exist_ok=True)
-                if isinstance(target, MergeTracksTarget):
-                    await target.apply(self._input_folder, output_folder_root,
-                        lambda q: self.statusbar.showMessage("(%d/%d) Executing: %s (%d%%)" % (i, len(order), str(target), int(q*100))))
+                output_file = output_folder_root / target.output_name
+                current_job.set(repr(target)) # account scratch space to the target
+
+                # skip targets whose output is generated from the same inputs and settings
+                fingerprint = await asyncio.get_running_loop().run_in_executor(
+                    None, target.fingerprint, self._input_folder)
+                job = queue.find(batch, job_keys[target])
+                checks = [name for name, enabled in target.checks().items() if enabled]
+                pending_checks = []
+                if target.temporary:
+                    up_to_date = job.status == DONE and output_file.exists()
                 else:
-                    await target.apply(self._input_folder, output_folder_root)
+                    up_to_date = manifest.is_valid(output_file, fingerprint)
+                if up_to_date and not target.temporary:
+                    # checks enabled since the output was generated are done on the output alone
+                    done_checks = manifest.done_checks(output_file)
+                    pending_checks = [name for name in checks if name not in done_checks]
+                    checks = sorted(done_checks.union(checks))
+                    analysis = manifest.analysis(output_file)
+                    if isinstance(target, MergeTracksTarget) and target._meta.analysis is None and analysis:
+                        target._meta.analysis = AudioAnalysis.from_dict(analysis)
+                if up_to_date and not pending_checks:
+                    _logger.info("Skip %s since the output is up to date", repr(target))
+                    if job.status in (PENDING, FAILED):
+                        queue.complete(job.id, output_file)
+                    return
+                if job.status == DONE: # the output has been removed or modified
+                    queue.add(batch, job.key, payload=job.payload, output=output_file, reset=True)
+
+                job = queue.claim(batch, key=job_keys[target])
+                if job is None:
+                    job = queue.find(batch, job_keys[target])
+                    if job.status == FAILED:
+                        raise RuntimeError("%s has failed after %d attempts: %s" % (str(target), job.attempts, job.error))
+                    raise RuntimeError("%s is being executed by another worker!" % str(target))
+
+                # progress is published with the stage and the processed bytes estimated from the input size
+                audio = isinstance(target, (MergeTracksTarget, TranscodeTrackTarget))
+                stage = "check" if pending_checks else ("encode" if audio else "execute")
+                publish = bus.reporter(target, stage, await asyncio.get_running_loop().run_in_executor(
+                    None, target.input_size, self._input_folder))
+                def report(fraction: float):
+                    progress_callback(fraction)
+                    publish(fraction)
+
+                if not pending_checks:
+                    manifest.discard(output_file)
+                heartbeat = asyncio.ensure_future(keep_alive(queue, job.id))
+                try:
+                    if pending_checks:
+                        _logger.info("Checking (%s) the output of %s", ", ".join(pending_checks), repr(target))
+                        await target.apply_checks(self._input_folder, output_folder_root, pending_checks, report)
+                    elif audio:
+                        await target.apply(self._input_folder, output_folder_root, report)
+                    else:
+                        await target.apply(self._input_folder, output_folder_root)
+                except asyncio.CancelledError:
+                    queue.release(job.id) # cancelled jobs are put back to the queue
+                    raise
+                except BaseException as e:
+                    queue.fail(job.id, str(e) or type(e).__name__)
+                    raise
+                finally:
+                    heartbeat.cancel()
+                queue.complete(job.id, output_file)
+                publish(1.)
 
                 if target.temporary:
-                    files_to_remove.append(output_folder_root / target.output_name)
+                    files_to_remove.append(output_file)
+                else:
+                    analysis = None
+                    if isinstance(target, MergeTracksTarget) and target._meta.analysis is not None:
+                        analysis = target._meta.analysis.to_dict()
+                    manifest.record(output_file, fingerprint, checks, analysis)
+                    manifest.save()
+
+            def report_progress(target: OrganizeTarget, progress: float, total: float):
+                if progress >= 1:
+                    finished.add(target)
+
+            def show_progress(event: ProgressEvent):
+                self._status_owner = event.target
+                processed = ", %.1f MB" % (event.bytes / 2 ** 20) if event.bytes else ""
+                eta = ", %ds left" % event.eta if event.eta else ""
+                self.statusbar.showMessage("(%d/%d) %s: %s (%d%%%s%s), total %d%%" % (
+                    len(finished), len(graph), event.stage.capitalize(), str(event.target),
+                    int(event.fraction*100), processed, eta, int(scheduler.progress*100)))
+
+            scheduler = GraphScheduler(graph, run_target,
+                max_workers=global_config.organizer.max_workers,
+                progress_callback=report_progress)
+            unsubscribe = bus.subscribe(show_progress, interval=0.1)
+            try:
+                await scheduler.run()
+            finally:
+                unsubscribe()
 
-            # create meta.yaml
+            # create meta.yaml, with analysis results of the audio if available
             meta_dict = self._meta.to_dict()
+            for target, folder in folder_map.items():
+                if isinstance(target, MergeTracksTarget) and target._meta.analysis is not None:
+                    folder_dict = meta_dict.setdefault(folder, dict())
+                    folder_dict.setdefault('analysis', dict())[target.output_name] = target._meta.analysis.to_dict()
             with Path(output_path, "meta.yaml").open("w", encoding="utf-8-sig") as fout:
                 yaml.dump(meta_dict, fout, encoding="utf-8", allow_unicode=True)
 
@@ -646,12 +777,19 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
             self.statusbar.showMessage("Organizing failed!")
 
+        except asyncio.CancelledError:
+            _logger.info("Pipeline execution cancelled")
+            self.statusbar.showMessage("Organizing cancelled!")
+            raise
+
         finally:
             # clean up
             for f in files_to_remove:
-                f.unlink()
+                f.unlink(missing_ok=True)
             self._status_owner = None
             self._executing = False
+            self.btn_apply.setEnabled(True)
+            self.btn_cancel.setEnabled(False)
 
 def register_context_menu(uninstall: bool = False):
     import distutils.sysconfig, winreg
@@ -677,6 +815,7 @@ def entry_with_args(initial_dir: Optional[str] = None,
     :param install_context: Install the organizer in right click context menu (Windows)
     :param uninstall_context: Uninstall the organizer in right click context menu (Windows)
     '''
+    setup_logging()
     if install_context:
         register_context_menu()
     elif uninstall_context:
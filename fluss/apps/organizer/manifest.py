@@ -0,0 +1,79 @@
+'''
+Manifest of executed targets in an output folder, so that targets whose inputs and settings are not changed
+since the last execution can be skipped (like make).
+'''
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Set, Union
+
+_logger = logging.getLogger("fluss.organizer")
+
+class TargetManifest:
+    '''
+    Record fingerprints of targets along with the state of their outputs. An output is valid if it still has
+    the size and modification time recorded when it was generated. The checks done on the output (see
+    OrganizeTarget.checks) and the analysis of audio are recorded separately, since they don't change the audio.
+    '''
+    filename = ".fluss_manifest.json"
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self._root = Path(root)
+        self._path = self._root / self.filename
+        self._records = {}
+        if self._path.exists():
+            try:
+                self._records = json.loads(self._path.read_text(encoding="utf-8"))
+            except (ValueError, OSError) as e:
+                _logger.warning("Failed to load manifest %s (%s), all targets will be executed", str(self._path), e)
+
+    def _key(self, output: Union[str, Path]) -> str:
+        return Path(output).relative_to(self._root).as_posix()
+
+    def is_valid(self, output: Union[str, Path], fingerprint: Optional[str]) -> bool:
+        ''' whether the output exists and was generated by a target with the same fingerprint '''
+        if fingerprint is None:
+            return False
+        record = self._records.get(self._key(output))
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+        try:
+            stat = os.stat(output)
+        except OSError:
+            return False
+        return stat.st_size == record['size'] and stat.st_mtime_ns == record['mtime_ns']
+
+    def done_checks(self, output: Union[str, Path]) -> Set[str]:
+        ''' names of the checks done on the recorded output '''
+        record = self._records.get(self._key(output))
+        return set(record.get('checks', [])) if record else set()
+
+    def analysis(self, output: Union[str, Path]) -> Optional[dict]:
+        ''' analysis of the recorded output, as saved by AudioAnalysis.to_dict '''
+        record = self._records.get(self._key(output))
+        return record.get('analysis') if record else None
+
+    def record(self, output: Union[str, Path], fingerprint: Optional[str],
+               checks: Iterable[str] = (), analysis: dict = None) -> None:
+        ''' record a generated output with the checks done on it, the record is removed if the fingerprint is unknown '''
+        key = self._key(output)
+        if fingerprint is None:
+            self._records.pop(key, None)
+            return
+        stat = os.stat(output)
+        record = dict(fingerprint=fingerprint, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        if checks:
+            record['checks'] = sorted(checks)
+        if analysis is not None:
+            record['analysis'] = analysis
+        self._records[key] = record
+
+    def discard(self, output: Union[str, Path]) -> None:
+        self._records.pop(self._key(output), None)
+
+    def save(self) -> None:
+        tmp = self._path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._records, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self._path)
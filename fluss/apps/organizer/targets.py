@@ -1,19 +1,25 @@
 import asyncio
+import hashlib
+import json
+import os
 from pathlib import Path, PurePath
-from typing import Callable, List, Union
+from typing import Callable, Dict, List, Optional, Union
 from io import BytesIO
 from shutil import copy2 as copy
 from PIL import Image
 import traceback
+import logging
 
-from PySide6.QtWidgets import QMessageBox
 from fluss import codecs
 
-from fluss.config import global_config
+from fluss.config import ConfigSnapshot, global_config
 from fluss.codecs import codec_from_filename, codec_from_name
-from fluss.meta import DiscMeta
+from fluss.cuesheet import Cuesheet
+from fluss.meta import DiscMeta, TrackMeta
 from fluss.utils import merge_tracks, convert_track
-from fluss.accurip import verify_accurip, parse_accurip
+from fluss.accurip import get_accurip_cache, verify_accurip_cached
+
+_logger = logging.getLogger("fluss.organizer")
 
 # readable suffixes supported by pillow
 PILLOW_SUFFIXES = ['png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif']
@@ -28,12 +34,14 @@ AUDIO_SUFFIXES = set(c.suffix for c in codec_from_name.values())
 class OrganizeTarget:
     description = "Target"
 
-    def __init__(self, input_files: List[Union[str, "OrganizeTarget"]]) -> None:
+    def __init__(self, input_files: List[Union[str, "OrganizeTarget"]], config: ConfigSnapshot = None) -> None:
         if not isinstance(input_files, list):
             self._input = [input_files]
         else:
             self._input = input_files
         self.temporary = False
+        self.config = config if config is not None else global_config
+        ''' config used when the target is executed, a snapshot should be assigned for each execution '''
 
     def switch_temporary(self, value: bool = None) -> None:
         if value is None:
@@ -54,6 +62,58 @@ class OrganizeTarget:
         ''' output file name'''
         raise NotImplementedError("Abstract property!")
 
+    def _fingerprint_settings(self) -> list:
+        ''' settings that affect the output besides the input files, they should be serializable as JSON '''
+        return []
+
+    def checks(self) -> Dict[str, bool]:
+        ''' checks of the output enabled in the config, they are not in the fingerprint since they can be done
+        again by :meth:`apply_checks` without generating the output '''
+        return {}
+
+    async def apply_checks(self, input_root: Path, output_root: Path, checks: List[str],
+                           progress_callback: Callable[[float], None] = None) -> None:
+        ''' do the given checks on the existing output '''
+        raise NotImplementedError("Abstract function!")
+
+    def fingerprint(self, input_root: Path) -> Optional[str]:
+        '''
+        Fingerprint of the input files (size and modification time), upstream targets and the settings of
+        this target. None is returned if any input file is missing.
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        settings = [type(self).__name__, self.output_name, self._fingerprint_settings()]
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        for source in self._input:
+            if isinstance(source, OrganizeTarget):
+                upstream = source.fingerprint(input_root)
+                if upstream is None:
+                    return None
+                digest.update(upstream.encode())
+            else:
+                try:
+                    stat = os.stat(Path(input_root, source))
+                except OSError:
+                    return None
+                digest.update(f"{source}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+        return digest.hexdigest()
+
+    def input_size(self, input_root: Path) -> Optional[int]:
+        ''' total size of the input files including those of upstream targets, None if any of them is missing '''
+        total = 0
+        for source in self._input:
+            if isinstance(source, OrganizeTarget):
+                size = source.input_size(input_root)
+                if size is None:
+                    return None
+                total += size
+            else:
+                try:
+                    total += os.path.getsize(Path(input_root, source))
+                except OSError:
+                    return None
+        return total
+
     async def apply_stream(self, input_root: Path = None, output_root: Path = None) -> BytesIO:
         ''' execute target to BytesIO
         Should return the generated binary data
@@ -70,6 +130,13 @@ class OrganizeTarget:
         Path(output_root, self.output_name).write_bytes(data.getvalue())
 
 
+def _audio_settings(config: ConfigSnapshot, codec: str) -> list:
+    ''' settings that change the encoded audio, for fingerprints of audio targets '''
+    return [config.audio_codecs[codec], config.pipeline.dsd_pcm_rate]
+
+def _audio_checks(config: ConfigSnapshot) -> Dict[str, bool]:
+    return dict(analyze=config.pipeline.analyze, verify=config.pipeline.verify)
+
 def _split_name(target: Union[str, OrganizeTarget]):
     if isinstance(target, str):
         name = PurePath(target).name
@@ -87,8 +154,8 @@ def _split_name(target: Union[str, OrganizeTarget]):
 class CopyTarget(OrganizeTarget):    
     description = "Copy"
 
-    def __init__(self, input_files):
-        super().__init__(input_files)
+    def __init__(self, input_files, config: ConfigSnapshot = None):
+        super().__init__(input_files, config)
         assert len(self._input) == 1, "CopyTarget only accept one input!"
 
         stem, suffix = _split_name(self._input[0])
@@ -120,13 +187,13 @@ class TranscodeTrackTarget(OrganizeTarget):
     ''' Support recoding single audio files '''
     description = "Transcode Tracks"
 
-    def __init__(self, input_files, codec=global_config.organizer.output_codec.audio):
-        super().__init__(input_files)
+    def __init__(self, input_files, codec=None, config: ConfigSnapshot = None):
+        super().__init__(input_files, config)
 
-        if codec in global_config.audio_codecs:
+        if codec in self.config.audio_codecs:
             self._codec = codec
         else:
-            self._codec = global_config.organizer.output_codec.audio
+            self._codec = self.config.organizer.output_codec.audio
 
         if isinstance(self._input[0], str):
             self._outstem = PurePath(self._input[0]).stem
@@ -147,7 +214,7 @@ class TranscodeTrackTarget(OrganizeTarget):
     @property
     def output_name(self):
         fname = self._outstem
-        codec_cls = codec_from_name[global_config.audio_codecs[self._codec].type.lower()]
+        codec_cls = codec_from_name[self.config.audio_codecs[self._codec].type.lower()]
         return fname + "." + codec_cls.suffix
 
     def __str__(self):
@@ -156,12 +223,32 @@ class TranscodeTrackTarget(OrganizeTarget):
     def __repr__(self):
         return "<TranscodeTrackTarget output=%s>" % self.output_name
 
+    def _fingerprint_settings(self):
+        return _audio_settings(self.config, self._codec)
+
+    def checks(self):
+        return _audio_checks(self.config)
+
     async def apply(self, input_root, output_root, progress_callback: Callable[[float], None] = None):
         await convert_track(
             Path(input_root, self._input[0]),
             Path(output_root, self.output_name),
             codec_out=self._codec,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            streaming=self.config.pipeline.streaming,
+            config=self.config
+        )
+
+    async def apply_checks(self, input_root, output_root, checks, progress_callback: Callable[[float], None] = None):
+        await convert_track(
+            Path(input_root, self._input[0]),
+            Path(output_root, self.output_name),
+            codec_out=self._codec,
+            progress_callback=progress_callback,
+            analyze="analyze" in checks,
+            verify="verify" in checks,
+            check_only=True,
+            config=self.config
         )
 
 
@@ -172,14 +259,14 @@ class MergeTracksTarget(OrganizeTarget):
     description = "Merge Tracks"
     _meta: DiscMeta
 
-    def __init__(self, input_files, codec=global_config.organizer.output_codec.audio):
-        super().__init__(input_files)
+    def __init__(self, input_files, codec=None, config: ConfigSnapshot = None):
+        super().__init__(input_files, config)
 
         self._outstem = "" # empty means using default name
-        if codec in global_config.audio_codecs:
+        if codec in self.config.audio_codecs:
             self._codec = codec
         else:
-            self._codec = global_config.organizer.output_codec.audio
+            self._codec = self.config.organizer.output_codec.audio
 
         self._tracks, self._cue, self._cover, unknown_files = MergeTracksTarget._sort_files(input_files)
         if len(unknown_files) > 0:
@@ -238,6 +325,57 @@ class MergeTracksTarget(OrganizeTarget):
     def initialized(self):
         return self._meta is not None
 
+    @staticmethod
+    def _tag_from_source(source, input_root):
+        if isinstance(source, str):
+            cls_codec = codec_from_filename(source)
+            return cls_codec.mutagen(Path(input_root, source))
+        else:
+            assert len(source._input) == 1 and isinstance(source._input[0], str), "Cannot parse tags from complex target"
+            cls_codec = codec_from_filename(source._input[0])
+            return cls_codec.mutagen(Path(input_root, source._input[0]))
+
+    async def load_meta(self, input_root: Path, output_root: Path = None) -> DiscMeta:
+        '''
+        Extract disc metadata from the cuesheet and the tags of input tracks.
+        UnicodeDecodeError will be raised if the cuesheet cannot be decoded.
+        '''
+        meta = DiscMeta()
+        if self._cue:
+            if isinstance(self._cue, str):
+                cs = Cuesheet.from_file(Path(input_root, self._cue))
+            else: # isinstance(self._cue, OrganizeTarget):
+                assert isinstance(self._cue, (CopyTarget, TranscodeTextTarget))
+                cs = await self._cue.apply_stream(input_root, output_root)
+                cs = Cuesheet.parse(cs.getvalue().decode('utf-8-sig'))
+            meta.update(DiscMeta.from_cuesheet(cs))
+            meta.cuesheet = cs
+
+        cue_from_file = False
+        for i, track in enumerate(self._tracks):
+            # Extract cuesheet
+            file_tags = self._tag_from_source(track, input_root)
+            cs = Cuesheet.from_mutagen(file_tags)
+            if cs:
+                if cue_from_file:
+                    raise ValueError("Multiple built-in cuesheet found!")
+                meta.update(DiscMeta.from_cuesheet(cs))
+                meta.cuesheet = cs
+                cue_from_file = True
+
+            # Extract other files
+            if not meta.cuesheet:
+                new_meta = DiscMeta.from_mutagen(file_tags)
+                meta.update(new_meta)
+                if not new_meta.tracks or all(t is None for t in new_meta.tracks):
+                    # assume track number by input order
+                    meta._reserve_tracks(i)
+                    meta.update_track(i, TrackMeta.from_mutagen(file_tags))
+            # XXX: we might want to include tags when cuesheet tells nothing
+
+        self._meta = meta
+        return meta
+
     @classmethod
     def validate(cls, input_files):
         track_files, _, _, unknown_files = MergeTracksTarget._sort_files(input_files)
@@ -254,7 +392,7 @@ class MergeTracksTarget(OrganizeTarget):
     @property
     def output_name(self):
         fname = self._outstem or self._default_output_name()
-        codec_cls = codec_from_name[global_config.audio_codecs[self._codec].type.lower()]
+        codec_cls = codec_from_name[self.config.audio_codecs[self._codec].type.lower()]
         return fname + "." + codec_cls.suffix
 
     def __str__(self):
@@ -266,7 +404,17 @@ class MergeTracksTarget(OrganizeTarget):
     def __repr__(self):
         return "<MergeTracksTarget output=%s>" % self.output_name
 
-    async def apply(self, input_root, output_root, progress_callback: Callable[[float], None] = None):
+    def _fingerprint_settings(self):
+        meta = None
+        if self._meta is not None:
+            meta = [str(self._meta), self._meta.discnumber, self._meta.partnumber,
+                    str(self._meta.cuesheet) if self._meta.cuesheet else None]
+        return _audio_settings(self.config, self._codec) + [meta]
+
+    def checks(self):
+        return _audio_checks(self.config)
+
+    async def apply(self, input_root, output_root, progress_callback: Callable[[float], None] = None, **kwargs):
         if self._cover:
             if isinstance(self._cover, str):
                 cover_path = Path(input_root, self._cover)
@@ -282,7 +430,10 @@ class MergeTracksTarget(OrganizeTarget):
                 Path(output_root, self.output_name),
                 meta=self._meta,
                 codec_out=self._codec,
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                streaming=self.config.pipeline.streaming,
+                config=self.config,
+                **kwargs
             )
         else:
             await merge_tracks(
@@ -290,9 +441,16 @@ class MergeTracksTarget(OrganizeTarget):
                 Path(output_root, self.output_name),
                 meta=self._meta,
                 codec_out=self._codec,
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                config=self.config,
+                **kwargs
             )
 
+    async def apply_checks(self, input_root, output_root, checks, progress_callback: Callable[[float], None] = None):
+        # tags are written again after the analysis, so the cover is loaded as well
+        await self.apply(input_root, output_root, progress_callback,
+                         analyze="analyze" in checks, verify="verify" in checks, check_only=True)
+
     async def apply_stream(self, input_root, output_root):
         # could apply and then read
         raise NotImplementedError()
@@ -303,8 +461,8 @@ class TranscodeTextTarget(OrganizeTarget):
     valid_encodings = ['utf-8-sig', 'gbk', 'big5', 'shift_jis', 'utf-16-le', 'utf-16-be', 'big5hkscs', 'euc_jp']
     valid_file_types = ['txt', 'log', 'cue']
 
-    def __init__(self, input_files, encoding="utf-8-sig"):
-        super().__init__(input_files)
+    def __init__(self, input_files, encoding="utf-8-sig", config: ConfigSnapshot = None):
+        super().__init__(input_files, config)
         if encoding in self.valid_encodings:
             self._encoding = encoding
         else:
@@ -337,16 +495,19 @@ class TranscodeTextTarget(OrganizeTarget):
     def __repr__(self):
         return "<TranscodeTextTarget output=%s>" % self.output_name
 
+    def _fingerprint_settings(self):
+        return [self._encoding]
+
 class TranscodePictureTarget(OrganizeTarget):
     ''' Support transcoding '''
     description = "Transcode Image"
 
-    def __init__(self, input_files, codec=global_config.organizer.output_codec.image):
-        super().__init__(input_files)
-        if codec in global_config.image_codecs:
+    def __init__(self, input_files, codec=None, config: ConfigSnapshot = None):
+        super().__init__(input_files, config)
+        if codec in self.config.image_codecs:
             self._codec = codec
         else:
-            self._codec = global_config.organizer.output_codec.image
+            self._codec = self.config.organizer.output_codec.image
         assert len(self._input) == 1, "CopyTarget only accept one input!"
 
         if isinstance(self._input[0], str):
@@ -358,7 +519,7 @@ class TranscodePictureTarget(OrganizeTarget):
 
     @property
     def output_name(self):
-        suffix = _image_suffix_from_format[global_config.image_codecs[self._codec].type]
+        suffix = _image_suffix_from_format[self.config.image_codecs[self._codec].type]
         return self._outstem + "." + suffix
 
     @classmethod
@@ -384,24 +545,30 @@ class TranscodePictureTarget(OrganizeTarget):
     def __repr__(self):
         return "<TranscodePictureTarget output=%s>" % self.output_name
 
-    async def apply_stream(self, input_root, output_root):
-        im = Image.open(Path(input_root, self._input[0]))
+    def _fingerprint_settings(self):
+        return [self.config.image_codecs[self._codec]]
 
+    async def apply_stream(self, input_root, output_root):
         buf = BytesIO()
-        codec = dict(global_config.image_codecs[self._codec])
-        format = codec.pop('type')
+        def task(): # prevent image coding from blocking main thread
+            im = Image.open(Path(input_root, self._input[0]))
 
-        im = self.convert_if_necessary(im, format)
-        im.save(buf, format=format, **codec)
-        buf.seek(0)
+            codec = dict(self.config.image_codecs[self._codec])
+            format = codec.pop('type')
+
+            im = self.convert_if_necessary(im, format)
+            im.save(buf, format=format, **codec)
+            buf.seek(0)
+
+        await asyncio.get_running_loop().run_in_executor(None, task)
         return buf
 
 class CropPictureTarget(TranscodePictureTarget):
     ''' Support cover cropping '''
     description = "Crop Image"
 
-    def __init__(self, input_files, codec="jpg"):
-        super().__init__(input_files, codec)
+    def __init__(self, input_files, codec="jpg", config: ConfigSnapshot = None):
+        super().__init__(input_files, codec, config)
         self._outstem = "cover" # default name is cover
         self._centerx = None
         self._centery = None
@@ -425,7 +592,7 @@ class CropPictureTarget(TranscodePictureTarget):
                 self._centerx + scaled_size/2, self._centery + scaled_size/2], fillcolor=(255,255,255), resample=Image.BICUBIC)
             im = im.resize((self._output_size, self._output_size), resample=Image.BICUBIC)
 
-            codec = dict(global_config.image_codecs[self._codec])
+            codec = dict(self.config.image_codecs[self._codec])
             format = codec.pop('type')
 
             im = self.convert_if_necessary(im, format)
@@ -441,12 +608,16 @@ class CropPictureTarget(TranscodePictureTarget):
     def __repr__(self):
         return "<CropPictureTarget output=%s>" % self.output_name
 
+    def _fingerprint_settings(self):
+        return super()._fingerprint_settings() + [self._centerx, self._centery, self._scale,
+                                                  self._rotation, self._output_size]
+
 class VerifyAccurateRipTarget(OrganizeTarget):
     ''' Support cover cropping '''
     description = "Verify with AccurateRip"
 
-    def __init__(self, input_files: List[Union[str, OrganizeTarget]]) -> None:
-        super().__init__(input_files)
+    def __init__(self, input_files: List[Union[str, OrganizeTarget]], config: ConfigSnapshot = None) -> None:
+        super().__init__(input_files, config)
         assert len(self._input) == 1, "CopyTarget only accept one input!"
 
         if isinstance(self._input[0], str):
@@ -480,17 +651,29 @@ class VerifyAccurateRipTarget(OrganizeTarget):
             cdfile = Path(output_root, self._input[0].output_name)
         else:
             cdfile = Path(input_root, self._input[0])
-        results = await verify_accurip(cdfile)
-
-        parsed = parse_accurip(results)
-        if parsed.fail:
-            msgbox = QMessageBox()
-            msgbox.setWindowTitle("Verify failed")
-            msgbox.setIcon(QMessageBox.Critical)
-            msgbox.setText("AccurateRip verification failed! Please check the output file " + str(Path(output_root, self.output_name)))
-            msgbox.exec_()
-
-        return BytesIO(results)
+        result = await verify_accurip_cached(cdfile, get_accurip_cache())
+        get_accurip_cache().save()
+
+        if result.fail:
+            _logger.error("AccurateRip verification of %s failed", str(cdfile))
+            _show_verify_failure(Path(output_root, self.output_name))
+
+        return BytesIO(result.log.encode())
+
+def _show_verify_failure(log_path: Path) -> None:
+    ''' notify verification failure with a dialog if running in GUI '''
+    try:
+        from PySide6.QtWidgets import QApplication, QMessageBox
+    except ImportError:
+        return
+    if QApplication.instance() is None:
+        return
+
+    msgbox = QMessageBox()
+    msgbox.setWindowTitle("Verify failed")
+    msgbox.setIcon(QMessageBox.Critical)
+    msgbox.setText("AccurateRip verification failed! Please check the output file " + str(log_path))
+    msgbox.exec_()
 
 target_types = [
     CopyTarget,
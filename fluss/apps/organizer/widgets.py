@@ -753,62 +753,18 @@ async def editMergeTracksTarget(self: MergeTracksTarget, input_root: Path = None
     layout.cbox_suffix.addItems(codecs_names)
     layout.cbox_suffix.setCurrentIndex(codecs_list.index(self._codec))
 
-    # util for extract tag
-    def tag_from_source(source):
-        if isinstance(source, str):
-            cls_codec = codec_from_filename(input_root / source)
-            return cls_codec.mutagen(input_root / source)
-        else:
-            assert isinstance(source._input, str), "Cannot parse tags from complex target"
-            cls_codec = codec_from_filename(input_root / source._input)
-            return cls_codec.mutagen(input_root / source)
-
     # extract disc meta if first time
     if self._meta is None:
-        self._meta = DiscMeta()
-        if self._cue:
-            if isinstance(self._cue, str):
-                try:
-                    cs = Cuesheet.from_file(input_root / self._cue)
-                except UnicodeDecodeError as e:
-                    _logger.error("Cuesheet decoding failed!")
-                    msgbox = QMessageBox()
-                    msgbox.setWindowTitle("Cuesheet decoding failed!")
-                    msgbox.setIcon(QMessageBox.Critical)
-                    msgbox.setText("Failed to decode cuesheet (reason: %s), please use TranscodeTextTarget to fix encoding first!" % str(e))
-                    msgbox.exec_()
-
-                    # reset
-                    self._meta = None
-                    return
-            else: # isinstance(self._cue, OrganizeTarget):
-                assert isinstance(self._cue, (CopyTarget, TranscodeTextTarget))
-                cs = await self._cue.apply_stream(input_root, output_root)
-                cs = Cuesheet.parse(cs.getvalue().decode('utf-8-sig'))
-            self._meta.update(DiscMeta.from_cuesheet(cs))
-            self._meta.cuesheet = cs
-
-        cue_from_file = False
-        for i, track in enumerate(self._tracks):
-            # Extract cuesheet
-            file_tags = tag_from_source(track)
-            cs = Cuesheet.from_mutagen(file_tags)
-            if cs:
-                if cue_from_file:
-                    raise ValueError("Multiple built-in cuesheet found!")
-                self._meta.update(DiscMeta.from_cuesheet(cs))
-                self._meta.cuesheet = cs
-                cue_from_file = True
-
-            # Extract other files
-            if not self._meta.cuesheet:
-                new_meta = DiscMeta.from_mutagen(file_tags)
-                self._meta.update(new_meta)
-                if not new_meta.tracks or all(t is None for t in new_meta.tracks):
-                    # assume track number by input order
-                    self._meta._reserve_tracks(i)
-                    self._meta.update_track(i, TrackMeta.from_mutagen(file_tags))
-            # XXX: we might want to include tags when cuesheet tells nothing
+        try:
+            await self.load_meta(input_root, output_root)
+        except UnicodeDecodeError as e:
+            _logger.error("Cuesheet decoding failed!")
+            msgbox = QMessageBox()
+            msgbox.setWindowTitle("Cuesheet decoding failed!")
+            msgbox.setIcon(QMessageBox.Critical)
+            msgbox.setText("Failed to decode cuesheet (reason: %s), please use TranscodeTextTarget to fix encoding first!" % str(e))
+            msgbox.exec_()
+            return
 
     # fill table content
     layout.txt_album_artists.setText("; ".join(self._meta.artists))
@@ -818,7 +774,7 @@ async def editMergeTracksTarget(self: MergeTracksTarget, input_root: Path = None
 
     # set up model
     meta_copy = self._meta.copy()
-    track_lengths = [tag_from_source(track).info.length for track in self._tracks]
+    track_lengths = [self._tag_from_source(track, input_root).info.length for track in self._tracks]
     table_model = TrackTableModel(layout.table_tracks, meta_copy, self._tracks, track_lengths)
     layout.table_tracks.setModel(table_model)
     layout.table_tracks.setStyle(TableRowMarkerStyle())
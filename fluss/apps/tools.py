@@ -0,0 +1,22 @@
+'''
+Report codec binaries available on this host, so that workers of a cluster can be matched with jobs
+they are able to execute.
+'''
+
+import json
+import sys
+from typing import Optional
+
+from fluss.tools import get_tool_registry
+
+def tools_entry(output: Optional[str] = None):
+    '''
+    :param output: Path to write the JSON report, print to stdout if not specified
+    '''
+    capabilities = get_tool_registry().capabilities()
+    if output:
+        with open(output, "w", encoding="utf-8") as fout:
+            json.dump(capabilities, fout, indent=2)
+    else:
+        json.dump(capabilities, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,62 @@
+'''
+Headless AccurateRip verification of disc images. Results are cached by content, so that unchanged
+images are not verified again, and a JSON summary is written for further processing.
+'''
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from fluss.accurip import get_accurip_cache, verify_accurip_batch
+from fluss.config import global_config
+from .organizer.targets import AUDIO_SUFFIXES, _split_name
+
+def find_images(inputs: List[Path]) -> List[Path]:
+    '''
+    Collect files to be verified. In each folder, cuesheets are verified if there are any,
+    otherwise audio files are regarded as images with embedded cuesheet.
+    '''
+    images = []
+    for path in inputs:
+        if path.is_file():
+            images.append(path)
+            continue
+
+        for dirpath, _, filenames in os.walk(path):
+            cues = [f for f in filenames if _split_name(f)[1] == 'cue']
+            if not cues:
+                cues = [f for f in filenames if _split_name(f)[1] in AUDIO_SUFFIXES]
+            images.extend(Path(dirpath, f) for f in sorted(cues))
+    return images
+
+def verify_entry(*inputs: str,
+                 jobs: Optional[int] = None,
+                 output: Optional[str] = None,
+                 no_cache: Optional[bool] = False):
+    '''
+    :param inputs: Images, cuesheets or folders containing them
+    :param jobs: Maximum number of concurrent verifications, default to accurip.max_workers in config
+    :param output: Path to write the JSON summary, print to stdout if not specified
+    :param no_cache: Verify all images again without looking up cached results
+    '''
+    images = find_images([Path(p) for p in inputs])
+    cache = None if no_cache else get_accurip_cache()
+    progress = lambda finished, total: print("[%d/%d] verified" % (finished, total), file=sys.stderr)
+    summary = asyncio.run(verify_accurip_batch(images,
+        max_workers=jobs or global_config.accurip.max_workers,
+        cache=cache, progress_callback=progress))
+
+    if output:
+        with Path(output).open("w", encoding="utf-8") as fout:
+            json.dump(summary, fout, indent=2, ensure_ascii=False)
+    else:
+        json.dump(summary, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    print("%d passed, %d failed, %d errors (%d cached)" % (summary["passed"], summary["failed"],
+          summary["errors"], summary["cached"]), file=sys.stderr)
+    if summary["failed"] or summary["errors"]:
+        sys.exit(1)
@@ -0,0 +1,140 @@
+'''
+On-disk cache of decoded PCM, so that re-running a pipeline doesn't decode the same sources again.
+'''
+
+import hashlib
+import logging
+import os
+import random
+import wave
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from fluss.config import global_config
+
+_logger = logging.getLogger("fluss.cache")
+
+_HASH_CHUNK = 2 ** 20
+_content_digests: Dict[Tuple[str, int, int], str] = {}
+
+def hash_file(path: Union[str, Path]) -> str:
+    '''
+    Hash the content of a file. Digests are memoized by path, size and mtime within the process
+    '''
+    path = Path(path).resolve()
+    st = path.stat()
+    memo_key = (str(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _content_digests:
+        digest = hashlib.blake2b(digest_size=20)
+        with path.open("rb") as fin:
+            while True:
+                chunk = fin.read(_HASH_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        _content_digests[memo_key] = digest.hexdigest()
+    return _content_digests[memo_key]
+
+class DecodeCache:
+    '''
+    Decoded wave files keyed by the source path, size, mtime and content hash. Least recently used
+    entries are evicted when the total size exceeds max_size.
+    '''
+    suffix = ".wav"
+
+    def __init__(self, root: Union[str, Path], max_size: int) -> None:
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+
+    def key(self, source: Union[str, Path]) -> str:
+        source = Path(source).resolve()
+        st = source.stat()
+        identity = "%s|%d|%d|%s" % (source, st.st_size, st.st_mtime_ns, hash_file(source))
+        return hashlib.blake2b(identity.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self._root / (key + self.suffix)
+
+    def get(self, key: str) -> Optional[Path]:
+        '''
+        Return path to the cached wave file, or None if missed
+        '''
+        path = self._path(key)
+        try:
+            os.utime(path) # mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, wave_in: wave.Wave_read) -> Path:
+        '''
+        Store the frames of a wave stream into the cache. The stream is consumed and closed
+        '''
+        from fluss.codecs import merge_streams
+        from fluss.pcm import MappedPCM
+
+        path = self._path(key)
+        tmp = self._root / ("%s.%x.tmp" % (key, random.getrandbits(32)))
+        try:
+            linked = False
+            if isinstance(wave_in, MappedPCM):
+                try: # the decoded file can be stored without copying if it's on the same volume
+                    os.link(wave_in.path, tmp)
+                    linked = True
+                    wave_in.close()
+                except OSError:
+                    pass
+            if not linked:
+                with tmp.open("wb") as fout:
+                    merge_streams([wave_in], fout)
+            os.replace(tmp, path) # atomic if the same source is decoded concurrently
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Path = None) -> None:
+        '''
+        Remove least recently used entries until the cache fits in the size budget
+
+        :param keep: entry that should not be evicted, usually the one just stored
+        '''
+        entries = []
+        for path in self._root.glob("*" + self.suffix):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+                total -= size
+                _logger.debug("Evicted %s from decode cache", path.name)
+            except OSError: # file could be in use on Windows
+                pass
+
+_decode_cache = None
+
+def get_decode_cache() -> Optional[DecodeCache]:
+    '''
+    Get the decode cache configured by decode_cache in global config, None if disabled
+    '''
+    global _decode_cache
+    if global_config.decode_cache.max_size <= 0:
+        return None
+
+    root = global_config.decode_cache.path or Path("~/.cache/fluss/decode").expanduser()
+    if _decode_cache is None or _decode_cache._root != Path(root):
+        _decode_cache = DecodeCache(root, global_config.decode_cache.max_size)
+    _decode_cache._max_size = global_config.decode_cache.max_size
+    return _decode_cache
@@ -1,39 +1,55 @@
 '''
-async decoding will use temp file to store results first due to performance issue of Python pipe and qasync (see https://github.com/CabbageDevelopment/qasync/issues/43)
+async decoding doesn't use asyncio pipes due to performance issue of Python pipe and qasync
+(see https://github.com/CabbageDevelopment/qasync/issues/43). If pipeline.transport is "pipe" and the codec supports
+pipes, decoded streams are read from the decoder through bounded buffers pumped on background threads (see
+fluss.transport), otherwise the decoders write temp files in the scratch space
 '''
 
+from __future__ import annotations
+
 # TODO: check return code for all encoders
 
 import asyncio
+import hashlib
 import io
+import os
 import stat
+import struct
 import re
+import signal
 import subprocess
 import wave
-import tempfile
 from tempfile import TemporaryDirectory, TemporaryFile
 from pathlib import Path
-from typing import Any, Callable, List, Type, Union, Coroutine
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, List, Optional, Tuple, Type, Union, Coroutine
 import logging
-import random
 
 _logger = logging.getLogger("fluss")
 
-import mutagen
-import mutagen.flac
-import mutagen.wave
-import mutagen.wavpack
-import mutagen.monkeysaudio
-import mutagen.trueaudio
-import mutagen.tak
-import mutagen.mp4
-
-from mutagen import id3, apev2
-
-from fluss.config import global_config as C
-
-APETagFiles = (apev2.APEv2File,)
-ID3TagFiles = (id3.ID3FileType, mutagen.wave.WAVE)
+if TYPE_CHECKING:
+    import mutagen
+    from mutagen import apev2, id3
+
+from fluss.cache import get_decode_cache
+from fluss.config import ConfigSnapshot, global_config as C
+from fluss.pcm import MappedPCM, PCMBuffer, _wave_params, array_to_frames, frames_to_array
+from fluss.probe import probe_length
+from fluss.progress import OutputProgressParser, parse_progress_async
+from fluss.scratch import ScratchFile, get_scratch_space
+from fluss.tools import get_tool_registry
+from fluss import transport
+
+def __getattr__(name):
+    # mutagen backends are loaded on first use, so that importing codecs is fast for headless workers
+    if name == "APETagFiles":
+        from mutagen import apev2
+        return (apev2.APEv2File,)
+    if name == "ID3TagFiles":
+        import mutagen.dsf
+        import mutagen.wave
+        from mutagen import id3
+        return (id3.ID3FileType, mutagen.wave.WAVE, mutagen.dsf.DSF)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def _resolve_pathstr(file: Union[str, Path]):
     if isinstance(file, str):
@@ -43,26 +59,82 @@ def _resolve_pathstr(file: Union[str, Path]):
     else:
         raise ValueError("Incorrect path type")
 
-def _get_temp_file(prefix='', ext=None):
-    tmpfolder = Path(tempfile.gettempdir(), "fluss")
-    tmpfolder.mkdir(exist_ok=True)
-    fname = prefix + hex(random.getrandbits(48))[2:]
-    if ext:
-        fname += ext
-    return tmpfolder / fname
+def _map_decoded(ftmp: ScratchFile) -> MappedPCM:
+    '''
+    map the temporary wave file written by a decoder, it's removed and its scratch space is released
+    when the stream is closed
+    '''
+    try:
+        ftmp.path.chmod(stat.S_IRUSR | stat.S_IWUSR)  # sometimes the output file happens to be readonly ...
+    except BaseException:
+        ftmp.release()
+        raise
+    return MappedPCM(ftmp.path, delete=True, on_release=ftmp.release)
 
 def joint_command_args(*args):
     return '"' + '" "'.join(a for a in args) + '"'
 
+# codec processes are started in their own process group, so that the codec started by the shell
+# is killed along with it when the job is cancelled
+if os.name == "nt":
+    _process_group_kwargs = dict(creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+else:
+    _process_group_kwargs = dict(start_new_session=True)
+
+async def _create_subprocess_shell(cmd: str, **kwargs) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_shell(cmd, **_process_group_kwargs, **kwargs)
+
+def _popen(args: List[str], **kwargs) -> subprocess.Popen:
+    return subprocess.Popen(args, **_process_group_kwargs, **kwargs)
+
+def _kill_process_group(proc: Union[subprocess.Popen, asyncio.subprocess.Process]) -> None:
+    ''' kill a process started by :func:`_popen` or :func:`_create_subprocess_shell` with all its children '''
+    running = proc.poll() is None if isinstance(proc, subprocess.Popen) else proc.returncode is None
+    if not running:
+        return
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def _remove_files(*files: Union[str, Path, ScratchFile]) -> None:
+    ''' remove partial outputs or temp files left by a failed process '''
+    for f in files:
+        if isinstance(f, ScratchFile):
+            f.release()
+            continue
+        try:
+            Path(f).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _logger.warning("Failed to remove %s: %s", str(f), e)
+
+def _binary(name: str, config: ConfigSnapshot = None) -> str:
+    ''' path of a codec binary, FileNotFoundError is raised if it's not available '''
+    return str(get_tool_registry().require(name, config).path)
+
 class AudioCodec:
     suffix: str
     ''' output suffix of files with this codec
     '''
+    cacheable: bool = True
+    ''' whether decoded results can be stored in the decode cache
+    '''
+    binaries: Tuple[str, ...] = ()
+    ''' names of the external tools (see fluss.tools) required by this codec
+    '''
 
-    def __init__(self, encode_args=None):
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
         '''
         encode_args: (extra) command line args for encoding, usually for adjusting compression level
+        config: config of the job using this codec, default to the global config
         '''
+        self.config = config if config is not None else C
         if encode_args is None:
             self.encode_args = []
         elif isinstance(encode_args, (list, tuple)):
@@ -70,37 +142,22 @@ class AudioCodec:
         else:
             self.encode_args = [encode_args]
 
+    @classmethod
+    def available(cls, config: ConfigSnapshot = None) -> bool:
+        ''' whether the required binaries are available on this host '''
+        registry = get_tool_registry()
+        return all(registry.get(name, config) is not None for name in cls.binaries)
+
     async def _report_encode_progress(self,
             stream: asyncio.StreamReader,
             pattern: str,
             convert: Union[Callable[[str], float], float],
             callback: Callable[[float], None],
-            linesep: str = b'\r\b') -> None:
+            linesep: str = b'\r\b') -> bytes:
         '''
-        Utility function for codecs to match progress string from process stream
+        Utility function for codecs to match progress string from process stream, the tail of the output is returned
         '''
-        pattern = re.compile(pattern)
-        cumulate = 0.0
-        finished = False
-        lines = []
-        while not finished:
-            try:
-                line = await stream.readuntil(linesep)
-            except asyncio.exceptions.IncompleteReadError as e:
-                line = e.partial
-                finished = True
-            lines.append(line)
-            if not line:
-                continue
-
-            match = pattern.search(line)
-            if match:
-                if isinstance(convert, float):
-                    cumulate += convert
-                    callback(cumulate)
-                else:
-                    callback(convert(match[0]))
-        return b"".join(lines)
+        return await parse_progress_async(stream, OutputProgressParser(pattern, convert, callback, linesep))
 
     def _assert_retcode(self, name, retcode, output_msg=None):
         if retcode != 0:
@@ -110,22 +167,259 @@ class AudioCodec:
                 _logger.error("%s returns %d", name, retcode)
             raise RuntimeError(f"{name} returns {retcode}, see log for full output")
 
+    def _decoded_size(self, fin: str) -> int:
+        ''' estimated size of the decoded wave file, used to allocate scratch space '''
+        try:
+            params = self.probe(fin)
+        except Exception:
+            params = None
+        if params is None:
+            return os.path.getsize(fin) * 4 # lossless codecs rarely compress below 25%
+        nchannels, sampwidth, _, nframes = params
+        return 44 + nchannels * sampwidth * nframes
+
+    async def _allocate_decoded(self, fin: str) -> ScratchFile:
+        ''' allocate a scratch file for decoding, waiting if the scratch quota is exhausted '''
+        size = await asyncio.get_running_loop().run_in_executor(None, self._decoded_size, fin)
+        return await get_scratch_space().allocate(size, "decode_", ".wav")
+
+    async def _wait_process(self, name: str, proc: asyncio.subprocess.Process,
+                            progress_task: Awaitable[bytes] = None,
+                            cleanup: List[Union[str, Path]] = ()) -> Optional[bytes]:
+        '''
+        Wait for the codec process (and the task parsing its progress) and check its return code. If it fails
+        or the waiting is cancelled, the whole process group is killed and files in cleanup are removed.
+
+        :return: output collected by the progress task
+        '''
+        try:
+            if progress_task is not None:
+                output_msg, retcode = await asyncio.gather(progress_task, proc.wait())
+            else:
+                output_msg, retcode = None, await proc.wait()
+            self._assert_retcode(name, retcode, output_msg)
+        except BaseException:
+            _kill_process_group(proc)
+            _remove_files(*cleanup)
+            raise
+        return output_msg
+
+    def _encode_pipe_args(self, fout: str) -> List[str]:
+        '''
+        Command line args for encoding wave stream from stdin into fout silently. Return None if not supported
+        '''
+        return None
+
+    def _decode_pipe_args(self, fin: str) -> List[str]:
+        '''
+        Command line args for decoding fin into wave stream on stdout silently. Return None if not supported
+        '''
+        return None
+
+    @property
+    def pipeable(self) -> bool:
+        ''' whether this codec can encode from and decode to pipes '''
+        return self._encode_pipe_args("-") is not None and self._decode_pipe_args("-") is not None
+
+    async def encode_pipe_async(self, fout: str, limit: int = 2 ** 16) -> asyncio.subprocess.Process:
+        '''
+        Start an encoder process that consumes wave stream from its stdin
+        '''
+        args = self._encode_pipe_args(_resolve_pathstr(fout))
+        if args is None:
+            raise NotImplementedError(f"{self.__class__.__name__} doesn't support encoding from pipe")
+        return await _create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, limit=limit)
+
+    async def decode_pipe_async(self, fin: str, limit: int = 2 ** 16) -> asyncio.subprocess.Process:
+        '''
+        Start a decoder process that produces wave stream on its stdout
+        '''
+        args = self._decode_pipe_args(_resolve_pathstr(fin))
+        if args is None:
+            raise NotImplementedError(f"{self.__class__.__name__} doesn't support decoding to pipe")
+        return await _create_subprocess_shell(joint_command_args(*args), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, limit=limit)
+
     def encode(self, fout: str, wavein: bytes) -> None:
         raise NotImplementedError("Abstract function!")
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
         raise NotImplementedError("Abstract function!")
 
+    async def encode_stream_async(self, fout: str, stream: "MergedWaveStream", progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        '''
+        Encode a chunked wave stream. The stream is piped into the encoder if supported, otherwise it will be
+        collected in memory and encoded as a whole.
+        '''
+        if self._encode_pipe_args("-") is None:
+            _logger.debug("%s doesn't support pipe input, buffering the whole stream", self.__class__.__name__)
+            await self.encode_async(fout, b"".join([chunk async for chunk in stream]), progress_callback=progress_callback)
+            return
+
+        _logger.info("Encoding stream to %s through pipe", fout)
+        encoder = await self.encode_pipe_async(fout)
+        try:
+            written = 0
+            async for chunk in stream:
+                encoder.stdin.write(chunk)
+                await encoder.stdin.drain()
+
+                written += len(chunk)
+                if progress_callback is not None:
+                    progress_callback(min(written / stream.nbytes, 1.0))
+            encoder.stdin.close()
+            retcode = await encoder.wait()
+            self._assert_retcode(f"{self.__class__.__name__} encoder", retcode)
+        except BaseException:
+            _kill_process_group(encoder)
+            _remove_files(fout)
+            raise
+        _logger.info("Encoding %s done", fout)
+
     def decode(self, fin: str) -> wave.Wave_read:
         raise NotImplementedError("Abstract function!")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+    @property
+    def _decode_through_pipe(self) -> bool:
+        ''' whether async decoding should use the pipe transport instead of temp files '''
+        return self.config.pipeline.transport == "pipe" and self._decode_pipe_args("-") is not None
+
+    async def _decode_pipe_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, MappedPCM]:
+        '''
+        Decode the whole file through a pipe pumped on a background thread into a scratch file, for callers that
+        need random access (see :meth:`decode_stream_async` for sequential reading)
+        '''
+        _logger.info("Decoding %s as %s through pipe", fin, self.__class__.__name__)
+        ftmp = await self._allocate_decoded(fin)
+        try:
+            proc = _popen(self._decode_pipe_args(_resolve_pathstr(fin)),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                await transport.pump_async(proc.stdout, ftmp.path.open("wb"), progress_callback,
+                                           self.config.pipeline.chunk_size)
+                retcode = await asyncio.get_running_loop().run_in_executor(None, proc.wait)
+            except BaseException:
+                _kill_process_group(proc)
+                raise
+            finally:
+                proc.stdout.close()
+            self._assert_retcode(f"{self.__class__.__name__} decoder", retcode)
+        except BaseException:
+            ftmp.release()
+            raise
+
+        if progress_callback is not None:
+            progress_callback(1.0)
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
+
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
         raise NotImplementedError("Abstract function!")
 
+    async def hash_decoded_async(self, fin: str) -> str:
+        '''
+        Decode the file and compute MD5 of the decoded frames. The decoded audio is streamed through the
+        hash if the codec supports pipes, and the decode cache is always bypassed.
+        '''
+        if self._decode_pipe_args("-") is None:
+            md5 = hashlib.md5()
+            with await self._decode_async(fin) as wave_in:
+                while True:
+                    chunk = wave_in.readframes(2 ** 16)
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+            return md5.hexdigest()
+
+        proc = _popen(self._decode_pipe_args(_resolve_pathstr(fin)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            digest = await transport.hash_pcm_async(proc.stdout, self.config.pipeline.chunk_size)
+            retcode = await asyncio.get_running_loop().run_in_executor(None, proc.wait)
+        except BaseException:
+            _kill_process_group(proc)
+            raise
+        finally:
+            proc.stdout.close()
+        self._assert_retcode(f"{self.__class__.__name__} decoder", retcode)
+        return digest
+
+    async def decode_stream_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, Union[wave.Wave_read, transport.PipeWaveReader]]:
+        '''
+        Decode the file into a stream that is read sequentially. If it's decoded through pipe (and the decode cache
+        is disabled), frames are read from the decoder as they are decoded and the decoder is blocked when the
+        buffers are full, otherwise it's the same as :meth:`decode_async`. A failure of the decoder is raised on reading.
+        '''
+        if not self._decode_through_pipe or (self.cacheable and get_decode_cache() is not None):
+            return await self.decode_async(fin, progress_callback)
+
+        _logger.info("Decoding %s as %s through pipe", fin, self.__class__.__name__)
+        loop = asyncio.get_running_loop()
+        proc = _popen(self._decode_pipe_args(_resolve_pathstr(fin)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def on_eof():
+            self._assert_retcode(f"{self.__class__.__name__} decoder", proc.wait())
+            if progress_callback is not None:
+                loop.call_soon_threadsafe(progress_callback, 1.0)
+            _logger.info("Decoding %s done", fin)
+
+        try:
+            return await transport.open_pipe_wave_async(proc.stdout,
+                depth=self.config.pipeline.pipe_buffers, chunk_size=self.config.pipeline.chunk_size,
+                progress_callback=progress_callback, on_eof=on_eof, on_close=lambda: _kill_process_group(proc))
+        except BaseException:
+            _kill_process_group(proc)
+            proc.stdout.close()
+            raise
+
+    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+        '''
+        Decode the file into a wave stream. Results are stored in the decode cache if it's enabled
+        '''
+        decode = self._decode_pipe_async if self._decode_through_pipe else self._decode_async
+        cache = get_decode_cache() if self.cacheable else None
+        if cache is None:
+            return await decode(fin, progress_callback)
+
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(None, cache.key, fin)
+        cached = cache.get(key)
+        if cached is None:
+            wave_in = await decode(fin, progress_callback)
+            cached = await loop.run_in_executor(None, cache.put, key, wave_in)
+        else:
+            _logger.info("Decoding %s hits cache %s", fin, cached.name)
+            if progress_callback is not None:
+                progress_callback(1.0)
+        return MappedPCM(cached)
+
     @classmethod
     def mutagen(cls, fin: str) -> mutagen.FileType:
         raise NotImplementedError("Abstract function!")
 
+    def probe(self, fin: str, mutag: "mutagen.FileType" = None) -> Optional[Tuple[int, int, int, int]]:
+        '''
+        Get the format of the decoded wave stream without decoding
+
+        :param mutag: mutagen object of the file if it's already loaded
+        :return: (nchannels, sampwidth, framerate, nframes), None if it cannot be determined
+        '''
+        info = (mutag or self.mutagen(fin)).info
+        nchannels = getattr(info, "channels", None)
+        bits = getattr(info, "bits_per_sample", None)
+        framerate = getattr(info, "sample_rate", None)
+        if not (nchannels and bits and framerate):
+            return None
+
+        length = probe_length(fin)
+        if length is not None and length[1] == framerate:
+            nframes = length[0]
+        else:
+            nframes = getattr(info, "total_samples", None) or round(info.length * framerate)
+        return nchannels, (bits + 7) // 8, framerate, nframes
+
     def __str__(self):
         if self.encode_args:
             return f"{self.__class__.__name__} ({' '.join(self.encode_args)})"
@@ -134,22 +428,29 @@ class AudioCodec:
 
 class wav(AudioCodec):
     suffix = "wav"
+    cacheable = False
 
-    def __init__(self, encode_args=None):
-        super().__init__(encode_args)
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        super().__init__(encode_args, config)
 
     def encode(self, fout: str, wavein: bytes) -> None:
         Path(fout).write_bytes(wavein)
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None]) -> Coroutine[Any, Any, None]:
-        self.encode(fout, bytes)
+        self.encode(fout, wavein)
+        if progress_callback:
+            progress_callback(1.0)
+
+    async def encode_stream_async(self, fout: str, stream: "MergedWaveStream", progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        with Path(fout).open("wb") as wave_out:
+            await merge_streams_async(stream, wave_out)
         if progress_callback:
             progress_callback(1.0)
 
     def decode(self, fin: str) -> wave.Wave_read:
         return wave.open(Path(fin).open("rb"), "rb")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None]) -> Coroutine[Any, Any, wave.Wave_read]:
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None]) -> Coroutine[Any, Any, wave.Wave_read]:
         result = self.decode(fin)
         if progress_callback:
             progress_callback(1.0)
@@ -157,31 +458,126 @@ class wav(AudioCodec):
 
     @classmethod
     def mutagen(cls, fin: str) -> mutagen.FileType:
+        import mutagen.wave
         return mutagen.wave.WAVE(fin)
 
 class flac(AudioCodec):
+    '''
+    FLAC codec using the flac binary, or libFLAC in process through soundfile
+    if pipeline.flac_backend is set to "soundfile"
+    '''
     suffix = "flac"
+    binaries = ("flac",)
+
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        super().__init__(encode_args, config)
+        self._in_process = self.config.pipeline.flac_backend == "soundfile"
+        if not self._in_process:
+            self._flac = _binary("flac", self.config)
 
-    def __init__(self, encode_args=None):
-        super().__init__(encode_args)
-        assert Path(C.path.flac).exists()
+    @classmethod
+    def available(cls, config: ConfigSnapshot = None) -> bool:
+        return (config if config is not None else C).pipeline.flac_backend == "soundfile" or super().available(config)
+
+    def _encode_pipe_args(self, fout: str) -> List[str]:
+        if self._in_process:
+            return None
+        return [self._flac, "-sfV", "-", "-o", fout] + self.encode_args
+
+    def _decode_pipe_args(self, fin: str) -> List[str]:
+        if self._in_process:
+            return None
+        return [self._flac, "-sdc", fin]
+
+    def _compression_level(self) -> int:
+        for arg in self.encode_args:
+            match = re.fullmatch(r'-([0-8])|--compression-level-([0-8])', arg)
+            if match:
+                return int(match[1] or match[2])
+            _logger.debug("Argument %s is ignored by in-process flac encoder", arg)
+        return None
+
+    def _encode_in_process(self, fout: str, stream: "MergedWaveStream", progress_callback: Callable[[float], None] = None,
+                           loop: asyncio.AbstractEventLoop = None) -> None:
+        import numpy as np
+        import soundfile
+
+        params = stream.params
+        subtypes = {1: 'PCM_S8', 2: 'PCM_16', 3: 'PCM_24'}
+        if params.sampwidth not in subtypes:
+            raise ValueError("FLAC doesn't support %d bit samples" % (params.sampwidth * 8))
+
+        options = {}
+        level = self._compression_level()
+        if level is not None:
+            options['compression_level'] = level / 8
+
+        written = 0
+        with soundfile.SoundFile(_resolve_pathstr(fout), 'w', samplerate=params.framerate, channels=params.nchannels,
+                                 format='FLAC', subtype=subtypes[params.sampwidth], **options) as sf:
+            frames = stream.iter_frames() if hasattr(stream, "iter_frames") else _iter_frames_threadsafe(stream, loop)
+            for chunk in frames:
+                samples = frames_to_array(chunk, params.sampwidth, params.nchannels)
+                if samples.dtype == np.int8:
+                    samples = samples.astype(np.int16) << 8
+                sf.write(samples)
+
+                written += len(samples)
+                if progress_callback is not None:
+                    progress_callback(written / max(stream.nframes, 1))
+
+    def _decode_in_process(self, fin: str) -> PCMBuffer:
+        import soundfile
+
+        fin = _resolve_pathstr(fin)
+        info = soundfile.info(fin)
+        sampwidths = {'PCM_S8': 1, 'PCM_16': 2, 'PCM_24': 3}
+        if info.subtype not in sampwidths:
+            raise ValueError("Unsupported FLAC subtype: %s" % info.subtype)
+        sampwidth = sampwidths[info.subtype]
+
+        samples, framerate = soundfile.read(fin, dtype='int16' if sampwidth <= 2 else 'int32', always_2d=True)
+        if sampwidth == 1:
+            samples >>= 8
+        return PCMBuffer(array_to_frames(samples, sampwidth), info.channels, sampwidth, framerate)
+
+    async def encode_stream_async(self, fout: str, stream: "MergedWaveStream", progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        if not self._in_process:
+            return await super().encode_stream_async(fout, stream, progress_callback)
+
+        _logger.info("Encoding as flac to %s in process", fout)
+        loop = asyncio.get_running_loop()
+        callback = None
+        if progress_callback is not None:
+            callback = lambda p: loop.call_soon_threadsafe(progress_callback, p)
+        await loop.run_in_executor(None, self._encode_in_process, fout, stream, callback, loop)
+        _logger.info("Encoding %s done", fout)
 
     def encode(self, fout: str, wavein: bytes) -> None:
-        proc = subprocess.Popen([C.path.flac, "-sfV", "-", "-o", _resolve_pathstr(fout)] + self.encode_args, stdin=subprocess.PIPE)
+        if self._in_process:
+            self._encode_in_process(fout, MergedWaveStream([wave.open(io.BytesIO(wavein), 'rb')]))
+            return
+
+        proc = subprocess.Popen(self._encode_pipe_args(_resolve_pathstr(fout)), stdin=subprocess.PIPE)
         proc.communicate(wavein)
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        if self._in_process:
+            stream = MergedWaveStream([wave.open(io.BytesIO(wavein), 'rb')])
+            return await self.encode_stream_async(fout, stream, progress_callback)
+
         _logger.info("Encoding as flac to %s", fout)
 
         if progress_callback is None:
-            args = [C.path.flac, "-sfV", "-", "-o", _resolve_pathstr(fout)] + self.encode_args
+            args = [self._flac, "-sfV", "-", "-o", _resolve_pathstr(fout)] + self.encode_args
             stderr = None
         else:
-            args = [C.path.flac, "-fV", "-", "-o", _resolve_pathstr(fout)] + self.encode_args
+            args = [self._flac, "-fV", "-", "-o", _resolve_pathstr(fout)] + self.encode_args
             stderr = subprocess.PIPE
 
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}(?=% complete)',
@@ -192,31 +588,38 @@ class flac(AudioCodec):
         proc.stdin.write(wavein)
         proc.stdin.close()
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("flac encoder", retcode, stderr_msg)
+        await self._wait_process("flac encoder", proc, ptask, cleanup=[fout])
 
-        _logger.info("Encoding %s done")
+        _logger.info("Encoding %s done", fout)
 
     def decode(self, fin: str) -> wave.Wave_read:
-        proc = subprocess.Popen([C.path.flac, "-sdc", _resolve_pathstr(fin)], stdout=subprocess.PIPE)
+        if self._in_process:
+            return self._decode_in_process(fin)
+
+        proc = subprocess.Popen(self._decode_pipe_args(_resolve_pathstr(fin)), stdout=subprocess.PIPE)
         return wave.open(proc.stdout, "rb")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
-        ftmp = _get_temp_file(prefix='decode_', ext='.wav')
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+        if self._in_process:
+            _logger.info("Decoding %s as flac in process", fin)
+            result = await asyncio.get_running_loop().run_in_executor(None, self._decode_in_process, fin)
+            if progress_callback is not None:
+                progress_callback(1.0)
+            return result
+
+        ftmp = await self._allocate_decoded(fin)
         _logger.info("Decoding %s as flac to %s", fin, str(ftmp))
 
         if progress_callback is None:
-            args = [C.path.flac, "-sdc", _resolve_pathstr(fin), "-o", str(ftmp)]
+            args = [self._flac, "-sdc", _resolve_pathstr(fin), "-o", str(ftmp)]
             stderr = None
         else:
-            args = [C.path.flac, "-dc", _resolve_pathstr(fin), "-o", str(ftmp)]
+            args = [self._flac, "-dc", _resolve_pathstr(fin), "-o", str(ftmp)]
             stderr = subprocess.PIPE
 
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                 pattern=rb'1?[0-9]{0,2}(?=% complete)',
@@ -224,47 +627,48 @@ class flac(AudioCodec):
                                                 callback=progress_callback,
                                                 linesep=b'\b')
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("flac decoder", retcode, stderr_msg)
+        await self._wait_process("flac decoder", proc, ptask, cleanup=[ftmp])
 
-        buf = ftmp.read_bytes()
-        ftmp.chmod(stat.S_IWUSR)  # sometimes the output file happens to be readonly ...
-        ftmp.unlink()
-
-        _logger.info("Decoding %s done")
-        return wave.open(io.BytesIO(buf), 'rb')
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
 
     @classmethod
     def mutagen(cls, fin: str) -> mutagen.flac.FLAC:
+        import mutagen.flac
         return mutagen.flac.FLAC(fin)
 
 class wavpack(AudioCodec):
     suffix = "wv"
+    binaries = ("wavpack", "wvunpack")
+
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        super().__init__(encode_args, config)
+        self._wavpack = _binary("wavpack", self.config)
+        self._wvunpack = _binary("wvunpack", self.config)
 
-    def __init__(self, encode_args=None):
-        super().__init__(encode_args)
-        assert Path(C.path.wavpack).exists()
-        assert Path(C.path.wvunpack).exists()
+    def _encode_pipe_args(self, fout: str) -> List[str]:
+        return [self._wavpack, '-yq'] + self.encode_args + ["-", fout]
+
+    def _decode_pipe_args(self, fin: str) -> List[str]:
+        return [self._wvunpack, '-yq', fin, "-"]
 
     def encode(self, fout: str, wavein: bytes) -> None:
-        proc = subprocess.Popen([C.path.wavpack, '-yq'] + self.encode_args + ["-", _resolve_pathstr(fout)], stdin=subprocess.PIPE)
+        proc = subprocess.Popen(self._encode_pipe_args(_resolve_pathstr(fout)), stdin=subprocess.PIPE)
         proc.communicate(wavein)
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
         _logger.info("Encoding as wavpack to %s", fout)
 
         if progress_callback is None:
-            args = [C.path.wavpack, '-yq'] + self.encode_args + ["-", _resolve_pathstr(fout)]
+            args = [self._wavpack, '-yq'] + self.encode_args + ["-", _resolve_pathstr(fout)]
             stderr = None
         else:
-            args = [C.path.wavpack, '-y'] + self.encode_args + ["-", _resolve_pathstr(fout)]
+            args = [self._wavpack, '-y'] + self.encode_args + ["-", _resolve_pathstr(fout)]
             stderr = subprocess.PIPE
 
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}(?=% done)',
@@ -275,29 +679,26 @@ class wavpack(AudioCodec):
         proc.stdin.write(wavein)
         proc.stdin.close()
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("wavpack encoder", retcode, stderr_msg)
+        await self._wait_process("wavpack encoder", proc, ptask, cleanup=[fout])
 
     def decode(self, fin: str) -> wave.Wave_read:
-        proc = subprocess.Popen([C.path.wvunpack, '-yq', _resolve_pathstr(fin), "-"], stdout=subprocess.PIPE)
+        proc = subprocess.Popen(self._decode_pipe_args(_resolve_pathstr(fin)), stdout=subprocess.PIPE)
         return wave.open(proc.stdout, "rb")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
         _logger.info("Decoding %s as wavpack", fin)
-        ftmp = _get_temp_file("decode_", ".wav")
+        ftmp = await self._allocate_decoded(fin)
 
         if progress_callback is None:
-            args = [C.path.wvunpack, '-yq', _resolve_pathstr(fin), str(ftmp)]
+            args = [self._wvunpack, '-yq', _resolve_pathstr(fin), str(ftmp)]
             stderr = None
         else:
-            args = [C.path.wvunpack, '-y', _resolve_pathstr(fin), str(ftmp)]
+            args = [self._wvunpack, '-y', _resolve_pathstr(fin), str(ftmp)]
             stderr = subprocess.PIPE
 
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}(?=% done)',
@@ -305,49 +706,46 @@ class wavpack(AudioCodec):
                                                  callback=progress_callback,
                                                  linesep=b'...')
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("wavpack decoder", retcode, stderr_msg)
+        await self._wait_process("wavpack decoder", proc, ptask, cleanup=[ftmp])
 
-        buf = ftmp.read_bytes()
         _logger.info("Decoding %s done", fin)
-        return wave.open(io.BytesIO(buf), 'rb')
+        return _map_decoded(ftmp)
 
     @classmethod
     def mutagen(cls, fin: str) -> mutagen.wavpack.WavPack:
+        import mutagen.wavpack
         return mutagen.wavpack.WavPack(fin)
 
 class monkeysaudio(AudioCodec):
     suffix = 'ape'
+    binaries = ("mac",)
 
-    def __init__(self, encode_args=None):
-        if not encode_args:
-            encode_args = ['-c2000'] # normal compression
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        encode_args = list(encode_args or []) # presets in config are not modified
         if '-c' not in ''.join(encode_args):
-            encode_args.append('-c2000')
-        super().__init__(encode_args=encode_args)
-        assert Path(C.path.mac).exists()
+            encode_args.append('-c2000') # normal compression
+        super().__init__(encode_args, config)
+        self._mac = _binary("mac", self.config)
 
     def encode(self, fout: str, wavein: bytes) -> None:
         with TemporaryDirectory() as tmp:
             tmp_file = Path(tmp, 'tmp.wav')
             tmp_file.write_bytes(wavein)
-            proc = subprocess.Popen([C.path.mac, str(tmp_file), _resolve_pathstr(fout)] + self.encode_args, stderr=subprocess.DEVNULL)
+            proc = subprocess.Popen([self._mac, str(tmp_file), _resolve_pathstr(fout)] + self.encode_args, stderr=subprocess.DEVNULL)
             proc.wait()
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
         _logger.info("Encoding as ape to %s", fout)
 
-        with TemporaryDirectory() as tmp:
-            tmp_file = Path(tmp, 'tmp.wav')
-            tmp_file.write_bytes(wavein)
+        tmp_file = await get_scratch_space().allocate(len(wavein), "encode_", ".wav")
+        try:
+            tmp_file.path.write_bytes(wavein)
 
-            args = [C.path.mac, str(tmp_file), _resolve_pathstr(fout)] + self.encode_args
+            args = [self._mac, str(tmp_file), _resolve_pathstr(fout)] + self.encode_args
             stderr = None if progress_callback is None else subprocess.PIPE
-            proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+            proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
 
+            ptask = None
             if progress_callback is not None:
                 ptask = self._report_encode_progress(proc.stderr,
                                                      pattern=rb'1?[0-9]{0,2}\.[0-9](?=% \()',
@@ -355,28 +753,49 @@ class monkeysaudio(AudioCodec):
                                                      callback=progress_callback,
                                                      linesep=b')')
 
+            await self._wait_process("Monkey's Audio encoder", proc, ptask, cleanup=[fout])
+        finally:
+            tmp_file.release()
+
+    async def encode_stream_async(self, fout: str, stream: "MergedWaveStream", progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        _logger.info("Encoding as ape to %s", fout)
+
+        # mac can't read from stdin, the stream is written to the temporary file without being joined in memory
+        ftmp = await get_scratch_space().allocate(stream.nbytes, "encode_", ".wav")
+        try:
+            with ftmp.path.open("wb") as wave_out:
+                await merge_streams_async(stream, wave_out)
+
+            args = [self._mac, str(ftmp), _resolve_pathstr(fout)] + self.encode_args
+            stderr = None if progress_callback is None else subprocess.PIPE
+            proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+
+            ptask = None
             if progress_callback is not None:
-                stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-            else:
-                stderr_msg, retcode = None, await proc.wait()
-            self._assert_retcode("Monkey's Audio encoder", retcode, stderr_msg)
+                ptask = self._report_encode_progress(proc.stderr,
+                                                     pattern=rb'1?[0-9]{0,2}\.[0-9](?=% \()',
+                                                     convert=lambda s: float(s) / 100,
+                                                     callback=progress_callback,
+                                                     linesep=b')')
+            await self._wait_process("Monkey's Audio encoder", proc, ptask, cleanup=[fout])
+        finally:
+            ftmp.release()
 
     def decode(self, fin: str) -> wave.Wave_read:
-        ftmp = _get_temp_file("decode_", ".wav")
-        proc = subprocess.Popen([C.path.mac, _resolve_pathstr(fin), str(ftmp), '-d'], stderr=subprocess.DEVNULL)
+        ftmp = get_scratch_space().allocate_blocking(self._decoded_size(fin), "decode_", ".wav")
+        proc = subprocess.Popen([self._mac, _resolve_pathstr(fin), str(ftmp), '-d'], stderr=subprocess.DEVNULL)
         proc.wait()
-        buf = io.BytesIO(ftmp.read_bytes())
-        ftmp.unlink()
-        return wave.open(buf, "rb")
+        return _map_decoded(ftmp)
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
         _logger.info("Decoding %s as ape", fin)
-        ftmp = _get_temp_file("decode_", ".wav")
+        ftmp = await self._allocate_decoded(fin)
 
-        args = [C.path.mac, _resolve_pathstr(fin), str(ftmp), '-d']
+        args = [self._mac, _resolve_pathstr(fin), str(ftmp), '-d']
         stderr = None if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                     pattern=rb'1?[0-9]{0,2}\.[0-9](?=% \()',
@@ -384,40 +803,43 @@ class monkeysaudio(AudioCodec):
                                                     callback=progress_callback,
                                                     linesep=b')')
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("Monkey's Audio decoder", retcode, stderr_msg)
+        await self._wait_process("Monkey's Audio decoder", proc, ptask, cleanup=[ftmp])
 
-        buf = ftmp.read_bytes()
-        ftmp.unlink()
-        _logger.info("Decoding %s done")
-        return wave.open(io.BytesIO(buf), 'rb')
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
 
     @classmethod
     def mutagen(cls, fin: str) -> mutagen.wavpack.WavPack:
+        import mutagen.monkeysaudio
         return mutagen.monkeysaudio.MonkeysAudio(fin)
 
 # TODO: tta encoder seems to buffer stderr output
 class trueaudio(AudioCodec):
     suffix = "tta"
+    binaries = ("tta",)
 
-    def __init__(self, encode_args=None):
-        super().__init__(encode_args)
-        assert Path(C.path.tta).exists()
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        super().__init__(encode_args, config)
+        self._tta = _binary("tta", self.config)
+
+    def _encode_pipe_args(self, fout: str) -> List[str]:
+        return [self._tta, "-e"] + self.encode_args + ["-", fout]
+
+    def _decode_pipe_args(self, fin: str) -> List[str]:
+        return [self._tta, "-d", fin, '-']
 
     def encode(self, fout: str, wavein: bytes) -> None:
-        proc = subprocess.Popen([C.path.tta, "-e"] + self.encode_args + ["-", _resolve_pathstr(fout)], stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(self._encode_pipe_args(_resolve_pathstr(fout)), stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
         proc.communicate(wavein)
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
         _logger.info("Encoding as tta to %s", fout)
 
-        args = [C.path.tta, "-e"] + self.encode_args + ["-", _resolve_pathstr(fout)]
+        args = [self._tta, "-e"] + self.encode_args + ["-", _resolve_pathstr(fout)]
         stderr = subprocess.DEVNULL if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}(?=%)',
@@ -428,24 +850,21 @@ class trueaudio(AudioCodec):
         proc.stdin.write(wavein)
         proc.stdin.close()
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("True Audio encoder", retcode, stderr_msg)
+        await self._wait_process("True Audio encoder", proc, ptask, cleanup=[fout])
 
     def decode(self, fin: str) -> wave.Wave_read:
-        proc = subprocess.Popen([C.path.tta, "-d", _resolve_pathstr(fin), '-'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(self._decode_pipe_args(_resolve_pathstr(fin)), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
         return wave.open(proc.stdout, "rb")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
         _logger.info("Decoding %s as tta", fin)
-        ftmp = _get_temp_file("decode_", ".wav")
+        ftmp = await self._allocate_decoded(fin)
 
-        args = [C.path.tta, "-d", _resolve_pathstr(fin), str(ftmp)]
+        args = [self._tta, "-d", _resolve_pathstr(fin), str(ftmp)]
         stderr = subprocess.DEVNULL if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}(?=%)',
@@ -453,40 +872,43 @@ class trueaudio(AudioCodec):
                                                  callback=progress_callback,
                                                  linesep=b'\r')
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("True Audio decoder", retcode, stderr_msg)
+        await self._wait_process("True Audio decoder", proc, ptask, cleanup=[ftmp])
 
-        buf = ftmp.read_bytes()
-        ftmp.unlink()
-        _logger.info("Decoding %s done")
-        return wave.open(io.BytesIO(buf), 'rb')
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
 
     @classmethod
     def mutagen(cls, fin: str) -> id3.ID3FileType:
+        import mutagen.trueaudio
         return mutagen.trueaudio.TrueAudio(fin)
 
 class tak(AudioCodec):
     suffix = "tak"
+    binaries = ("takc",)
+
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        super().__init__(encode_args, config)
+        self._takc = _binary("takc", self.config)
 
-    def __init__(self, encode_args=None):
-        super().__init__(encode_args)
-        assert Path(C.path.takc).exists()
+    def _encode_pipe_args(self, fout: str) -> List[str]:
+        return [self._takc, "-e", "-silent", "-overwrite"] + self.encode_args + ["-", fout]
+
+    def _decode_pipe_args(self, fin: str) -> List[str]:
+        return [self._takc, "-d", "-silent", "-overwrite", fin, '-']
 
     def encode(self, fout: str, wavein: bytes) -> None:
-        proc = subprocess.Popen([C.path.takc, "-e", "-silent", "-overwrite"] + self.encode_args + ["-", _resolve_pathstr(fout)],
+        proc = subprocess.Popen(self._encode_pipe_args(_resolve_pathstr(fout)),
             stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
         proc.communicate(wavein)
 
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
         _logger.info("Encoding as tak to %s", fout)
 
-        args = [C.path.takc, "-e", "-overwrite"] + self.encode_args + ["-", _resolve_pathstr(fout)]
+        args = [self._takc, "-e", "-overwrite"] + self.encode_args + ["-", _resolve_pathstr(fout)]
         stdout = subprocess.DEVNULL if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stdout=stdout)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stdout=stdout)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stdout,
                                                  pattern=rb'[^1-9]\.|^\.',
@@ -497,25 +919,22 @@ class tak(AudioCodec):
         proc.stdin.write(wavein)
         proc.stdin.close()
 
-        if progress_callback is not None:
-            stdout_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stdout_msg, retcode = None, await proc.wait()
-        self._assert_retcode("TAK encoder", retcode, stdout_msg)
+        await self._wait_process("TAK encoder", proc, ptask, cleanup=[fout])
 
     def decode(self, fin: str) -> wave.Wave_read:
-        proc = subprocess.Popen([C.path.takc, "-d", "-silent", "-overwrite", _resolve_pathstr(fin), '-'],
+        proc = subprocess.Popen(self._decode_pipe_args(_resolve_pathstr(fin)),
             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
         return wave.open(proc.stdout, "rb")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
         _logger.info("Decoding %s as tak", fin)
-        ftmp = _get_temp_file("decode_", ".wav")
+        ftmp = await self._allocate_decoded(fin)
 
-        args = [C.path.takc, "-d", "-overwrite", _resolve_pathstr(fin), str(ftmp)]
+        args = [self._takc, "-d", "-overwrite", _resolve_pathstr(fin), str(ftmp)]
         stdout = subprocess.DEVNULL if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stdout=stdout)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stdout=stdout)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stdout,
                                                  pattern=rb'[^1-9]\.|^\.',
@@ -523,30 +942,32 @@ class tak(AudioCodec):
                                                  callback=progress_callback,
                                                  linesep=b'.')
 
-        if progress_callback is not None:
-            stdout_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stdout_msg, retcode = None, await proc.wait()
-        self._assert_retcode("TAK decoder", retcode, stdout_msg)
+        await self._wait_process("TAK decoder", proc, ptask, cleanup=[ftmp])
 
-        buf = ftmp.read_bytes()
-        ftmp.unlink()
-        _logger.info("Decoding %s done")
-        return wave.open(io.BytesIO(buf), 'rb')
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
 
     @classmethod
     def mutagen(cls, fin: str) -> apev2.APEv2File:
+        import mutagen.tak
         return mutagen.tak.TAK(fin)
 
 class alac(AudioCodec):
     suffix = "m4a"
+    binaries = ("refalac",)
+
+    def __init__(self, encode_args=None, config: ConfigSnapshot = None):
+        super().__init__(encode_args, config)
+        self._refalac = _binary("refalac", self.config)
+
+    def _encode_pipe_args(self, fout: str) -> List[str]:
+        return [self._refalac, "-s"] + self.encode_args + ["-", "-o", fout]
 
-    def __init__(self, encode_args=None):
-        super().__init__(encode_args)
-        assert Path(C.path.refalac).exists()
+    def _decode_pipe_args(self, fin: str) -> List[str]:
+        return [self._refalac, "-s", "-D", fin, "-o", "-"]
 
     def encode(self, fout: str, wavein: bytes) -> None:
-        proc = subprocess.Popen([C.path.refalac, "-s"] + self.encode_args + ["-", "-o", _resolve_pathstr(fout)],
+        proc = subprocess.Popen(self._encode_pipe_args(_resolve_pathstr(fout)),
             stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
         proc.communicate(wavein)
         return fout
@@ -554,10 +975,11 @@ class alac(AudioCodec):
     async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
         _logger.info("Encoding as alac to %s", fout)
 
-        args = [C.path.refalac] + self.encode_args + ["-", "-o", _resolve_pathstr(fout)]
+        args = [self._refalac] + self.encode_args + ["-", "-o", _resolve_pathstr(fout)]
         stderr = subprocess.DEVNULL if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stdin=subprocess.PIPE, stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}\.[0-9](?=%])',
@@ -568,25 +990,22 @@ class alac(AudioCodec):
         proc.stdin.write(wavein)
         proc.stdin.close()
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = None, await proc.wait()
-        self._assert_retcode("ALAC encoder", retcode, stderr_msg)
+        await self._wait_process("ALAC encoder", proc, ptask, cleanup=[fout])
 
     def decode(self, fin: str) -> wave.Wave_read:
-        proc = subprocess.Popen([C.path.refalac, "-s", "-D", _resolve_pathstr(fin), "-o", "-"],
+        proc = subprocess.Popen(self._decode_pipe_args(_resolve_pathstr(fin)),
             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
         return wave.open(proc.stdout, "rb")
 
-    async def decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
         _logger.info("Decoding %s as alac", fin)
-        ftmp = _get_temp_file("decode_", ".wav")
+        ftmp = await self._allocate_decoded(fin)
 
-        args = [C.path.refalac, "-D", _resolve_pathstr(fin), "-o", str(ftmp)]
+        args = [self._refalac, "-D", _resolve_pathstr(fin), "-o", str(ftmp)]
         stderr = subprocess.DEVNULL if progress_callback is None else subprocess.PIPE
-        proc = await asyncio.create_subprocess_shell(joint_command_args(*args), stderr=stderr)
+        proc = await _create_subprocess_shell(joint_command_args(*args), stderr=stderr)
 
+        ptask = None
         if progress_callback is not None:
             ptask = self._report_encode_progress(proc.stderr,
                                                  pattern=rb'1?[0-9]{0,2}\.[0-9](?=%])',
@@ -594,21 +1013,93 @@ class alac(AudioCodec):
                                                  callback=progress_callback,
                                                  linesep=b'\r')
 
-        if progress_callback is not None:
-            stderr_msg, retcode = await asyncio.gather(ptask, proc.wait())
-        else:
-            stderr_msg, retcode = await proc.wait()
-        self._assert_retcode("ALAC decoder", retcode, stderr)
+        await self._wait_process("ALAC decoder", proc, ptask, cleanup=[ftmp])
 
-        buf = ftmp.read_bytes()
-        ftmp.unlink()
-        _logger.info("Decoding %s done")
-        return wave.open(io.BytesIO(buf), 'rb')
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
 
     @classmethod
     def mutagen(cls, fin: str) -> mutagen.mp4.MP4:
+        import mutagen.mp4
         return mutagen.mp4.MP4(fin)
 
+class dsf(AudioCodec):
+    '''
+    Sony DSF (DSD) files, which are converted to 24 bit PCM with sample rate given by pipeline.dsd_pcm_rate
+    in process. Encoding to DSF is not supported.
+    '''
+    suffix = "dsf"
+
+    def encode(self, fout: str, wavein: bytes) -> None:
+        raise NotImplementedError("Encoding to DSF is not supported!")
+
+    async def encode_async(self, fout: str, wavein: bytes, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        raise NotImplementedError("Encoding to DSF is not supported!")
+
+    async def encode_stream_async(self, fout: str, stream: "MergedWaveStream", progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, None]:
+        raise NotImplementedError("Encoding to DSF is not supported!")
+
+    def _decode_to_file(self, fin: str, fout: Path, progress_callback: Callable[[float], None] = None) -> None:
+        import numpy as np
+        from fluss import _dsf
+
+        with _dsf.open(_resolve_pathstr(fin)) as dsd_in:
+            nchannels, nframes = dsd_in.getnchannels(), dsd_in.getnframes()
+            pcm_rate = _dsf.dsd_pcm_rate(dsd_in.getdsdrate(), self.config.pipeline.dsd_pcm_rate)
+            decimator = _dsf.DsdDecimator(nchannels, dsd_in.getdsdrate(), pcm_rate)
+            chunk_frames = max(self.config.pipeline.chunk_size // nchannels, 1)
+
+            with fout.open("wb") as wave_out:
+                wave_out.write(_wave_header(nchannels, 3, pcm_rate, decimator.output_length(nframes)))
+                while True:
+                    frames = dsd_in.readframes(chunk_frames)
+                    samples = decimator.process(frames) if frames else decimator.flush()
+                    samples = np.clip(np.round(samples * 2**23), -2**23, 2**23 - 1).astype(np.int32)
+                    wave_out.write(array_to_frames(samples, 3))
+                    if not frames:
+                        break
+                    if progress_callback is not None:
+                        progress_callback(dsd_in.tell() / max(nframes, 1))
+
+    def decode(self, fin: str) -> wave.Wave_read:
+        ftmp = get_scratch_space().allocate_blocking(self._decoded_size(fin), "decode_", ".wav")
+        try:
+            self._decode_to_file(fin, ftmp.path)
+        except BaseException:
+            ftmp.release()
+            raise
+        return _map_decoded(ftmp)
+
+    async def _decode_async(self, fin: str, progress_callback: Callable[[float], None] = None) -> Coroutine[Any, Any, wave.Wave_read]:
+        _logger.info("Decoding %s as dsf", fin)
+        ftmp = await self._allocate_decoded(fin)
+
+        loop = asyncio.get_running_loop()
+        callback = None
+        if progress_callback is not None:
+            callback = lambda p: loop.call_soon_threadsafe(progress_callback, p)
+        try:
+            await loop.run_in_executor(None, self._decode_to_file, fin, ftmp.path, callback)
+        except BaseException:
+            ftmp.release()
+            raise
+
+        _logger.info("Decoding %s done", fin)
+        return _map_decoded(ftmp)
+
+    @classmethod
+    def mutagen(cls, fin: str) -> mutagen.dsf.DSF:
+        import mutagen.dsf
+        return mutagen.dsf.DSF(fin)
+
+    def probe(self, fin: str, mutag: "mutagen.FileType" = None) -> Optional[Tuple[int, int, int, int]]:
+        from fluss import _dsf
+
+        with _dsf.open(_resolve_pathstr(fin)) as dsd_in:
+            pcm_rate = _dsf.dsd_pcm_rate(dsd_in.getdsdrate(), self.config.pipeline.dsd_pcm_rate)
+            ratio = dsd_in.getdsdrate() // 8 // pcm_rate
+            return dsd_in.getnchannels(), 3, pcm_rate, -(-dsd_in.getnframes() // ratio)
+
 codec_from_name = {
     'wavpack': wavpack,
     'flac': flac,
@@ -616,33 +1107,387 @@ codec_from_name = {
     'trueaudio': trueaudio,
     'wave': wav,
     'tak': tak,
-    'm4a': alac
+    'm4a': alac,
+    'dsf': dsf
 }
 
 def codec_from_filename(filename: Union[Path, str]) -> Type[AudioCodec]:
     codec_map = {('.' + c.suffix): c for c in codec_from_name.values()}
     return codec_map[Path(filename).suffix.lower()]
 
-def merge_streams(streams: List[Union[wave.Wave_read, float]], fout: io.RawIOBase) -> None:
+def _wave_header(nchannels: int, sampwidth: int, framerate: int, nframes: int) -> bytes:
+    '''
+    Generate header of a PCM wave file with known length, so that it can be written to unseekable streams
     '''
-    Merge audio streams and return merged streams and cuesheet
+    # data longer than 4GB cannot be represented, mark it as unknown size as most encoders do
+    datalength = nframes * nchannels * sampwidth
+    riff_length = 36 + datalength
+    if riff_length > 0xFFFFFFFF:
+        datalength = riff_length = 0xFFFFFFFF
+
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+        b'RIFF', riff_length, b'WAVE',
+        b'fmt ', 16, 1, nchannels, framerate, nchannels * sampwidth * framerate, nchannels * sampwidth, sampwidth * 8,
+        b'data', datalength)
+
+class MergedWaveStream:
+    '''
+    Merge audio streams into a wave stream that is generated chunk by chunk. Iterating over this object
+    yields the wave header and then fixed-size blocks of frames, inputs are closed once consumed.
 
     :param streams: if given float, it specifies a period of silence with given length
+    :param chunk_frames: number of frames read and written in each block
     '''
-    params = None
-    wave_out = wave.open(fout, "wb")
+    def __init__(self, streams: List[Union[wave.Wave_read, float]], chunk_frames: int = 2 ** 16) -> None:
+        self._streams = streams
+        self._chunk_frames = chunk_frames
+
+        params = None
+        for wave_in in streams:
+            if isinstance(wave_in, float):
+                if params is None:
+                    raise ValueError("Unable to insert silence at the beginning!")
+                continue
+            if not hasattr(wave_in, "readframes"):
+                raise ValueError("Unsupported stream type!")
+
+            if params is None:
+                params = wave_in.getparams()
+            elif wave_in.getparams()[:3] != params[:3]:
+                raise ValueError("Inconsistent audio format between streams!")
 
-    for wave_in in streams:
         if params is None:
-            if not isinstance(wave_in, wave.Wave_read):
-                raise ValueError("Unable to insert silence at the beginning!")
-            params = wave_in.getparams()
-            wave_out.setparams(params)
-        if isinstance(wave_in, wave.Wave_read):
-            wave_out.writeframes(wave_in.readframes(wave_in.getnframes()))
-            wave_in.close()
-        elif isinstance(wave_in, float):
-            # add silence of nchannels * sampwidth * framerate * time frames
-            wave_out.writeframes(b'\0' * int(params[0]*params[1]*params[2]*wave_in))
+            raise ValueError("No audio stream to merge!")
+        self.params = params
+
+        self.nframes = sum(self._silence_frames(s) if isinstance(s, float) else s.getnframes() for s in streams)
+        self.header = _wave_header(params.nchannels, params.sampwidth, params.framerate, self.nframes)
+
+    def _silence_frames(self, length: float) -> int:
+        return round(self.params.framerate * length)
+
+    @property
+    def nbytes(self) -> int:
+        ''' total size of the generated wave stream '''
+        return len(self.header) + self.nframes * self.params.nchannels * self.params.sampwidth
+
+    def __iter__(self):
+        yield self.header
+        yield from self.iter_frames()
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+    def iter_frames(self):
+        ''' yield blocks of merged frames without the wave header '''
+        framesize = self.params.nchannels * self.params.sampwidth
+        silence = None  # allocated once when needed and reused by slicing
+
+        for wave_in in self._streams:
+            if isinstance(wave_in, float):
+                if silence is None:
+                    silence = memoryview(bytes(self._chunk_frames * framesize))
+                remaining = self._silence_frames(wave_in)
+                while remaining > 0:
+                    nframes = min(remaining, self._chunk_frames)
+                    yield silence[:nframes * framesize]
+                    remaining -= nframes
+            else:
+                try:
+                    while True:
+                        chunk = wave_in.readframes(self._chunk_frames)
+                        if not chunk:
+                            break
+                        yield chunk
+                finally:
+                    wave_in.close()
+
+def merge_streams(streams: Union[List[Union[wave.Wave_read, float]], "MergedWaveStream"],
+                  fout: Union[io.RawIOBase, int],
+                  chunk_frames: int = 2 ** 16) -> None:
+    '''
+    Merge audio streams into a wave stream with fixed memory consumption
+
+    :param streams: if given float, it specifies a period of silence with given length
+    :param fout: writable file object or a file descriptor (e.g. stdin of an encoder process)
+    '''
+    if not isinstance(streams, MergedWaveStream):
+        streams = MergedWaveStream(streams, chunk_frames)
+
+    for chunk in streams:
+        if isinstance(fout, int):
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fout, view):]
         else:
-            raise ValueError("Unsupported stream type!")
+            fout.write(chunk)
+
+class DecodingWaveStream:
+    '''
+    Merge audio files into a wave stream while they are being decoded. At most `window` files are decoded
+    ahead of (and including) the one being streamed, each decoded stream is forwarded in order as soon as
+    it's ready and released right after being consumed. It only supports asynchronous iteration.
+
+    Since the wave header is generated before decoding, the format and the number of frames of each file
+    must be known. ValueError is raised if a decoded stream has a different length, since the merged audio
+    wouldn't match the sources anymore.
+
+    :param sources: coroutine functions that return the decoded stream, or float for a period of silence
+    :param params: (nchannels, sampwidth, framerate) of all sources
+    :param lengths: number of frames of each source, ignored for silence
+    :param window: maximum number of files decoded at the same time
+    '''
+    def __init__(self, sources: List[Union[Callable[[], Awaitable[wave.Wave_read]], float]],
+                 params: Tuple[int, int, int], lengths: List[int],
+                 window: int = 2, chunk_frames: int = 2 ** 16) -> None:
+        if not any(callable(s) for s in sources):
+            raise ValueError("No audio stream to merge!")
+        if isinstance(sources[0], float):
+            raise ValueError("Unable to insert silence at the beginning!")
+
+        self._sources = sources
+        self._window = max(window, 1)
+        self._chunk_frames = chunk_frames
+
+        nchannels, sampwidth, framerate = params[:3]
+        self._lengths = [round(framerate * s) if isinstance(s, float) else n for s, n in zip(sources, lengths)]
+        self.nframes = sum(self._lengths)
+        self.params = _wave_params(nchannels, sampwidth, framerate, self.nframes, 'NONE', 'not compressed')
+        self.header = _wave_header(nchannels, sampwidth, framerate, self.nframes)
+
+    @property
+    def nbytes(self) -> int:
+        ''' total size of the generated wave stream '''
+        return len(self.header) + self.nframes * self.params.nchannels * self.params.sampwidth
+
+    async def __aiter__(self):
+        yield self.header
+        async for chunk in self.aiter_frames():
+            yield chunk
+
+    async def aiter_frames(self):
+        ''' yield blocks of merged frames without the wave header '''
+        framesize = self.params.nchannels * self.params.sampwidth
+        silence = memoryview(bytes(self._chunk_frames * framesize))
+        tasks: List[Optional[asyncio.Future]] = [None] * len(self._sources)
+        started = 0
+
+        def schedule(current: int):
+            nonlocal started
+            while started < len(self._sources):
+                if sum(t is not None for t in tasks[current:started]) >= self._window:
+                    break
+                source = self._sources[started]
+                if callable(source):
+                    tasks[started] = asyncio.ensure_future(source())
+                started += 1
+
+        try:
+            for idx, expected in enumerate(self._lengths):
+                schedule(idx)
+                remaining = expected
+                if tasks[idx] is not None:
+                    wave_in = await tasks[idx]
+                    try:
+                        if wave_in.getparams()[:3] != self.params[:3]:
+                            raise ValueError("Inconsistent audio format between streams!")
+                        piped = hasattr(wave_in, "readframes_async") # read without blocking the loop
+                        while remaining > 0:
+                            nframes = min(remaining, self._chunk_frames)
+                            chunk = await wave_in.readframes_async(nframes) if piped else wave_in.readframes(nframes)
+                            if not chunk:
+                                raise ValueError("Stream %d ends %d frames earlier than its probed length %d"
+                                                 % (idx, remaining, expected))
+                            remaining -= len(chunk) // framesize
+                            yield chunk
+                        if (await wave_in.readframes_async(1)) if piped else wave_in.readframes(1):
+                            raise ValueError("Stream %d is longer than its probed length %d" % (idx, expected))
+                    finally:
+                        wave_in.close()
+                        tasks[idx] = None
+
+                while remaining > 0: # silence
+                    nframes = min(remaining, self._chunk_frames)
+                    yield silence[:nframes * framesize]
+                    remaining -= nframes
+        finally:
+            for task in tasks:
+                if task is None:
+                    continue
+                if task.done():
+                    if not task.cancelled() and task.exception() is None:
+                        task.result().close()
+                else:
+                    task.cancel()
+
+class TeeWaveStream:
+    '''
+    Split a wave stream into branches that are consumed concurrently (e.g. by several encoders), so that the
+    source is decoded only once. Each branch buffers at most `depth` blocks, thus the slowest consumer sets the
+    pace. A branch that is closed before being exhausted is detached from the source.
+
+    :param stream: stream that yields the wave header and then blocks of frames
+    '''
+    def __init__(self, stream: Union[MergedWaveStream, DecodingWaveStream], nbranches: int, depth: int = 4) -> None:
+        self._stream = stream
+        self._queues = [asyncio.Queue(maxsize=depth) for _ in range(nbranches)]
+        self._detached = [False] * nbranches
+        self._producer: Optional[asyncio.Future] = None
+        self.branches = [_TeeBranch(self, i) for i in range(nbranches)]
+
+    async def _produce(self) -> None:
+        try:
+            chunks = self._stream.__aiter__()
+            await chunks.__anext__() # skip the header, it's generated by each branch
+            async for chunk in chunks:
+                for queue, detached in zip(self._queues, self._detached):
+                    if not detached:
+                        await queue.put(chunk)
+            for queue in self._queues:
+                queue.put_nowait(None)
+        except BaseException as e:
+            for queue in self._queues:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(e)
+            if not isinstance(e, Exception):
+                raise
+
+    async def _get(self, index: int) -> Optional[bytes]:
+        if self._producer is None:
+            self._producer = asyncio.ensure_future(self._produce())
+        item = await self._queues[index].get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def _detach(self, index: int) -> None:
+        self._detached[index] = True
+        queue = self._queues[index]
+        while not queue.empty(): # unblock the producer
+            queue.get_nowait()
+        if all(self._detached) and self._producer is not None and not self._producer.done():
+            self._producer.cancel()
+
+class _TeeBranch:
+    ''' a branch of TeeWaveStream, it has the same attributes as the source stream '''
+    def __init__(self, tee: TeeWaveStream, index: int) -> None:
+        self._tee = tee
+        self._index = index
+        self.params = tee._stream.params
+        self.nframes = tee._stream.nframes
+        self.header = tee._stream.header
+
+    @property
+    def nbytes(self) -> int:
+        return self._tee._stream.nbytes
+
+    async def __aiter__(self):
+        yield self.header
+        async for chunk in self.aiter_frames():
+            yield chunk
+
+    async def aiter_frames(self):
+        ''' yield blocks of frames without the wave header '''
+        try:
+            while True:
+                chunk = await self._tee._get(self._index)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._tee._detach(self._index)
+
+class HashingWaveStream:
+    '''
+    Pass a wave stream through while computing MD5 of its frames, the digest is available as :attr:`digest`
+    after the stream is exhausted. It only supports asynchronous iteration.
+    '''
+    def __init__(self, stream) -> None:
+        self._stream = stream
+        self.params = stream.params
+        self.nframes = stream.nframes
+        self.header = stream.header
+        self.digest: str = None
+
+    @property
+    def nbytes(self) -> int:
+        return self._stream.nbytes
+
+    async def __aiter__(self):
+        yield self.header
+        async for chunk in self.aiter_frames():
+            yield chunk
+
+    async def aiter_frames(self):
+        ''' yield blocks of frames without the wave header '''
+        md5 = hashlib.md5()
+        if hasattr(self._stream, "aiter_frames"):
+            async for chunk in self._stream.aiter_frames():
+                md5.update(chunk)
+                yield chunk
+        else:
+            for chunk in self._stream.iter_frames():
+                md5.update(chunk)
+                yield chunk
+        self.digest = md5.hexdigest()
+
+async def merge_streams_async(stream: Union[MergedWaveStream, DecodingWaveStream], fout: io.RawIOBase) -> None:
+    '''
+    Write the merged wave stream into a file
+    '''
+    async for chunk in stream:
+        fout.write(chunk)
+
+def _iter_frames_threadsafe(stream: DecodingWaveStream, loop: asyncio.AbstractEventLoop):
+    '''
+    Iterate frames of an asynchronous stream from a worker thread, while the stream runs in the given event loop
+    '''
+    frames = stream.aiter_frames()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(frames.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(frames.aclose(), loop).result()
+
+async def transcode_pipe_async(icodec: AudioCodec, fin: str,
+                               ocodec: AudioCodec, fout: str,
+                               progress_callback: Callable[[float], None] = None,
+                               chunk_size: int = 2 ** 20) -> None:
+    '''
+    Stream decoded wave from decoder's stdout into encoder's stdin. The pipes are pumped on a background
+    thread (spliced in kernel on Linux), so encoding starts when decoding is running and the memory used
+    is bounded by the pipe buffers.
+    '''
+    _logger.info("Transcoding %s to %s through pipe", fin, fout)
+
+    decoder = _popen(icodec._decode_pipe_args(_resolve_pathstr(fin)),
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    encoder = _popen(ocodec._encode_pipe_args(_resolve_pathstr(fout)),
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await transport.pump_async(decoder.stdout, encoder.stdin, progress_callback, chunk_size)
+
+        loop = asyncio.get_running_loop()
+        dretcode, eretcode = await asyncio.gather(
+            loop.run_in_executor(None, decoder.wait), loop.run_in_executor(None, encoder.wait))
+        icodec._assert_retcode(f"{icodec.__class__.__name__} decoder", dretcode)
+        ocodec._assert_retcode(f"{ocodec.__class__.__name__} encoder", eretcode)
+    except BaseException:
+        for proc in (decoder, encoder):
+            _kill_process_group(proc)
+        _remove_files(fout)
+        raise
+    finally:
+        decoder.stdout.close()
+
+    if progress_callback is not None:
+        progress_callback(1.0)
+    _logger.info("Transcoding %s done", fout)
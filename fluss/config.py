@@ -1,63 +1,245 @@
+'''
+Global config of fluss. Defaults are defined here, and they are overridden by ~/.fluss.yaml,
+which is loaded on the first access of global_config rather than on import.
+
+Jobs should be executed with an immutable snapshot of the config rather than global_config, so that concurrent
+jobs with different settings don't interfere. Snapshots are layered as defaults <- ~/.fluss.yaml <- library
+(.fluss.yaml in the root of the input library) <- job.
+'''
+
 from pathlib import Path
+from typing import Union
 import addict
-import yaml
 
-global_config = addict.Dict()
+default_config = addict.Dict()
 
-# path to encoders and decoders
-global_config.path.wavpack = ""
-global_config.path.wvunpack = ""
-global_config.path.flac = ""
-global_config.path.mac = ""
-global_config.path.takc = ""
-global_config.path.tta = ""
-global_config.path.refalac = ""
-global_config.path.arcue = ""
+# path to encoders and decoders, empty to search in PATH
+default_config.path.wavpack = ""
+default_config.path.wvunpack = ""
+default_config.path.flac = ""
+default_config.path.mac = ""
+default_config.path.takc = ""
+default_config.path.tta = ""
+default_config.path.refalac = ""
+default_config.path.arcue = ""
 
 # encoder preset configs
-global_config.audio_codecs.wavpack.type = "wavpack"
-global_config.audio_codecs.wavpack.encode = ["-m"]
-global_config.audio_codecs.wavpack_hybrid.type = "wavpack"
-global_config.audio_codecs.wavpack_hybrid.encode = ["-m", "-b192", "-c"]
-global_config.audio_codecs.wavpack_hybrid_high.type = "wavpack"
-global_config.audio_codecs.wavpack_hybrid_high.encode = ["-m", "-hx", "-b192", "-c"]
-global_config.audio_codecs.flac.type = "flac"
-global_config.audio_codecs.flac.encode = []
-global_config.image_codecs.png.type = "png"
-global_config.image_codecs.jpg.type = "jpeg"
-global_config.image_codecs.jpg.quality = 85
+default_config.audio_codecs.wavpack.type = "wavpack"
+default_config.audio_codecs.wavpack.encode = ["-m"]
+default_config.audio_codecs.wavpack_hybrid.type = "wavpack"
+default_config.audio_codecs.wavpack_hybrid.encode = ["-m", "-b192", "-c"]
+default_config.audio_codecs.wavpack_hybrid_high.type = "wavpack"
+default_config.audio_codecs.wavpack_hybrid_high.encode = ["-m", "-hx", "-b192", "-c"]
+default_config.audio_codecs.flac.type = "flac"
+default_config.audio_codecs.flac.encode = []
+default_config.image_codecs.png.type = "png"
+default_config.image_codecs.jpg.type = "jpeg"
+default_config.image_codecs.jpg.quality = 85
+
+# audio pipeline options
+default_config.pipeline.streaming = False  # pipe decoder output into encoder directly instead of buffering whole file
+default_config.pipeline.chunk_size = 1048576  # size of the buffer when streaming through pipes
+default_config.pipeline.transport = "pipe"  # "pipe" to stream decoder output through bounded buffers if the codec supports pipes, "file" to let decoders write temp files
+default_config.pipeline.pipe_buffers = 8  # chunks of chunk_size buffered ahead of the reader for each decoder streamed through pipe
+default_config.pipeline.flac_backend = "binary"  # "binary" to call flac executable, "soundfile" to use libFLAC in process
+default_config.pipeline.decode_window = 2  # number of files decoded ahead when merging tracks, 0 decodes all files before encoding
+default_config.pipeline.dsd_pcm_rate = 88200  # sample rate of PCM converted from DSD, scaled to 96000 for DSD based on 48kHz
+default_config.pipeline.analyze = False  # compute PCM MD5, peak and loudness (ReplayGain 2.0) of tracks while merging or converting
+default_config.pipeline.verify = False  # decode each encoded output and compare MD5 of its frames with the input audio
+
+# the sections below configure resources shared by all jobs of a process (see global_sections),
+# they can only be set in ~/.fluss.yaml rather than library configs or recipes
+
+# cache of decoded audio, keyed by source file path, size, mtime and content hash
+default_config.decode_cache.path = ""  # empty means ~/.cache/fluss/decode
+default_config.decode_cache.max_size = 0  # size budget in bytes, 0 disables the cache
+
+# scratch space for temporary files of codecs
+default_config.scratch.path = ""  # directory of temp files on disk, empty means $TMP/fluss
+default_config.scratch.ram_path = ""  # RAM-backed directory (e.g. /dev/shm) preferred over disk, empty to disable
+default_config.scratch.quota = 0  # maximum bytes of temp files used by concurrent jobs, 0 means unlimited
+default_config.scratch.min_free = 1073741824  # bytes kept free on the device of a scratch directory, otherwise the next one is used
+
+# versions and features of codec binaries
+default_config.tools.cache_path = ""  # file caching probe results of binaries, empty means ~/.cache/fluss/tools-<hostname>.json
+
+# AccurateRip verification
+default_config.accurip.cache_path = ""  # file storing verification results, empty means ~/.cache/fluss/accurip.json
+default_config.accurip.max_workers = 0  # maximum number of concurrent ARCue processes, 0 means number of CPU cores
+
+# persistent queue of batch jobs
+default_config.jobs.path = ""  # SQLite database of jobs, empty means ~/.cache/fluss/jobs.sqlite
+default_config.jobs.lease = 600  # seconds before a running job without heartbeat is considered abandoned
+default_config.jobs.max_attempts = 3  # number of attempts of a failed job before it's given up by workers
+
+# logging of applications, records are written by a background thread
+default_config.logging.path = ""  # log file, {host} and {pid} are replaced for per-worker files, empty means ~/.fluss.log
+default_config.logging.level = "DEBUG"  # level of the root logger
+default_config.logging.levels = {}  # levels of specific loggers, e.g. {"fluss.transport": "WARNING"}
+default_config.logging.format = "text"  # "text" for plain lines, "json" for JSON lines
+default_config.logging.max_bytes = 10485760  # rotate the log file when it exceeds this size, 0 disables rotation
+default_config.logging.backup_count = 3  # number of rotated log files kept
 
 # define possible output formats
-global_config.organizer.output_format.indie = "[{artist}][{partnumber}][{yymmdd}({event})][{collaboration}] {title}"
-global_config.organizer.output_format.commercial = "[{artist}][{yymmdd}({event})][{partnumber}] {title}"
-global_config.organizer.output_format.acg = "[{yymmdd}({event})][{artist}] {title}"
-global_config.organizer.output_format.indie_collection = "[{partnumber}][{yymmdd}({event})] {title}"
+default_config.organizer.output_format.indie = "[{artist}][{partnumber}][{yymmdd}({event})][{collaboration}] {title}"
+default_config.organizer.output_format.commercial = "[{artist}][{yymmdd}({event})][{partnumber}] {title}"
+default_config.organizer.output_format.acg = "[{yymmdd}({event})][{artist}] {title}"
+default_config.organizer.output_format.indie_collection = "[{partnumber}][{yymmdd}({event})] {title}"
 
 # define default output codec for various contents
-global_config.organizer.output_codec.image = "png"
-global_config.organizer.output_codec.audio = "wavpack_hybrid_high"
-global_config.organizer.output_codec.text = "utf-8-sig"
+default_config.organizer.output_codec.image = "png"
+default_config.organizer.output_codec.audio = "wavpack_hybrid_high"
+default_config.organizer.output_codec.text = "utf-8-sig"
 
 # some other options
-global_config.organizer.default_output_dir = r""
-global_config.organizer.artist_splitter = r",\s+|;\s+"  # regex expression for splitting artist
-global_config.organizer.keyword_splitter = r';| - |\[|\]|\(|\)'  # regex expression for splitting keyword
+default_config.organizer.default_output_dir = r""
+default_config.organizer.max_workers = 0  # maximum number of targets executed concurrently, 0 means number of CPU cores
+default_config.organizer.artist_splitter = r",\s+|;\s+"  # regex expression for splitting artist
+default_config.organizer.keyword_splitter = r';| - |\[|\]|\(|\)'  # regex expression for splitting keyword
+
+class _LazyConfig(addict.Dict):
+    ''' addict.Dict that loads the config file on the first read '''
+    def __getitem__(self, name):
+        if not _loaded:
+            load_config()
+        return super().__getitem__(name)
+
+    def __contains__(self, name):
+        if not _loaded:
+            load_config()
+        return super().__contains__(name)
+
+    def __iter__(self):
+        if not _loaded:
+            load_config()
+        return super().__iter__()
+
+    def get(self, name, default=None):
+        if not _loaded:
+            load_config()
+        return super().get(name, default)
+
+    def items(self):
+        if not _loaded:
+            load_config()
+        return super().items()
+
+    def to_dict(self):
+        if not _loaded:
+            load_config()
+        return super().to_dict()
 
-# load config from file
 config_path = Path("~/.fluss.yaml").expanduser()
-if config_path.exists():
-    with config_path.open("r", encoding="utf-8-sig") as fin:
-        saved_config = yaml.safe_load(fin)
-        global_config.update(addict.Dict(saved_config))
-else:
-    with config_path.open("w", encoding="utf-8-sig") as fout:
-        fout.write("# This file contains the configs for Fluss organizer.\n")
-        yaml.dump(global_config.to_dict(), fout, encoding="utf-8", allow_unicode=True)
-
-# setting up logging
-import logging
-logging.basicConfig(level=logging.DEBUG,
-                    handlers=[logging.FileHandler(filename=Path("~/.fluss.log").expanduser(), 
-                                                  encoding='utf-8', mode='a+')],
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M:%S')
+_loaded = False
+global_config = _LazyConfig(default_config)
+
+def load_config() -> None:
+    '''
+    Load config from file into global_config, a config file with default values is created if it doesn't exist
+    '''
+    global _loaded
+    _loaded = True
+    import yaml
+
+    if config_path.exists():
+        with config_path.open("r", encoding="utf-8-sig") as fin:
+            saved_config = yaml.safe_load(fin)
+            global_config.update(addict.Dict(saved_config))
+    else:
+        with config_path.open("w", encoding="utf-8-sig") as fout:
+            fout.write("# This file contains the configs for Fluss organizer.\n")
+            yaml.dump(global_config.to_dict(), fout, encoding="utf-8", allow_unicode=True)
+
+class ConfigSnapshot(addict.Dict):
+    '''
+    Immutable copy of the config, sections are snapshots as well and lists are converted to tuples.
+    Reading a missing key raises KeyError (AttributeError for attribute access) instead of creating it.
+    It's pickled as a plain dict, so that it can be sent to worker processes cheaply.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        object.__setattr__(self, '__frozen', True)
+
+    @classmethod
+    def _hook(cls, item):
+        if isinstance(item, dict):
+            return item if isinstance(item, cls) else cls(item)
+        elif isinstance(item, (list, tuple)):
+            return tuple(cls._hook(elem) for elem in item)
+        return item
+
+    def __setitem__(self, name, value):
+        if object.__getattribute__(self, '__frozen'):
+            raise TypeError("Config snapshot is read-only, use layer() to derive a new one")
+        super().__setitem__(name, value)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Config snapshot is read-only, use layer() to derive a new one")
+
+    __delitem__ = __delattr__ = __ior__ = _read_only
+    update = setdefault = pop = popitem = clear = _read_only
+
+    def __getattr__(self, item):
+        if item.startswith('__'): # special methods looked up by copy, pickle, etc.
+            raise AttributeError(item)
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError("Config has no option %r" % item) from None
+
+    def __reduce__(self):
+        return (ConfigSnapshot, (self.to_dict(),))
+
+    def copy(self):
+        return self
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def layer(self, *overrides: dict) -> "ConfigSnapshot":
+        '''
+        Derive a snapshot with the overrides merged section by section over this one,
+        ValueError is raised if an override contains any of global_sections
+        '''
+        merged = addict.Dict(self.to_dict())
+        for override in overrides:
+            if override:
+                shared = global_sections.intersection(override)
+                if shared:
+                    raise ValueError("Config sections %s can only be set in %s" % (", ".join(sorted(shared)), config_path))
+                merged.update(addict.Dict(override))
+        return ConfigSnapshot(merged)
+
+global_sections = frozenset(["decode_cache", "scratch", "tools", "accurip", "jobs", "logging"])
+''' sections of resources shared by all jobs of a process, which are read from global config only '''
+
+library_config_name = ".fluss.yaml"
+
+def load_layer(path: Union[str, Path]) -> dict:
+    '''
+    Load a config layer from YAML file, a directory is looked up for the library config in it.
+    An empty layer is returned if the file doesn't exist.
+    '''
+    path = Path(path)
+    if path.is_dir():
+        path = path / library_config_name
+    if not path.is_file():
+        return {}
+
+    import yaml
+    with path.open("r", encoding="utf-8-sig") as fin:
+        return yaml.safe_load(fin) or {}
+
+def snapshot(*overrides: dict, library: Union[str, Path] = None) -> ConfigSnapshot:
+    '''
+    Take an immutable snapshot of global config for a job
+
+    :param library: root folder of the input library, whose .fluss.yaml overrides the global config
+    :param overrides: per-job settings overriding all other layers, e.g. dict(pipeline=dict(verify=True)).
+        Neither the library config nor overrides can contain global_sections.
+    '''
+    layers = [load_layer(library)] if library is not None else []
+    return ConfigSnapshot(global_config.to_dict()).layer(*layers, *overrides)
@@ -0,0 +1,283 @@
+'''
+Durable queue of batch jobs stored in SQLite, so that long batch conversions can be resumed after a crash
+or restart. Jobs are grouped by batch and identified by a key unique in the batch. Workers in different
+threads or processes can claim jobs concurrently, a claimed job is leased to the worker until it's
+finished or the lease expires.
+'''
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+from .config import global_config
+
+_logger = logging.getLogger("fluss.jobs")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+Job = namedtuple('Job', 'id batch key status payload output attempts worker '
+                        'created_at started_at finished_at elapsed error')
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT,
+    output TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    elapsed REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (batch, key)
+);
+CREATE TABLE IF NOT EXISTS job_deps (
+    job INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    dep INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    PRIMARY KEY (job, dep)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (batch, status);
+'''
+
+_columns = "id, batch, key, status, payload, output, attempts, worker, created_at, started_at, finished_at, elapsed, error"
+
+def default_worker_name() -> str:
+    ''' identify the worker by host, process and thread '''
+    return "%s:%d:%d" % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+class JobQueue:
+    '''
+    Persistent job queue backed by a SQLite database
+
+    :param lease: seconds before a running job without heartbeat is considered abandoned
+    :param max_attempts: a failed job is retried until it has been attempted this many times
+    '''
+    def __init__(self, path: Union[str, Path], lease: float = 600., max_attempts: int = 3) -> None:
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._lease = lease
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        # transactions are managed explicitly, claiming a job needs a write lock from the beginning
+        self._conn = sqlite3.connect(str(self._path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_schema)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self, func, *args):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _to_job(row) -> Job:
+        job = Job(*row)
+        return job._replace(payload=json.loads(job.payload) if job.payload else None)
+
+    def add(self, batch: str, key: str, payload: dict = None, output: str = None,
+            depends: Iterable[str] = (), reset: bool = False) -> Job:
+        '''
+        Add a job to the batch if it doesn't exist yet. An existing job keeps its status so that finished jobs
+        are not repeated when a batch is resumed, unless reset is True (its attempts are kept for the record).
+
+        :param depends: keys of the jobs in the same batch that must be done before this job is claimed
+        '''
+        return self._add(batch, key, payload, output, depends, reset, False)
+
+    def sync(self, batch: str, key: str, payload: dict = None, output: str = None,
+             depends: Iterable[str] = ()) -> Job:
+        '''
+        Add a job to the batch, an existing job is reset if its payload changed (e.g. the inputs or settings of
+        the target changed) and it's not running. Resuming a batch then repeats the changed and unfinished jobs.
+        '''
+        return self._add(batch, key, payload, output, depends, False, True)
+
+    def _add(self, batch: str, key: str, payload: Optional[dict], output: Optional[str],
+             depends: Iterable[str], reset: bool, reset_changed: bool) -> Job:
+        encoded = json.dumps(payload) if payload is not None else None
+        output = str(output) if output is not None else None
+
+        def add_job():
+            now = time.time()
+            self._conn.execute("INSERT OR IGNORE INTO jobs (batch, key, status, payload, output, created_at) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", (batch, key, PENDING, encoded, output, now))
+            if reset or reset_changed:
+                cond, args = "batch = ? AND key = ?", (batch, key)
+                if not reset:
+                    cond += " AND status != ? AND payload IS NOT ?"
+                    args += (RUNNING, encoded)
+                self._conn.execute("UPDATE jobs SET status = ?, payload = ?, output = ?, worker = NULL, "
+                                   f"lease_until = NULL, error = NULL WHERE {cond}",
+                                   (PENDING, encoded, output) + args)
+            job_id, = self._conn.execute("SELECT id FROM jobs WHERE batch = ? AND key = ?", (batch, key)).fetchone()
+            for dep in depends:
+                self._conn.execute("INSERT OR IGNORE INTO job_deps (job, dep) "
+                                   "SELECT ?, id FROM jobs WHERE batch = ? AND key = ?", (job_id, batch, dep))
+            return job_id
+
+        return self.get(self._transaction(add_job))
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def find(self, batch: str, key: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_columns} FROM jobs WHERE batch = ? AND key = ?", (batch, key)).fetchone()
+        return self._to_job(row) if row else None
+
+    def jobs(self, batch: str) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_columns} FROM jobs WHERE batch = ? ORDER BY id", (batch,)).fetchall()
+        return [self._to_job(r) for r in rows]
+
+    def summary(self, batch: str) -> Dict[str, int]:
+        ''' number of jobs in each status '''
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status", (batch,))
+            return dict(rows.fetchall())
+
+    def _recover(self, batch: Optional[str]) -> int:
+        now = time.time()
+        cond = "status = ? AND lease_until < ?" + (" AND batch = ?" if batch is not None else "")
+        args = (RUNNING, now) + ((batch,) if batch is not None else ())
+        return self._conn.execute(f"UPDATE jobs SET status = '{PENDING}', worker = NULL, lease_until = NULL, "
+                                  f"error = 'abandoned by worker ' || worker WHERE {cond}", args).rowcount
+
+    def recover(self, batch: str = None, force: bool = False) -> int:
+        '''
+        Put running jobs whose lease expired back to the queue, all running jobs are recovered if force is
+        True (e.g. when the only worker restarts). Return the number of recovered jobs.
+        '''
+        def recover_jobs():
+            if force:
+                self._conn.execute("UPDATE jobs SET lease_until = 0 WHERE status = ?" +
+                                   (" AND batch = ?" if batch is not None else ""),
+                                   (RUNNING,) + ((batch,) if batch is not None else ()))
+            return self._recover(batch)
+
+        count = self._transaction(recover_jobs)
+        if count:
+            _logger.info("Recovered %d abandoned jobs", count)
+        return count
+
+    def retry(self, batch: str) -> int:
+        '''
+        Put failed jobs of the batch back to the queue, each of them is attempted once more.
+        Return the number of jobs to retry.
+        '''
+        return self._transaction(lambda: self._conn.execute(
+            "UPDATE jobs SET status = ? WHERE batch = ? AND status = ?", (PENDING, batch, FAILED)).rowcount)
+
+    def claim(self, batch: str, worker: str = None, key: str = None) -> Optional[Job]:
+        '''
+        Claim a pending job in the batch whose dependencies are all done, None if there's no such job.
+        A specific job can be claimed by its key.
+        '''
+        worker = worker or default_worker_name()
+
+        def claim_job():
+            self._recover(batch)
+            query = (f"SELECT id FROM jobs j WHERE batch = ? AND status = '{PENDING}' AND NOT EXISTS ("
+                     f"SELECT 1 FROM job_deps d JOIN jobs p ON p.id = d.dep WHERE d.job = j.id AND p.status != '{DONE}')")
+            args = (batch,)
+            if key is not None:
+                query += " AND key = ?"
+                args += (key,)
+            row = self._conn.execute(query + " ORDER BY id LIMIT 1", args).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            self._conn.execute("UPDATE jobs SET status = ?, worker = ?, lease_until = ?, started_at = ?, "
+                               "attempts = attempts + 1, error = NULL WHERE id = ?",
+                               (RUNNING, worker, now + self._lease, now, row[0]))
+            return row[0]
+
+        job_id = self._transaction(claim_job)
+        return self.get(job_id) if job_id is not None else None
+
+    def heartbeat(self, job_id: int) -> None:
+        ''' extend the lease of a running job '''
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                               (time.time() + self._lease, job_id, RUNNING))
+
+    def _finish(self, job_id: int, status: str, output: Optional[str], error: Optional[str]) -> None:
+        now = time.time()
+        self._transaction(lambda: self._conn.execute(
+            "UPDATE jobs SET status = ?, output = COALESCE(?, output), error = ?, finished_at = ?, "
+            "elapsed = elapsed + (? - COALESCE(started_at, ?)), worker = NULL, lease_until = NULL WHERE id = ?",
+            (status, output, error, now, now, now, job_id)))
+
+    def complete(self, job_id: int, output: Union[str, Path] = None) -> None:
+        ''' mark the job done, a pending job can be completed directly if its output turns out to be up to date '''
+        self._finish(job_id, DONE, str(output) if output is not None else None, None)
+
+    def fail(self, job_id: int, error: str, retry: bool = True) -> None:
+        '''
+        Record the failure of a job. It's put back to the queue if retry is True and it has attempts left.
+        '''
+        job = self.get(job_id)
+        status = PENDING if retry and job.attempts < self._max_attempts else FAILED
+        self._finish(job_id, status, None, error)
+        _logger.warning("Job %s failed (attempt %d): %s", job.key, job.attempts, error)
+
+    def release(self, job_id: int) -> None:
+        '''
+        Put a running job back to the queue without counting the attempt, e.g. when its execution is cancelled
+        '''
+        self._transaction(lambda: self._conn.execute(
+            "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), worker = NULL, lease_until = NULL "
+            "WHERE id = ? AND status = ?", (PENDING, job_id, RUNNING)))
+
+async def keep_alive(queue: JobQueue, job_id: int) -> None:
+    ''' renew the lease of a running job periodically until cancelled '''
+    while True:
+        await asyncio.sleep(queue._lease / 3)
+        queue.heartbeat(job_id)
+
+_job_queue = None
+
+def get_job_queue() -> JobQueue:
+    '''
+    Get the job queue configured by jobs.path in global config
+    '''
+    global _job_queue
+    path = Path(global_config.jobs.path or Path("~/.cache/fluss/jobs.sqlite").expanduser())
+    if _job_queue is None or _job_queue._path != path:
+        _job_queue = JobQueue(path, lease=global_config.jobs.lease, max_attempts=global_config.jobs.max_attempts)
+    return _job_queue
@@ -0,0 +1,90 @@
+'''
+Logging of applications. Records are put into a queue by the logging threads (usually the event loop) and
+written by a background listener thread, so that slow file systems (e.g. NFS) don't stall codec pipelines.
+Concurrent workers should log into separate files by putting {host} and {pid} into logging.path of config.
+'''
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import socket
+from pathlib import Path
+from typing import Optional
+
+from .config import global_config
+
+_text_format = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+_text_datefmt = '%m-%d %H:%M:%S'
+
+class JsonFormatter(logging.Formatter):
+    ''' format records as JSON lines '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(time=record.created, level=record.levelname, logger=record.name,
+                     process=record.process, thread=record.threadName, message=record.getMessage())
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only merge the arguments (which could be changed later), formatting is left to the listener thread
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+def log_file_path() -> Path:
+    ''' path of the log file of this process '''
+    path = global_config.logging.path or "~/.fluss.log"
+    return Path(path.format(host=socket.gethostname(), pid=os.getpid())).expanduser()
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging() -> None:
+    '''
+    Log into the file given by the logging section of config through a background thread,
+    it's called by the entry points of applications
+    '''
+    global _listener
+    if _listener is not None:
+        return
+
+    conf = global_config.logging
+    path = log_file_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if conf.max_bytes:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=conf.max_bytes,
+                                                       backupCount=conf.backup_count, encoding='utf-8')
+    else:
+        handler = logging.FileHandler(path, mode='a', encoding='utf-8')
+    if conf.format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(_text_format, datefmt=_text_datefmt))
+
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root = logging.getLogger()
+    root.addHandler(_QueueHandler(records))
+    root.setLevel(conf.level)
+    for name, level in (conf.levels or {}).items():
+        logging.getLogger(name).setLevel(level)
+
+def stop_logging() -> None:
+    ''' flush queued records and stop the listener thread '''
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _QueueHandler):
+            root.removeHandler(handler)
+    _listener = None
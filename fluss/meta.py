@@ -13,6 +13,7 @@ from PIL import Image
 from fluss import cuesheet
 from fluss.cuesheet import Cuesheet, CuesheetTrack, _default_cuesheet_file
 from fluss.codecs import APETagFiles, ID3TagFiles
+from fluss.analysis import AudioAnalysis
 
 def assert_field(v1, v2, field_name):
     assert not v1 or not v2 or v1 == v2, f"Inconsistent {field_name} between cuesheet and metadata!"
@@ -137,6 +138,8 @@ class DiscMeta:
     cover: bytes
     discnumber: int
     partnumber: str
+    analysis: AudioAnalysis
+    ''' MD5, peak and loudness of the audio, only available after analyzed during conversion '''
 
     _cuesheet: Cuesheet
 
@@ -151,6 +154,7 @@ class DiscMeta:
         self.cover = None
         self.partnumber = None
         self.discnumber = None
+        self.analysis = None
 
     def __str__(self) -> str:
         str_tracks = [f"\n\t{i+1:02} " + str(t).replace("\n", "\n\t") for i, t in enumerate(self.tracks)] # indent
@@ -456,6 +460,24 @@ class DiscMeta:
     def full_artist(self) -> str:
         return ', '.join(self.artists) if self.artists else None
 
+    def _replaygain_tags(self) -> Dict[str, str]:
+        '''
+        ReplayGain tags from the analysis, track gain is only given if the file contains a single track
+        '''
+        tags = dict()
+        if self.analysis is None:
+            return tags
+
+        if self.analysis.gain is not None:
+            tags['REPLAYGAIN_ALBUM_GAIN'] = "%.2f dB" % self.analysis.gain
+        tags['REPLAYGAIN_ALBUM_PEAK'] = "%.6f" % self.analysis.peak
+        if len(self.analysis.tracks) == 1:
+            track = self.analysis.tracks[0]
+            if track.gain is not None:
+                tags['REPLAYGAIN_TRACK_GAIN'] = "%.2f dB" % track.gain
+            tags['REPLAYGAIN_TRACK_PEAK'] = "%.6f" % track.peak
+        return tags
+
     def to_flac(self, flac_meta: FLAC, builtin_cuesheet=False) -> None:
         '''
         :param builtin_cuesheet: Whether to use the cuesheet field builtin FLAC specs
@@ -497,6 +519,9 @@ class DiscMeta:
             add_if_exist(self.cuesheet.catalog, 'Catalog')
             add_if_exist(self.cuesheet.rems.get('COMMENT', None), 'Comment')
 
+        for key, value in self._replaygain_tags().items():
+            flac_meta.tags[key] = value
+
         flac_meta.save()
 
     def to_id3(self, id3_meta: ID3) -> None:
@@ -533,6 +558,9 @@ class DiscMeta:
             add_if_exist(self.cuesheet.rems.get('UPC', None), 'UPC')
             add_if_exist(self.cuesheet.rems.get('COMMENT', None), 'COMMENT')
 
+        for key, value in self._replaygain_tags().items():
+            add_if_exist(value, key)
+
         ape_meta.save()
 
     def to_mutagen(self, mutagen_file: mutagen.FileType) -> None:
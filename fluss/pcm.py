@@ -0,0 +1,199 @@
+'''
+PCM frame containers that expose the reading API of wave.Wave_read, and conversions between
+interleaved little-endian frames and NumPy arrays (NumPy is only required by the conversions).
+'''
+
+import mmap
+import struct
+import weakref
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable, Union
+
+_wave_params = namedtuple('_wave_params', 'nchannels sampwidth framerate nframes comptype compname')
+
+class PCMBuffer:
+    '''
+    Interleaved PCM frames kept in memory. Frames are returned as memoryview slices without copying.
+    '''
+    def __init__(self, data: Union[bytes, bytearray, memoryview], nchannels: int, sampwidth: int, framerate: int) -> None:
+        self._data = memoryview(data).cast('B')
+        self._nchannels = nchannels
+        self._sampwidth = sampwidth
+        self._framerate = framerate
+        self._framesize = nchannels * sampwidth
+        self._nframes = len(self._data) // self._framesize
+        self._pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self._data = None
+
+    def getnchannels(self) -> int:
+        return self._nchannels
+
+    def getsampwidth(self) -> int:
+        return self._sampwidth
+
+    def getframerate(self) -> int:
+        return self._framerate
+
+    def getnframes(self) -> int:
+        return self._nframes
+
+    def getcomptype(self) -> str:
+        return 'NONE'
+
+    def getcompname(self) -> str:
+        return 'not compressed'
+
+    def getparams(self) -> _wave_params:
+        return _wave_params(self._nchannels, self._sampwidth, self._framerate,
+                            self._nframes, self.getcomptype(), self.getcompname())
+
+    def rewind(self) -> None:
+        self._pos = 0
+
+    def tell(self) -> int:
+        return self._pos
+
+    def setpos(self, pos: int) -> None:
+        if pos < 0 or pos > self._nframes:
+            raise ValueError("position not in range")
+        self._pos = pos
+
+    @property
+    def frames(self) -> memoryview:
+        ''' all frames as a flat byte view '''
+        return self._data
+
+    def readframes(self, nframes: int) -> memoryview:
+        end = min(self._pos + nframes, self._nframes)
+        chunk = self._data[self._pos * self._framesize:end * self._framesize]
+        self._pos = end
+        return chunk
+
+    def as_array(self):
+        ''' all frames as NumPy array with shape (nframes, nchannels) '''
+        return frames_to_array(self._data, self._sampwidth, self._nchannels)
+
+def _parse_wave_header(buf: Union[bytes, mmap.mmap]):
+    '''
+    Parse header of a PCM wave file
+
+    :return: (nchannels, sampwidth, framerate, offset of data, size of data)
+    '''
+    if len(buf) < 12 or buf[:4] != b'RIFF' or buf[8:12] != b'WAVE':
+        raise ValueError("Not a wave file!")
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', buf, pos)
+        pos += 8
+        if chunk_id == b'fmt ':
+            format_tag, nchannels, framerate, _, _, bits = struct.unpack_from('<HHIIHH', buf, pos)
+            if format_tag not in (0x0001, 0xFFFE): # PCM and WAVE_FORMAT_EXTENSIBLE
+                raise ValueError("Unsupported wave format: %d" % format_tag)
+            fmt = nchannels, (bits + 7) // 8, framerate
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("Missing fmt chunk before data!")
+            # size could be invalid if the wave is written by a streaming encoder
+            if chunk_size in (0, 0xFFFFFFFF) or pos + chunk_size > len(buf):
+                chunk_size = len(buf) - pos
+            return fmt + (pos, chunk_size)
+        pos += chunk_size + (chunk_size & 1)
+
+    raise ValueError("Missing data chunk in wave file!")
+
+def _release_mapping(mapping: mmap.mmap, path: Path = None, on_release: Callable[[], None] = None) -> None:
+    try:
+        mapping.close()
+    except BufferError: # frames are still referenced, the mapping will be released with them
+        pass
+    if path is not None:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+    if on_release is not None:
+        on_release()
+
+class MappedPCM(PCMBuffer):
+    '''
+    PCM frames of a wave file mapped into memory, frames are never copied into the Python heap. The mapping
+    is released on close (or garbage collection), and the file is removed as well if delete is True.
+
+    :param on_release: called after the mapping is released, e.g. to return the scratch space of the file
+    '''
+    def __init__(self, path: Union[str, Path], delete: bool = False, on_release: Callable[[], None] = None) -> None:
+        self.path = Path(path)
+        try:
+            with self.path.open("rb") as fin:
+                self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            nchannels, sampwidth, framerate, offset, size = _parse_wave_header(self._mmap)
+        except BaseException:
+            if getattr(self, "_mmap", None) is not None:
+                self._mmap.close()
+            if delete:
+                self.path.unlink()
+            if on_release is not None:
+                on_release()
+            raise
+
+        super().__init__(memoryview(self._mmap)[offset:offset + size], nchannels, sampwidth, framerate)
+        self._finalizer = weakref.finalize(self, _release_mapping, self._mmap,
+                                           self.path if delete else None, on_release)
+
+    def close(self) -> None:
+        if self._data is not None:
+            self._data.release()
+        super().close()
+        self._finalizer()
+
+def frames_to_array(data: Union[bytes, memoryview], sampwidth: int, nchannels: int):
+    '''
+    Convert wave frames to integer NumPy array with shape (nframes, nchannels). 8 bit samples are
+    converted to signed values and 24 bit samples are returned as int32 scaled to full range.
+    '''
+    import numpy as np
+
+    if sampwidth == 1:
+        array = (np.frombuffer(data, dtype=np.uint8).astype(np.int16) - 128).astype(np.int8)
+    elif sampwidth == 2:
+        array = np.frombuffer(data, dtype='<i2')
+    elif sampwidth == 3:
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(packed), 4), dtype=np.uint8)
+        padded[:, 1:] = packed
+        array = padded.view('<i4').ravel()
+    elif sampwidth == 4:
+        array = np.frombuffer(data, dtype='<i4')
+    else:
+        raise ValueError("Unsupported sample width: %d" % sampwidth)
+    return array.reshape(-1, nchannels)
+
+def array_to_frames(array, sampwidth: int) -> memoryview:
+    '''
+    Convert integer NumPy array with shape (nframes, nchannels) back to wave frames,
+    it's the inverse of :func:`frames_to_array`
+    '''
+    import numpy as np
+
+    if sampwidth == 1:
+        frames = (array.astype(np.int16) + 128).astype(np.uint8)
+    elif sampwidth == 2:
+        frames = array.astype('<i2', copy=False)
+    elif sampwidth == 3:
+        frames = np.ascontiguousarray(array.astype('<i4', copy=False)).view(np.uint8).reshape(-1, 4)[:, 1:]
+    elif sampwidth == 4:
+        frames = array.astype('<i4', copy=False)
+    else:
+        raise ValueError("Unsupported sample width: %d" % sampwidth)
+    return memoryview(np.ascontiguousarray(frames)).cast('B')
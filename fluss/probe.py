@@ -0,0 +1,184 @@
+'''
+Read the exact number of samples of audio files from their stream headers, without decoding or loading tags.
+'''
+
+import mmap
+import struct
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Tuple, Union
+
+ProbeResult = Tuple[int, int]
+''' (number of samples in each channel, sample rate) '''
+
+def _skip_id3(fin: BinaryIO) -> None:
+    ''' skip ID3v2 tag at the beginning of the file, which is allowed before FLAC and TTA streams '''
+    header = fin.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = 0
+        for b in header[6:10]: # syncsafe integer
+            size = (size << 7) | (b & 0x7f)
+        fin.seek(10 + size + (10 if header[5] & 0x10 else 0))
+    else:
+        fin.seek(0)
+
+def _probe_flac(fin: BinaryIO) -> Optional[ProbeResult]:
+    _skip_id3(fin)
+    header = fin.read(42)
+    if len(header) < 42 or header[:4] != b'fLaC' or header[4] & 0x7f != 0: # STREAMINFO must be the first block
+        return None
+
+    # STREAMINFO: 20 bits sample rate, 3 bits channels, 5 bits bits per sample and 36 bits total samples
+    packed, = struct.unpack_from('>Q', header, 18)
+    sample_rate = packed >> 44
+    nsamples = packed & 0xFFFFFFFFF
+    if nsamples == 0: # unknown
+        return None
+    return nsamples, sample_rate
+
+_wavpack_sample_rates = [6000, 8000, 9600, 11025, 12000, 16000, 22050, 24000,
+                         32000, 44100, 48000, 64000, 88200, 96000, 192000]
+
+def _probe_wavpack(fin: BinaryIO) -> Optional[ProbeResult]:
+    header = fin.read(32)
+    if len(header) < 32 or header[:4] != b'wvpk':
+        return None
+
+    _, _, _, _, total_high, total_low, _, _, flags = struct.unpack_from('<4sIHBBIIII', header)
+    if total_low == 0xFFFFFFFF: # unknown
+        return None
+    # upper byte is stored with an offset so that the lower word can be 0xFFFFFFFF
+    total_low -= total_high
+    rate_index = (flags >> 23) & 0xf
+    if rate_index >= len(_wavpack_sample_rates): # custom sample rate stored in metadata
+        return None
+    return (total_high << 32) + total_low, _wavpack_sample_rates[rate_index]
+
+def _probe_monkeysaudio(fin: BinaryIO) -> Optional[ProbeResult]:
+    header = fin.read(76)
+    if len(header) < 32 or header[:4] != b'MAC ':
+        return None
+
+    version, = struct.unpack_from('<H', header, 4)
+    if version >= 3980:
+        # APE_DESCRIPTOR followed by APE_HEADER
+        descriptor_bytes, = struct.unpack_from('<I', header, 8)
+        if len(header) < descriptor_bytes + 24:
+            return None
+        _, _, blocks_per_frame, final_frame_blocks, total_frames, _, _, sample_rate = \
+            struct.unpack_from('<HHIIIHHI', header, descriptor_bytes)
+    else:
+        compression, _, _, sample_rate, _, _, total_frames, final_frame_blocks = \
+            struct.unpack_from('<HHHIIIII', header, 6)
+        if version >= 3950:
+            blocks_per_frame = 73728 * 4
+        elif version >= 3900 or (version >= 3800 and compression == 4000):
+            blocks_per_frame = 73728
+        else:
+            blocks_per_frame = 9216
+
+    if total_frames == 0:
+        return 0, sample_rate
+    return (total_frames - 1) * blocks_per_frame + final_frame_blocks, sample_rate
+
+def _probe_trueaudio(fin: BinaryIO) -> Optional[ProbeResult]:
+    _skip_id3(fin)
+    header = fin.read(18)
+    if len(header) < 18 or header[:4] != b'TTA1':
+        return None
+    _, _, _, sample_rate, nsamples = struct.unpack_from('<HHHII', header, 4)
+    return nsamples, sample_rate
+
+def _probe_tak(fin: BinaryIO) -> Optional[ProbeResult]:
+    from mutagen.tak import TAKHeaderError, TAKInfo
+
+    try:
+        info = TAKInfo(fin) # only parses the metadata blocks at the beginning
+    except TAKHeaderError:
+        return None
+    return info.number_of_samples, info.sample_rate
+
+def _iter_atoms(fin: BinaryIO, end: int):
+    ''' iterate (type, start of payload, end of atom) of MP4 atoms until end '''
+    pos = fin.tell()
+    while pos + 8 <= end:
+        fin.seek(pos)
+        size, atom_type = struct.unpack('>I4s', fin.read(8))
+        payload = pos + 8
+        if size == 1: # 64 bit size
+            size, = struct.unpack('>Q', fin.read(8))
+            payload += 8
+        elif size == 0: # extends to the end
+            size = end - pos
+        if size < payload - pos:
+            return
+        yield atom_type, payload, pos + size
+        pos += size
+
+def _probe_mp4(fin: BinaryIO) -> Optional[ProbeResult]:
+    fin.seek(0, 2)
+    file_end = fin.tell()
+    fin.seek(0)
+
+    def find(atom_type: bytes, start: int, end: int):
+        fin.seek(start)
+        for t, payload, atom_end in _iter_atoms(fin, end):
+            if t == atom_type:
+                yield payload, atom_end
+
+    # the duration in media header of sound track is counted in samples as its timescale is the sample rate
+    for moov in find(b'moov', 0, file_end):
+        for trak in find(b'trak', *moov):
+            for mdia in find(b'mdia', *trak):
+                handlers = list(find(b'hdlr', *mdia))
+                if not handlers:
+                    continue
+                fin.seek(handlers[0][0] + 8)
+                if fin.read(4) != b'soun':
+                    continue
+
+                for mdhd, _ in find(b'mdhd', *mdia):
+                    fin.seek(mdhd)
+                    version = fin.read(4)[0]
+                    if version == 1:
+                        timescale, duration = struct.unpack('>IQ', fin.read(28)[16:])
+                    else:
+                        timescale, duration = struct.unpack('>II', fin.read(16)[8:])
+                    return duration, timescale
+    return None
+
+def _probe_wave(fin: BinaryIO) -> Optional[ProbeResult]:
+    from fluss.pcm import _parse_wave_header
+
+    # map the file so that only the pages of the chunk headers are read
+    with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        try:
+            nchannels, sampwidth, framerate, _, size = _parse_wave_header(buf)
+        except ValueError:
+            return None
+    return size // (nchannels * sampwidth), framerate
+
+_probers: Dict[str, Callable[[BinaryIO], Optional[ProbeResult]]] = {
+    '.flac': _probe_flac,
+    '.wv': _probe_wavpack,
+    '.ape': _probe_monkeysaudio,
+    '.tta': _probe_trueaudio,
+    '.tak': _probe_tak,
+    '.m4a': _probe_mp4,
+    '.wav': _probe_wave,
+}
+
+def probe_length(path: Union[str, Path]) -> Optional[ProbeResult]:
+    '''
+    Read the number of samples and the sample rate from the stream header
+
+    :return: (number of samples in each channel, sample rate), None if the format is not supported or
+        the length is not recorded in the header
+    '''
+    prober = _probers.get(Path(path).suffix.lower())
+    if prober is None:
+        return None
+    with open(path, "rb") as fin:
+        try:
+            return prober(fin)
+        except (struct.error, IndexError, ValueError):
+            return None
@@ -0,0 +1,195 @@
+'''
+Progress reporting. Output of encoders is parsed incrementally in large chunks, and progress of targets is
+published as typed events to a bus, which delivers them to each subscriber at a limited rate. Intermediate
+events are coalesced, so that dozens of concurrent encoders don't flood the event loop (and the GUI).
+'''
+
+import asyncio
+import logging
+import re
+import time
+from collections import namedtuple
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+_logger = logging.getLogger("fluss.progress")
+
+ProgressEvent = namedtuple('ProgressEvent', 'target stage fraction bytes eta')
+# bytes: amount of processed data if it's known
+# eta: estimated seconds until the stage finishes, None if it can't be estimated yet
+
+class OutputProgressParser:
+    '''
+    Parse progress from the output of a codec process. The output is fed in chunks of any size and split
+    into records ending with the separator, each record is matched against the pattern. Only the tail of
+    the output is kept for error messages.
+
+    :param convert: function converting the matched string to progress, or a float added to the progress
+        for each match (for encoders printing a mark per step)
+    :param keep: number of bytes kept from the end of the output
+    '''
+    def __init__(self, pattern: Union[str, bytes],
+                 convert: Union[Callable[[bytes], float], float],
+                 callback: Callable[[float], None],
+                 separator: bytes = b'\r',
+                 keep: int = 2 ** 16) -> None:
+        self._pattern = re.compile(pattern)
+        self._convert = convert
+        self._callback = callback
+        self._separator = separator
+        self._keep = keep
+
+        self._partial = b""
+        self._tail = bytearray()
+        self._progress = 0.
+        self._reported = None
+
+    @property
+    def progress(self) -> float:
+        return self._progress
+
+    def _match(self, record: bytes) -> None:
+        match = self._pattern.search(record)
+        if not match:
+            return
+        if isinstance(self._convert, float):
+            self._progress = min(self._progress + self._convert, 1.)
+        else:
+            self._progress = self._convert(match[0])
+        if self._progress != self._reported: # encoders often print the same progress repeatedly
+            self._reported = self._progress
+            self._callback(self._progress)
+
+    def feed(self, data: bytes) -> None:
+        self._tail += data
+        if len(self._tail) > self._keep:
+            del self._tail[:-self._keep]
+
+        records = (self._partial + data).split(self._separator)
+        self._partial = records.pop()
+        if len(self._partial) > self._keep: # output without separators, e.g. binary garbage
+            self._partial = self._partial[-self._keep:]
+        for record in records:
+            self._match(record + self._separator)
+
+    def close(self) -> bytes:
+        '''
+        Parse the last record without separator
+
+        :return: tail of the output
+        '''
+        if self._partial:
+            self._match(self._partial)
+            self._partial = b""
+        return bytes(self._tail)
+
+async def parse_progress_async(stream: asyncio.StreamReader, parser: OutputProgressParser,
+                               chunk_size: int = 2 ** 16) -> bytes:
+    '''
+    Feed the stream into the parser until its end
+
+    :return: tail of the output
+    '''
+    while True:
+        chunk = await stream.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.close()
+
+class _Subscriber:
+    def __init__(self, callback: Callable[[ProgressEvent], None], interval: float) -> None:
+        self.callback = callback
+        self.interval = interval
+        self._last = -float("inf")
+        self._pending: Dict[Tuple[Hashable, str], ProgressEvent] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _deliver(self, event: ProgressEvent) -> None:
+        try:
+            self.callback(event)
+        except Exception:
+            _logger.exception("Progress subscriber %r failed", self.callback)
+
+    def flush(self) -> None:
+        self._timer = None
+        self._last = time.monotonic()
+        pending, self._pending = self._pending, {}
+        for event in pending.values():
+            self._deliver(event)
+
+    def offer(self, event: ProgressEvent) -> None:
+        key = (event.target, event.stage)
+        if event.fraction >= 1: # final events are never delayed
+            self._pending.pop(key, None)
+            self._deliver(event)
+            return
+
+        self._pending[key] = event
+        if self._timer is not None:
+            return
+        delay = self._last + self.interval - time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # published outside of an event loop, e.g. by synchronous code
+            loop = None
+        if delay <= 0 or loop is None:
+            self.flush()
+        else:
+            self._timer = loop.call_later(delay, self.flush)
+
+    def cancel(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending.clear()
+
+class ProgressBus:
+    '''
+    Publish progress events of targets to subscribers. Each subscriber receives a batch of the latest
+    events at most once per its interval, final events (fraction 1) are delivered immediately.
+    Events should be published from the thread running the event loop.
+    '''
+    def __init__(self) -> None:
+        self._subscribers: List[_Subscriber] = []
+        self._started: Dict[Tuple[Hashable, str], Tuple[float, float]] = {}
+
+    def subscribe(self, callback: Callable[[ProgressEvent], None], interval: float = 0.1) -> Callable[[], None]:
+        '''
+        Subscribe to progress events
+
+        :param interval: minimum seconds between two deliveries to this subscriber
+        :return: function to unsubscribe
+        '''
+        subscriber = _Subscriber(callback, interval)
+        self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            subscriber.cancel()
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        return unsubscribe
+
+    def _eta(self, key: Tuple[Hashable, str], fraction: float, now: float) -> Optional[float]:
+        if fraction >= 1:
+            self._started.pop(key, None)
+            return 0.
+        started = self._started.setdefault(key, (now, fraction))
+        start_time, start_fraction = started
+        if fraction <= start_fraction:
+            return None
+        return (now - start_time) * (1 - fraction) / (fraction - start_fraction)
+
+    def publish(self, target: Hashable, stage: str, fraction: float, bytes: int = None) -> None:
+        fraction = min(max(fraction, 0.), 1.)
+        key = (target, stage)
+        event = ProgressEvent(target, stage, fraction, bytes, self._eta(key, fraction, time.monotonic()))
+        for subscriber in list(self._subscribers):
+            subscriber.offer(event)
+
+    def reporter(self, target: Hashable, stage: str, total_bytes: int = None) -> Callable[[float], None]:
+        '''
+        Adapt the bus to functions taking a progress callback, the processed bytes are estimated from total_bytes
+        '''
+        def report(fraction: float):
+            self.publish(target, stage, fraction, int(fraction * total_bytes) if total_bytes is not None else None)
+        return report
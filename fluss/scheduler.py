@@ -0,0 +1,83 @@
+'''
+Execute a dependency graph of jobs concurrently
+'''
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from networkx import DiGraph, descendants, topological_sort
+
+_logger = logging.getLogger("fluss.scheduler")
+
+class GraphScheduler:
+    '''
+    Run every node of a DiGraph as soon as all of its predecessors finished, with at most
+    max_workers nodes running at the same time. Among the ready nodes, those blocking more
+    nodes are started first so that the critical path is not delayed.
+
+    :param runner: coroutine function called as runner(node, progress_callback) to execute a node
+    :param max_workers: maximum number of concurrent nodes, default to the number of CPU cores
+    :param progress_callback: called as progress_callback(node, node_progress, total_progress)
+    '''
+    def __init__(self, graph: DiGraph,
+                 runner: Callable[[Hashable, Callable[[float], None]], Awaitable[Any]],
+                 max_workers: int = None,
+                 progress_callback: Callable[[Hashable, float, float], None] = None) -> None:
+        self._graph = graph
+        self._runner = runner
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._callback = progress_callback
+
+        self._progress: Dict[Hashable, float] = {n: 0. for n in graph.nodes}
+        self._total = 0.
+
+        # rank nodes by topological order and the number of nodes depending on them
+        order = {n: i for i, n in enumerate(topological_sort(graph))}
+        self._priority = {n: (-len(descendants(graph, n)), order[n]) for n in graph.nodes}
+
+    @property
+    def progress(self) -> float:
+        ''' aggregated progress of all nodes '''
+        return self._total / len(self._progress) if self._progress else 1.
+
+    def _update(self, node: Hashable, progress: float) -> None:
+        progress = min(max(progress, 0.), 1.)
+        self._total += progress - self._progress[node]
+        self._progress[node] = progress
+        if self._callback is not None:
+            self._callback(node, progress, self.progress)
+
+    async def run(self) -> None:
+        '''
+        Execute all nodes. If any node fails, the running ones are cancelled and the exception is raised
+        '''
+        pending = {n: self._graph.in_degree(n) for n in self._graph.nodes}
+        ready = [n for n, d in pending.items() if d == 0]
+        running: Dict[asyncio.Task, Hashable] = {}
+
+        try:
+            while ready or running:
+                ready.sort(key=self._priority.__getitem__)
+                while ready and len(running) < self._max_workers:
+                    node = ready.pop(0)
+                    _logger.debug("Start executing %s", repr(node))
+                    task = asyncio.ensure_future(self._runner(node, lambda p, n=node: self._update(n, p)))
+                    running[task] = node
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node = running.pop(task)
+                    task.result() # raise exception if failed
+                    self._update(node, 1.)
+
+                    for succ in self._graph.successors(node):
+                        pending[succ] -= 1
+                        if pending[succ] == 0:
+                            ready.append(succ)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
@@ -0,0 +1,261 @@
+'''
+Scratch space for temporary files of codecs (e.g. decoded wave files). Files are placed in a RAM-backed
+directory if it's configured and has enough free space, otherwise on disk. The total size of scratch files
+is bounded by a quota, allocations wait until enough space is released by other jobs. A job that already holds
+scratch space is never blocked (it may exceed the quota), otherwise it could wait for itself, e.g. decoding the
+tracks of an album whose encoding temp file is allocated, or jobs could wait for each other. Each process keeps
+its files in a directory locked by itself, so that the directories left by crashed processes can be swept.
+'''
+
+import asyncio
+import atexit
+import contextvars
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from .config import global_config
+
+_logger = logging.getLogger("fluss.scratch")
+
+current_job = contextvars.ContextVar("current_job", default=None)
+''' name of the job that scratch files are accounted to, set by the executor of jobs '''
+
+_run_prefix = "run-"
+_lock_name = ".lock"
+
+def _lock_file(fd: int) -> None:
+    ''' lock the file exclusively without blocking, OSError is raised if it's locked by another process '''
+    if os.name == "nt":
+        import msvcrt
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+class ScratchFile(os.PathLike):
+    '''
+    A file allocated in the scratch space, its size is accounted until it's released. The file is not created.
+    '''
+    def __init__(self, space: "ScratchSpace", path: Path, size: int, job: Optional[str]) -> None:
+        self.path = path
+        self.size = size
+        self.job = job
+        self._space = space
+        self._released = False
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    def release(self) -> None:
+        ''' remove the file and return its space, it's safe to be called more than once and from any thread '''
+        if self._released:
+            return
+        self._released = True
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _logger.warning("Failed to remove scratch file %s: %s", str(self.path), e)
+        self._space._release(self)
+
+class ScratchSpace:
+    '''
+    Allocate scratch files from candidate directories in order of preference
+
+    :param roots: candidate directories, e.g. a directory on tmpfs followed by one on disk
+    :param quota: maximum total size of allocated files in bytes, 0 means unlimited
+    :param min_free: a directory is skipped if allocating in it leaves less free space on its device
+    '''
+    def __init__(self, roots: List[Union[str, Path]], quota: int = 0, min_free: int = 0) -> None:
+        self.roots = [Path(r) for r in roots]
+        self.quota = quota
+        self.min_free = min_free
+
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._used = 0
+        self._job_usage: Dict[Optional[str], int] = defaultdict(int)
+        self._waiters: List[tuple] = []
+        self._run_dirs: Dict[Path, Path] = {}
+        self._lock_files = []
+
+    @property
+    def used(self) -> int:
+        ''' total size of allocated files '''
+        return self._used
+
+    def usage(self) -> Dict[Optional[str], int]:
+        ''' size of allocated files of each job '''
+        with self._lock:
+            return {job: size for job, size in self._job_usage.items() if size}
+
+    def sweep(self, max_age: float = 86400.) -> int:
+        '''
+        Remove directories left by processes that are not running anymore (whose lock can be acquired), and
+        loose files older than max_age seconds (left by old versions). Return the number of removed entries.
+        '''
+        removed = 0
+        for root in self.roots:
+            if not root.is_dir():
+                continue
+            for entry in root.iterdir():
+                if entry.is_file():
+                    try:
+                        if time.time() - entry.stat().st_mtime > max_age:
+                            entry.unlink()
+                            removed += 1
+                    except OSError:
+                        pass
+                    continue
+                if not entry.name.startswith(_run_prefix) or entry in self._run_dirs.values():
+                    continue
+                try:
+                    with open(entry / _lock_name, "a+b") as flock:
+                        _lock_file(flock.fileno())
+                except FileNotFoundError:
+                    pass # the directory is being created or it's already removed
+                except OSError:
+                    continue # locked by a running process
+
+                shutil.rmtree(entry, ignore_errors=True)
+                _logger.info("Removed orphaned scratch directory %s", str(entry))
+                removed += 1
+        return removed
+
+    def _run_dir(self, root: Path) -> Path:
+        ''' directory of this process under the root, locked as long as the process is running '''
+        run_dir = self._run_dirs.get(root)
+        if run_dir is None:
+            run_dir = root / ("%s%d-%x" % (_run_prefix, os.getpid(), random.getrandbits(32)))
+            run_dir.mkdir(parents=True)
+            flock = open(run_dir / _lock_name, "a+b")
+            _lock_file(flock.fileno())
+            self._lock_files.append(flock)
+            self._run_dirs[root] = run_dir
+            atexit.register(shutil.rmtree, run_dir, True)
+        return run_dir
+
+    def _select_root(self, size: int) -> Path:
+        for root in self.roots:
+            try:
+                root.mkdir(parents=True, exist_ok=True)
+                if shutil.disk_usage(root).free - size >= self.min_free:
+                    return root
+            except OSError as e:
+                _logger.debug("Scratch directory %s is not available: %s", str(root), e)
+        _logger.warning("No scratch directory has %d bytes free, using %s", size, str(self.roots[-1]))
+        return self.roots[-1]
+
+    def _reserve_locked(self, size: int, job: Optional[str]) -> bool:
+        # a file larger than the quota is still allowed when nothing else is allocated
+        if self.quota and self._used + size > self.quota and self._used > 0 and not self._job_usage.get(job):
+            return False
+        self._used += size
+        self._job_usage[job] += size
+        return True
+
+    def _try_reserve(self, size: int, job: Optional[str]) -> bool:
+        with self._lock:
+            return self._reserve_locked(size, job)
+
+    def _unreserve(self, size: int, job: Optional[str]) -> None:
+        with self._lock:
+            self._used -= size
+            self._job_usage[job] -= size
+            waiters, self._waiters = self._waiters, []
+            self._released.notify_all()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    def _release(self, scratch: ScratchFile) -> None:
+        self._unreserve(scratch.size, scratch.job)
+
+    def _create(self, size: int, prefix: str, suffix: str, job: Optional[str]) -> ScratchFile:
+        try:
+            root = self._select_root(size)
+            with self._lock:
+                run_dir = self._run_dir(root)
+        except BaseException:
+            self._unreserve(size, job)
+            raise
+        name = "%s%x%s" % (prefix, random.getrandbits(48), suffix)
+        return ScratchFile(self, run_dir / name, size, job)
+
+    def allocate_blocking(self, size: int, prefix: str = '', suffix: str = '') -> ScratchFile:
+        '''
+        Allocate a file for synchronous code, blocking the thread until the quota allows it. In a thread running
+        an event loop it doesn't wait (since the space might be released by the loop itself) but exceeds the quota.
+        '''
+        job = current_job.get()
+        try:
+            asyncio.get_running_loop()
+            in_loop = True
+        except RuntimeError:
+            in_loop = False
+
+        with self._lock:
+            if not self._reserve_locked(size, job):
+                if in_loop:
+                    _logger.warning("Scratch quota is exceeded by %s, since the event loop can't be blocked",
+                                    job or "anonymous job")
+                    self._used += size
+                    self._job_usage[job] += size
+                else:
+                    _logger.info("Waiting for %d bytes of scratch space for %s (%d of %d bytes used)",
+                                 size, job or "anonymous job", self._used, self.quota)
+                    self._released.wait_for(lambda: self._reserve_locked(size, job))
+        return self._create(size, prefix, suffix, job)
+
+    async def allocate(self, size: int, prefix: str = '', suffix: str = '') -> ScratchFile:
+        '''
+        Allocate a file with estimated size, waiting until the quota allows it
+
+        :return: allocated file, which should be released after use
+        '''
+        job = current_job.get()
+        loop = asyncio.get_running_loop()
+        started = None
+        while not self._try_reserve(size, job):
+            if started is None:
+                started = time.time()
+                _logger.info("Waiting for %d bytes of scratch space for %s (%d of %d bytes used)",
+                             size, job or "anonymous job", self._used, self.quota)
+            waiter = loop.create_future()
+            with self._lock:
+                self._waiters.append((loop, waiter))
+            if self._try_reserve(size, job): # released before the waiter is registered
+                break
+            await waiter
+
+        if started is not None:
+            _logger.info("Scratch space for %s is available after %.1fs", job or "anonymous job", time.time() - started)
+        return self._create(size, prefix, suffix, job)
+
+_scratch_space = None
+
+def get_scratch_space() -> ScratchSpace:
+    '''
+    Get the scratch space configured by scratch section in global config, directories left by crashed
+    processes are swept when it's created
+    '''
+    global _scratch_space
+    roots = [Path(global_config.scratch.path or Path(tempfile.gettempdir(), "fluss"))]
+    if global_config.scratch.ram_path:
+        roots.insert(0, Path(global_config.scratch.ram_path, "fluss"))
+
+    if _scratch_space is None or _scratch_space.roots != roots:
+        _scratch_space = ScratchSpace(roots, quota=global_config.scratch.quota, min_free=global_config.scratch.min_free)
+        _scratch_space.sweep()
+    return _scratch_space
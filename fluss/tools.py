@@ -0,0 +1,165 @@
+'''
+Registry of external codec binaries. Each tool is resolved once per process, from its path in config or from
+PATH, and probed for its version and features. Probe results are cached on disk by the path, size and mtime of
+the binary, so that starting a worker doesn't run every binary again. The capabilities of a host can be
+reported before jobs are assigned to it.
+'''
+
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import threading
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .config import ConfigSnapshot, global_config
+
+_logger = logging.getLogger("fluss.tools")
+
+ToolInfo = namedtuple('ToolInfo', 'name path version features')
+
+_ToolSpec = namedtuple('_ToolSpec', 'names args version features')
+# names: executable names searched in PATH
+# args: arguments to print the banner or usage used for probing, None if the tool is not probed
+# version: regex whose first group is the version in the output of probing
+# features: name of each feature and the regex that matches the output if it's supported
+
+_specs: Dict[str, _ToolSpec] = dict(
+    flac=_ToolSpec(["flac"], ["--help"], r"version (\d[\w.]*)", dict(threads=r"--threads")),
+    wavpack=_ToolSpec(["wavpack"], ["--help"], r"[Vv]ersion (\d[\w.]*)", dict(threads=r"--threads")),
+    wvunpack=_ToolSpec(["wvunpack"], ["--help"], r"[Vv]ersion (\d[\w.]*)", dict(threads=r"--threads")),
+    mac=_ToolSpec(["mac", "MAC"], [], r"Monkey's Audio (\d[\w.]*)", dict(threads=r"-threads")),
+    takc=_ToolSpec(["takc", "Takc"], [], r"(\d+\.\d+\.\d+)", dict(threads=r"-tn")),
+    tta=_ToolSpec(["tta", "ttaenc"], [], r"version (\d[\w.]*)", dict()),
+    refalac=_ToolSpec(["refalac", "refalac64"], ["--help"], r"refalac (\d[\w.]*)", dict()),
+    arcue=_ToolSpec(["ARCue", "arcue"], None, None, dict()),
+)
+
+def _probe(spec: _ToolSpec, path: Path, timeout: float = 10.) -> Tuple[Optional[str], List[str]]:
+    ''' run the tool to find its version and supported features '''
+    if spec.args is None:
+        return None, []
+    try:
+        proc = subprocess.run([str(path)] + spec.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, timeout=timeout)
+        output = proc.stdout.decode("utf-8", errors="replace")
+    except (OSError, subprocess.TimeoutExpired) as e:
+        _logger.warning("Failed to probe %s: %s", str(path), e)
+        return None, []
+
+    match = re.search(spec.version, output) if spec.version else None
+    features = [name for name, pattern in spec.features.items() if re.search(pattern, output)]
+    return (match[1] if match else None), features
+
+class ToolRegistry:
+    '''
+    Resolve and probe codec binaries, results are kept for the lifetime of the registry
+
+    :param cache_path: JSON file storing probe results, None to probe without caching
+    '''
+    def __init__(self, cache_path: Union[str, Path] = None) -> None:
+        self._cache_path = Path(cache_path) if cache_path else None
+        self._cache = {}
+        if self._cache_path and self._cache_path.exists():
+            try:
+                self._cache = json.loads(self._cache_path.read_text(encoding="utf-8"))
+            except (ValueError, OSError) as e:
+                _logger.warning("Failed to load tool cache %s (%s), tools will be probed again", str(self._cache_path), e)
+        self._resolved: Dict[Tuple[str, str], Optional[ToolInfo]] = {}
+        self._lock = threading.Lock()
+
+    def _locate(self, name: str, configured: str) -> Optional[Path]:
+        if configured:
+            path = Path(configured).expanduser()
+            if path.is_file():
+                return path
+            found = shutil.which(configured) # a bare executable name is also accepted
+            if found:
+                return Path(found)
+            _logger.warning("%s is configured as %s but not found, searching in PATH", name, configured)
+        for candidate in _specs[name].names:
+            found = shutil.which(candidate)
+            if found:
+                return Path(found)
+        return None
+
+    def _resolve(self, name: str, configured: str) -> Optional[ToolInfo]:
+        path = self._locate(name, configured)
+        if path is None:
+            _logger.debug("%s is not available", name)
+            return None
+
+        path = path.resolve()
+        stat = path.stat()
+        entry = self._cache.get(name)
+        if entry and entry['path'] == str(path) and entry['size'] == stat.st_size \
+           and entry['mtime_ns'] == stat.st_mtime_ns:
+            return ToolInfo(name, path, entry['version'], entry['features'])
+
+        version, features = _probe(_specs[name], path)
+        _logger.info("Found %s %s at %s (features: %s)", name, version or "(unknown version)",
+                     str(path), ", ".join(features) or "none")
+        self._cache[name] = dict(path=str(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                                 version=version, features=features)
+        self._save()
+        return ToolInfo(name, path, version, features)
+
+    def _save(self) -> None:
+        if self._cache_path is None:
+            return
+        try:
+            self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._cache_path.with_suffix(".%d.tmp" % os.getpid())
+            tmp.write_text(json.dumps(self._cache, indent=1, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self._cache_path)
+        except OSError as e:
+            _logger.warning("Failed to save tool cache %s: %s", str(self._cache_path), e)
+
+    def get(self, name: str, config: ConfigSnapshot = None) -> Optional[ToolInfo]:
+        '''
+        Get the tool by its name in the path section of config (default to the global config),
+        None if it's not available
+        '''
+        if name not in _specs:
+            raise KeyError("Unknown tool: %s" % name)
+        config = config if config is not None else global_config
+        key = (name, config.path.get(name) or "")
+        with self._lock:
+            if key not in self._resolved:
+                self._resolved[key] = self._resolve(name, key[1])
+            return self._resolved[key]
+
+    def require(self, name: str, config: ConfigSnapshot = None) -> ToolInfo:
+        ''' get the tool, FileNotFoundError is raised if it's not available '''
+        info = self.get(name, config)
+        if info is None:
+            raise FileNotFoundError("%s is not found, add it to PATH or set path.%s in config" % (name, name))
+        return info
+
+    def capabilities(self) -> dict:
+        ''' available tools on this host with their versions and features, in a JSON serializable form '''
+        tools = {}
+        for name in _specs:
+            info = self.get(name)
+            if info is not None:
+                tools[name] = dict(path=str(info.path), version=info.version, features=info.features)
+        return dict(host=socket.gethostname(), tools=tools)
+
+_tool_registry = None
+
+def get_tool_registry() -> ToolRegistry:
+    '''
+    Get the registry with probe results cached at tools.cache_path in global config. The default cache
+    is per host, because home folders can be shared by hosts with different binaries.
+    '''
+    global _tool_registry
+    path = Path(global_config.tools.cache_path or
+                Path("~/.cache/fluss/tools-%s.json" % socket.gethostname()).expanduser())
+    if _tool_registry is None or _tool_registry._cache_path != path:
+        _tool_registry = ToolRegistry(path)
+    return _tool_registry
@@ -0,0 +1,280 @@
+'''
+Pipe transport between codec processes. Pipes are pumped by blocking reads with large buffers on background
+threads (and os.splice between two processes on Linux) instead of asyncio pipes, which are slow under qasync
+(see https://github.com/CabbageDevelopment/qasync/issues/43). Progress callbacks are marshalled to the event loop.
+Decoded streams are either read through a bounded queue of chunks (see PipeWaveReader) or saved into scratch files,
+but never collected in memory, since hi-res albums can take several GB.
+'''
+
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import threading
+from typing import BinaryIO, Callable, Optional, Tuple
+
+from .pcm import _parse_wave_header, _wave_params
+
+_logger = logging.getLogger("fluss.transport")
+
+class _ProgressReporter:
+    '''
+    Report progress from a worker thread through the event loop, at most once per percent
+    '''
+    def __init__(self, loop: asyncio.AbstractEventLoop, callback: Callable[[float], None], total: Optional[int]) -> None:
+        self._loop = loop
+        self._callback = callback
+        self.total = total
+        self._last = -1
+
+    def update(self, done: int) -> None:
+        if self._callback is None or not self.total:
+            return
+        percent = min(done * 100 // self.total, 100)
+        if percent != self._last:
+            self._last = percent
+            self._loop.call_soon_threadsafe(self._callback, percent / 100)
+
+def _read_exactly(fd: int, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = os.read(fd, size)
+        if not chunk:
+            raise EOFError("Unexpected end of wave stream")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _write_all(fd: int, data: memoryview) -> None:
+    while len(data):
+        data = data[os.write(fd, data):]
+
+def read_wave_header(fd: int) -> Tuple[bytes, Optional[int]]:
+    '''
+    Read RIFF header from a wave stream until the beginning of the data chunk
+
+    :return: raw header bytes and the size of data chunk (None if unknown)
+    '''
+    header = _read_exactly(fd, 12)
+    if header[:4] != b'RIFF' or header[8:] != b'WAVE':
+        raise ValueError("Input stream is not a wave stream!")
+
+    while True:
+        chunk_header = _read_exactly(fd, 8)
+        header += chunk_header
+        chunk_size = int.from_bytes(chunk_header[4:], 'little')
+        if chunk_header[:4] == b'data':
+            break
+        header += _read_exactly(fd, chunk_size + (chunk_size & 1))
+
+    if chunk_size in (0, 0xFFFFFFFF): # size is unknown for some streaming encoders
+        chunk_size = None
+    return header, chunk_size
+
+def hash_pcm(fd: int, chunk_size: int = 2 ** 20) -> str:
+    '''
+    Compute MD5 of the frames in a wave stream from a pipe, frames are discarded after being hashed
+    '''
+    read_wave_header(fd)
+    md5 = hashlib.md5()
+    while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+            break
+        md5.update(chunk)
+    return md5.hexdigest()
+
+def pump(fd_in: int, fd_out: int, progress: _ProgressReporter = None, chunk_size: int = 2 ** 20) -> int:
+    '''
+    Move a wave stream from a pipe to another pipe or a file until the end of input. Data is spliced in kernel
+    on Linux. The header is copied as is, so the size of data could be unknown in the output.
+
+    :return: size of the data after the wave header
+    '''
+    header, data_size = read_wave_header(fd_in)
+    _write_all(fd_out, memoryview(header))
+    if progress is not None:
+        progress.total = data_size
+
+    transferred = 0
+    use_splice = hasattr(os, "splice")
+    while True:
+        if use_splice:
+            try:
+                moved = os.splice(fd_in, fd_out, chunk_size)
+            except OSError as e: # e.g. EINVAL if the pipe is not supported by splice
+                _logger.debug("Splicing pipes failed (%s), falling back to copying", e)
+                use_splice = False
+                continue
+        else:
+            chunk = os.read(fd_in, chunk_size)
+            _write_all(fd_out, memoryview(chunk))
+            moved = len(chunk)
+
+        if moved == 0:
+            break
+        transferred += moved
+        if progress is not None:
+            progress.update(transferred)
+    return transferred
+
+async def hash_pcm_async(pipe: BinaryIO, chunk_size: int = 2 ** 20) -> str:
+    '''
+    Compute MD5 of the frames in a wave stream from the pipe on a background thread
+    '''
+    return await asyncio.get_running_loop().run_in_executor(None, hash_pcm, pipe.fileno(), chunk_size)
+
+async def pump_async(pipe_in: BinaryIO, pipe_out: BinaryIO,
+                     progress_callback: Callable[[float], None] = None,
+                     chunk_size: int = 2 ** 20) -> int:
+    '''
+    Move a wave stream from the pipe to another pipe or a file on a background thread, the output is closed afterwards
+    '''
+    loop = asyncio.get_running_loop()
+    progress = _ProgressReporter(loop, progress_callback, None)
+
+    def run():
+        try:
+            return pump(pipe_in.fileno(), pipe_out.fileno(), progress, chunk_size)
+        finally:
+            pipe_out.close()
+
+    return await loop.run_in_executor(None, run)
+
+class PipeWaveReader:
+    '''
+    Read frames of a wave stream from a pipe (e.g. stdout of a decoder) with the reading API of wave.Wave_read.
+    The pipe is pumped on a background thread into a queue of at most `depth` chunks, so the producer is blocked
+    by the pipe when the reader falls behind. Frames can only be read sequentially, and the pipe is closed by the
+    pumping thread. Use :func:`open_pipe_wave_async` to create it.
+
+    :param on_eof: called on the pumping thread at the end of input, e.g. to check the return code of the
+        producer, exception raised by it is raised by the reading methods
+    :param on_close: called if the reader is closed before the end of input, e.g. to kill the producer
+    '''
+    def __init__(self, pipe: BinaryIO, header: bytes, data_size: Optional[int],
+                 depth: int = 8, chunk_size: int = 2 ** 20,
+                 progress_callback: Callable[[float], None] = None,
+                 on_eof: Callable[[], None] = None, on_close: Callable[[], None] = None) -> None:
+        self._nchannels, self._sampwidth, self._framerate, _, _ = _parse_wave_header(header)
+        self._framesize = self._nchannels * self._sampwidth
+        self._nframes = None if data_size is None else data_size // self._framesize
+
+        self._pipe = pipe
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max(depth, 1))
+        self._pending = bytearray()
+        self._eof = False
+        self._closed = False
+        self._on_eof = on_eof
+        self._on_close = on_close
+
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._progress = _ProgressReporter(self._loop, progress_callback, data_size)
+        self._thread = threading.Thread(target=self._pump, name="pipe-reader", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _put(self, item) -> None:
+        if not self._closed:
+            self._queue.put(item)
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError: # the loop is closed, only blocking reads are possible
+                pass
+
+    def _pump(self) -> None:
+        try:
+            fd = self._pipe.fileno()
+            received = 0
+            while not self._closed:
+                chunk = os.read(fd, self._chunk_size)
+                if not chunk:
+                    break
+                self._put(chunk)
+                received += len(chunk)
+                self._progress.update(received)
+
+            if not self._closed and self._on_eof is not None:
+                self._on_eof()
+            self._put(b"")
+        except BaseException as e:
+            self._put(e)
+        finally:
+            self._pipe.close()
+
+    def _take(self, nframes: int, block: bool) -> bytes:
+        ''' take frames from the queue, queue.Empty is raised if it's not blocking and the queue runs out '''
+        size = nframes * self._framesize
+        while len(self._pending) < size and not self._eof:
+            item = self._queue.get(block)
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+            self._pending += item
+
+        size = min(size, len(self._pending) // self._framesize * self._framesize)
+        chunk = bytes(self._pending[:size])
+        del self._pending[:size]
+        return chunk
+
+    def readframes(self, nframes: int) -> bytes:
+        ''' read at most nframes frames, blocking until they are available '''
+        return self._take(nframes, True)
+
+    async def readframes_async(self, nframes: int) -> bytes:
+        ''' read at most nframes frames without blocking the event loop '''
+        while True:
+            try:
+                return self._take(nframes, False)
+            except queue.Empty:
+                self._ready.clear()
+                if self._queue.empty():
+                    await self._ready.wait()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if not self._eof and self._on_close is not None:
+            self._on_close()
+        try: # unblock the pumping thread
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._pending = bytearray()
+
+    def getnchannels(self) -> int:
+        return self._nchannels
+
+    def getsampwidth(self) -> int:
+        return self._sampwidth
+
+    def getframerate(self) -> int:
+        return self._framerate
+
+    def getnframes(self) -> Optional[int]:
+        ''' number of frames declared by the header, None if it's unknown '''
+        return self._nframes
+
+    def getparams(self) -> _wave_params:
+        return _wave_params(self._nchannels, self._sampwidth, self._framerate,
+                            self._nframes, 'NONE', 'not compressed')
+
+async def open_pipe_wave_async(pipe: BinaryIO, **kwargs) -> PipeWaveReader:
+    '''
+    Read the wave header from the pipe on a background thread and create a :class:`PipeWaveReader` of its frames,
+    keyword arguments are passed to the reader
+    '''
+    header, data_size = await asyncio.get_running_loop().run_in_executor(None, read_wave_header, pipe.fileno())
+    return PipeWaveReader(pipe, header, data_size, **kwargs)
@@ -1,66 +1,292 @@
 from collections import defaultdict
 from ntpath import join
-from typing import Callable, List, Tuple, Union, Any
+from typing import Callable, List, Optional, Tuple, Union, Any
 import asyncio
+import logging
+import math
+from fractions import Fraction
+from functools import partial
 from PIL.Image import new
 
-from fluss import codecs
-from fluss.cuesheet import Cuesheet, _default_cuesheet_file
+from fluss import analysis, codecs
+from fluss.cuesheet import Cuesheet, CuesheetTrack, _default_cuesheet_file
 from fluss.meta import DiscMeta
-from fluss.config import global_config
+from fluss.config import ConfigSnapshot, global_config
+from fluss.probe import probe_length
 from pathlib import Path
-from io import BytesIO
 
-def _get_codec(filename: Union[str, Path], codec: str = None) -> codecs.AudioCodec:
+_logger = logging.getLogger("fluss.utils")
+
+def _get_codec(filename: Union[str, Path], codec: str = None, config: ConfigSnapshot = global_config) -> codecs.AudioCodec:
     if codec:
-        codec_conf = global_config.audio_codecs[codec]
+        codec_conf = config.audio_codecs[codec]
         codec_t = codecs.codec_from_name[codec_conf.type.lower()]
         if codec_t != codecs.codec_from_filename(filename):
             raise ValueError("Inconsistent codec type with file suffix!")
-        return codec_t(codec_conf.encode)
+        return codec_t(codec_conf.get("encode"), config=config)
     else:
         codec_t = codecs.codec_from_filename(filename)
-        return codec_t()
+        return codec_t(config=config)
+
+def _get_outputs(file_out: Union[str, Path, List[Union[str, Path]]],
+                 codec_out: Union[str, List[str]] = None,
+                 config: ConfigSnapshot = global_config) -> List[Tuple[Union[str, Path], codecs.AudioCodec]]:
+    '''
+    Resolve output files and their codecs, codec_out could be a list with the same length as file_out
+    '''
+    files_out = list(file_out) if isinstance(file_out, (list, tuple)) else [file_out]
+    if isinstance(codec_out, (list, tuple)):
+        if len(codec_out) != len(files_out):
+            raise ValueError("Number of output codecs doesn't match number of output files!")
+        codecs_out = list(codec_out)
+    else:
+        codecs_out = [codec_out] * len(files_out)
+    return [(f, _get_codec(f, c, config)) for f, c in zip(files_out, codecs_out)]
 
 class _ProgressCombiner:
     '''
-    Combine progress for multiple parallel tasks
+    Combine progress for multiple parallel tasks, the combined progress is the minimum of them. The minimum is
+    maintained incrementally, it's only searched again when every task at the minimum has moved forward.
     '''
     def __init__(self, identifiers: list, progress_callback: Callable[[float], None] = None, range: Tuple[float, float] = [0,1]) -> None:
         self._callback = progress_callback
         self._range = range
-        self._min_progress = 0
         self._progress = {i: 0 for i in identifiers}
+        self._min_progress = 0
+        self._at_min = len(self._progress) # number of tasks whose progress equals the minimum
 
         if progress_callback is not None:
             progress_callback(float(range[0]))
 
-    def call(self): 
-        min_progress = min(self._progress.values())
-        if self._min_progress != min_progress and self._callback is not None:
-            self._callback(min_progress * (self._range[1] - self._range[0]) + self._range[0])
-            self._min_progress = min_progress
+    def _set(self, identifier: Any, progress: float) -> None:
+        old = self._progress[identifier]
+        self._progress[identifier] = progress
+        if progress < self._min_progress:
+            self._min_progress, self._at_min = progress, 1
+        elif progress == self._min_progress:
+            self._at_min += old != progress
+        elif old == self._min_progress:
+            self._at_min -= 1
+            if self._at_min == 0:
+                self._min_progress = min(self._progress.values())
+                self._at_min = sum(1 for p in self._progress.values() if p == self._min_progress)
 
     def get_updater(self, identifier: Any):
         def update(progress: float):
-            self._progress[identifier] = progress
-            self.call()
+            last = self._min_progress
+            self._set(identifier, progress)
+            if self._min_progress != last and self._callback is not None:
+                self._callback(self._min_progress * (self._range[1] - self._range[0]) + self._range[0])
         return update
 
+def _load_track(file: Union[str, Path], probe_format: bool,
+                config: ConfigSnapshot = global_config) -> Tuple[codecs.AudioCodec, Any, Fraction, Optional[tuple]]:
+    '''
+    Load tags and read the exact length (in seconds) from the stream header of a file
+
+    :return: (codec, mutagen object, length, decoded format if probe_format is true)
+    '''
+    icodec = codecs.codec_from_filename(file)(config=config)
+    mutag = icodec.mutagen(file)
+
+    fmt = icodec.probe(file, mutag) if probe_format else None
+    if fmt is not None:
+        length = Fraction(fmt[3], fmt[2])
+    else:
+        header = probe_length(file)
+        if header is not None:
+            length = Fraction(*header)
+        else:
+            length = Fraction(mutag.info.length)
+    return icodec, mutag, length, fmt
+
+def _cd_frames(seconds: Fraction) -> int:
+    ''' convert time to the nearest CD frame '''
+    return math.floor(seconds * 75 + Fraction(1, 2))
+
+def _track_starts(cuesheet: Cuesheet, framerate: int) -> List[int]:
+    ''' first frame of each track except the first one from a cuesheet of single file '''
+    if cuesheet is None or len(cuesheet.files) != 1:
+        return []
+    tracks = next(iter(cuesheet.files.values()))
+    if any(t.index01 is None for t in tracks.values()):
+        return []
+    return [tracks[i].index01 * framerate // 75 for i in sorted(tracks)[1:]]
+
+async def _encode_outputs(stream: Union[codecs.MergedWaveStream, codecs.DecodingWaveStream],
+                          outputs: List[Tuple[Union[str, Path], codecs.AudioCodec]],
+                          meta: DiscMeta,
+                          progress_callback: Callable[[float], None] = None,
+                          analyze: bool = False,
+                          verify: bool = False) -> None:
+    '''
+    Encode the wave stream into all outputs and write tags from meta. Multiple outputs are encoded
+    concurrently from branches of the same stream, so that the source is decoded only once.
+
+    :param analyze: if true, the stream is analyzed while being encoded and the result is stored in meta
+    :param verify: if true, each output is decoded right after it's encoded and the MD5 of decoded frames
+        is compared with the encoded stream, RuntimeError is raised on mismatch
+    '''
+    if analyze:
+        analyzer = stream = analysis.AnalyzingWaveStream(stream, _track_starts(meta.cuesheet, stream.params.framerate))
+    if verify:
+        stream = codecs.HashingWaveStream(stream)
+
+    if len(outputs) == 1:
+        tee = None
+        progress_updaters = [progress_callback]
+    else:
+        tee = codecs.TeeWaveStream(stream, len(outputs))
+        progress_updater = _ProgressCombiner(list(range(len(outputs))), progress_callback=progress_callback)
+        progress_updaters = [progress_updater.get_updater(i) for i in range(len(outputs))]
+
+    async def encode(idx: int) -> Optional[str]:
+        file_out, ocodec = outputs[idx]
+        try:
+            await ocodec.encode_stream_async(file_out, tee.branches[idx] if tee else stream,
+                                             progress_callback=progress_updaters[idx])
+        finally:
+            if tee:
+                tee.branches[idx].close()
+
+        if verify: # verify while other outputs are still being encoded
+            return await ocodec.hash_decoded_async(file_out)
+
+    tasks = [asyncio.ensure_future(encode(i)) for i in range(len(outputs))]
+    try:
+        digests = await asyncio.gather(*tasks)
+        if verify:
+            _compare_digests(outputs, digests, stream.digest)
+    except BaseException:
+        # stop other encoders and remove all outputs, so that no partial output is left
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for file_out, _ in outputs:
+            Path(file_out).unlink(missing_ok=True)
+        raise
+
+    if analyze:
+        meta.analysis = analyzer.result
+
+    for file_out, ocodec in outputs:
+        mutag = ocodec.mutagen(file_out)
+        meta.to_mutagen(mutag)
+        mutag.save()
+
+def _compare_digests(outputs: List[Tuple[Union[str, Path], codecs.AudioCodec]], digests: List[str], expected: str) -> None:
+    ''' check MD5 of decoded outputs against the input audio, RuntimeError is raised on mismatch '''
+    for (file_out, _), digest in zip(outputs, digests):
+        if digest != expected:
+            _logger.error("Verification of %s failed, MD5 of decoded audio is %s rather than %s",
+                          file_out, digest, expected)
+            raise RuntimeError(f"Decoded audio of {file_out} doesn't match the encoded audio!")
+        _logger.info("Verification of %s passed", file_out)
+
+async def _check_outputs(stream: Union[codecs.MergedWaveStream, codecs.DecodingWaveStream],
+                         outputs: List[Tuple[Union[str, Path], codecs.AudioCodec]],
+                         meta: DiscMeta,
+                         progress_callback: Callable[[float], None] = None,
+                         analyze: bool = False,
+                         verify: bool = False) -> None:
+    '''
+    Analyze the wave stream and verify the existing outputs against it without encoding them again. Outputs
+    failing the verification are removed, and tags are written again after the analysis (for ReplayGain).
+    '''
+    if not (analyze or verify):
+        return
+    if analyze:
+        analyzer = stream = analysis.AnalyzingWaveStream(stream, _track_starts(meta.cuesheet, stream.params.framerate))
+    if verify:
+        stream = codecs.HashingWaveStream(stream)
+
+    async def consume():
+        done = 0
+        async for chunk in stream.aiter_frames():
+            done += len(chunk)
+            if progress_callback is not None:
+                progress_callback(min(done / stream.nbytes, 1.0))
+
+    tasks = [asyncio.ensure_future(consume())]
+    if verify:
+        tasks += [asyncio.ensure_future(ocodec.hash_decoded_async(file_out)) for file_out, ocodec in outputs]
+    try:
+        digests = (await asyncio.gather(*tasks))[1:]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    if verify:
+        try:
+            _compare_digests(outputs, digests, stream.digest)
+        except RuntimeError:
+            for file_out, _ in outputs:
+                Path(file_out).unlink(missing_ok=True)
+            raise
+
+    if analyze:
+        meta.analysis = analyzer.result
+        for file_out, ocodec in outputs:
+            mutag = ocodec.mutagen(file_out)
+            meta.to_mutagen(mutag)
+            mutag.save()
+
+async def _decode_all(streams: List[Union[Callable, float]], progress_callback: Callable[[float], None] = None) -> codecs.MergedWaveStream:
+    '''
+    Decode all files concurrently and merge the results, decoding progress is reported in range [0, 0.5]
+    '''
+    sources = [i for i, s in enumerate(streams) if not isinstance(s, float)]
+    progress_updater = _ProgressCombiner(sources, progress_callback=progress_callback, range=[0, 0.5])
+    tasks = [asyncio.ensure_future(streams[i](progress_callback=progress_updater.get_updater(i))) for i in sources]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # stop other decoders and release the decoded results
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is None:
+                task.result().close()
+        raise
+
+    streams = list(streams)
+    for i, r in zip(sources, results):
+        streams[i] = r
+    return codecs.MergedWaveStream(streams)
+
 async def merge_tracks(files_in: List[Union[str, Path]],
-                       file_out: Union[str, Path],
+                       file_out: Union[str, Path, List[Union[str, Path]]],
                        cuesheet: Union[str, Path, Cuesheet] = None,
                        meta: DiscMeta = None,
-                       codec_out: str = None,
+                       codec_out: Union[str, List[str]] = None,
                        progress_callback: Callable[[float], None] = None,
-                       dry_run: bool = False):
+                       dry_run: bool = False,
+                       analyze: bool = None,
+                       verify: bool = None,
+                       check_only: bool = False,
+                       config: ConfigSnapshot = None):
     '''
     Generated metadata will be returned
 
     :param dry_run: if true, only parse metadata
     :param cuesheet: if cuesheet is specified, meta data from cuesheet will have higher priority than from file
-    :param codec_out: if not given, output codec will be infered from file name and have default parameters
+    :param file_out: a list of files could be given to encode the merged stream into several formats at once
+    :param analyze: if true, MD5, peak and loudness of the album and each track are computed while encoding and
+        stored as meta.analysis, default to pipeline.analyze
+    :param verify: if true, outputs are decoded and compared with the merged audio, default to pipeline.verify
+    :param check_only: if true, the outputs already exist and only the analysis and verification are done
+    :param codec_out: if not given, output codec will be infered from file name and have default parameters.
+        It should be a list if there are multiple output files
+    :param config: config snapshot of the job, default to the global config
+
+    Track offsets are computed from the exact sample counts in the stream headers, which are read concurrently.
+    Files are decoded in a window of pipeline.decode_window files and streamed into the encoder in order
+    if their formats can be probed, otherwise all files are decoded before encoding.
     '''
+    config = config if config is not None else global_config
     if cuesheet is None:
         if meta and meta.cuesheet:
             cuesheet = meta.cuesheet
@@ -90,114 +316,151 @@ async def merge_tracks(files_in: List[Union[str, Path]],
     if meta is None:
         meta = DiscMeta.from_cuesheet(cuesheet)
 
-    # parse metadata and cuesheet
-    offset = 0
-    last_length = None
-    streams = []
-    progress_updater = _ProgressCombiner(range(len(files_in)), progress_callback=progress_callback, range=[0, 0.5])
-    for idx, file in enumerate(files_in):
-        codec_t = codecs.codec_from_filename(file)
-        icodec = codec_t()
-        mutag = icodec.mutagen(file)
+    # load tags and stream headers of all files concurrently
+    loop = asyncio.get_running_loop()
+    loaded = await asyncio.gather(*[loop.run_in_executor(None, _load_track, file, not dry_run, config) for file in files_in])
+
+    # files are decoded in a bounded window and streamed into the encoder in order if their formats are probed
+    window = config.pipeline.decode_window
+    probed = [fmt for _, _, _, fmt in loaded]
+    windowed = window > 0 and None not in probed and len(set(f[:3] for f in probed)) == 1
+
+    # parse metadata and cuesheet, offsets are accumulated in seconds and rounded to CD frames only once
+    offset = Fraction(0)
+    last_start = None
+    streams = [] # decoding functions and silence periods
+    formats = [] # format of decoded streams, None if unknown
+    for idx, (file, (icodec, mutag, length, fmt)) in enumerate(zip(files_in, loaded)):
         track_meta = DiscMeta.from_mutagen(mutag)
         cuesheet.update(track_meta.to_cuesheet(), overwrite=False)
         meta.update(track_meta, overwrite=False)
 
         # process pregap
-        cur_track = tracks[idx + 1]
+        cur_track = tracks.setdefault(idx + 1, CuesheetTrack())
         if cur_track.pregap is not None:
-            if cur_track.index00 < 0:
+            if cur_track.index00 is not None and cur_track.index00 < 0:
                 raise SyntaxError("Should not add pregap in noncompliant cuesheet")
-            offset += cur_track.pregap
+            offset += Fraction(cur_track.pregap, 75)
             streams.append(cur_track.pregap / 75.)
             cur_track.pregap = None
 
         # update offset
         if not dry_run:
-            wave_in = asyncio.ensure_future(icodec.decode_async(file,
-                progress_callback=progress_updater.get_updater(idx)))
-            streams.append(wave_in)
+            streams.append(partial(icodec.decode_stream_async if windowed else icodec.decode_async, file))
+            formats.append(fmt)
         if combine_cuesheet:
             if cur_track.index00 is not None:
                 if cur_track.index00 >= 0:
-                    cur_track.index00 += offset
+                    cur_track.index00 += _cd_frames(offset)
                 else:
-                    if last_length is None:
+                    if last_start is None:
                         raise SyntaxError("Cannot parse noncompliant pregap in the first track!")
-                    cur_track.index00 = (offset - last_length) + -cur_track.index00
+                    cur_track.index00 = _cd_frames(last_start) + -cur_track.index00
             if cur_track.index01 is None:
-                cur_track.index01 = offset
+                cur_track.index01 = _cd_frames(offset)
             else:
-                cur_track.index01 += offset
+                cur_track.index01 += _cd_frames(offset)
+
+        last_start = offset
+        offset += length
 
         # process postgap
         if cur_track.postgap is not None:
-            offset += cur_track.postgap
+            offset += Fraction(cur_track.postgap, 75)
             streams.append(cur_track.postgap / 75.)
             cur_track.postgap = None
 
-        last_length = int(mutag.info.length * 75)
-        offset += last_length
-
-    # wait for completion
-    tasks = [(i, s) for i, s in enumerate(streams) if isinstance(s, asyncio.Task)]
-    results = await asyncio.gather(*[s for _, s in tasks])
-    for (i, _), r in zip(tasks, results):
-        streams[i] = r
-
     # update and assign cuesheet
     cuesheet.update(meta.to_cuesheet())
     meta.cuesheet = cuesheet
 
     # convert audio
-    ocodec = _get_codec(file_out, codec_out)
+    outputs = _get_outputs(file_out, codec_out, config)
     if not dry_run:
-        buf = BytesIO()
-        codecs.merge_streams(streams, buf)
-
-        await ocodec.encode_async(file_out, buf.getvalue(),
-            progress_callback=lambda p: progress_callback(p / 2 + 0.5))
+        if windowed:
+            frames = iter(f[3] for f in formats)
+            lengths = [0 if isinstance(s, float) else next(frames) for s in streams]
+            stream = codecs.DecodingWaveStream(streams, formats[0][:3], lengths, window=window)
+            encode_progress = progress_callback
+        else:
+            stream = await _decode_all(streams, progress_callback)
+            encode_progress = lambda p: progress_callback(p / 2 + 0.5) if progress_callback else None
 
-        mutag = ocodec.mutagen(file_out)
-        meta.to_mutagen(mutag)
-        mutag.save()
+        if analyze is None:
+            analyze = config.pipeline.analyze
+        if verify is None:
+            verify = config.pipeline.verify
+        process = _check_outputs if check_only else _encode_outputs
+        await process(stream, outputs, meta, encode_progress, analyze=analyze, verify=verify)
 
     return meta
 
 async def convert_track(file_in: Union[str, Path],
-                        file_out: Union[str, Path],
+                        file_out: Union[str, Path, List[Union[str, Path]]],
                         meta: DiscMeta = None,
-                        codec_out: str = None,
+                        codec_out: Union[str, List[str]] = None,
                         progress_callback: Callable[[float], None] = None,
-                        dry_run: bool = False):
+                        dry_run: bool = False,
+                        streaming: bool = False,
+                        analyze: bool = None,
+                        verify: bool = None,
+                        check_only: bool = False,
+                        config: ConfigSnapshot = None):
     '''
     Convert audio file and preserve meta data
-    '''
 
-    icodec = _get_codec(file_in)
-    ocodec = _get_codec(file_out, codec_out)
+    :param file_out: a list of files could be given to decode once and encode into several formats at once,
+        codec_out should be a list with the same length in that case
+    :param streaming: if true, decoded audio will be piped into the encoder chunk by chunk without
+        buffering the whole file. It falls back to buffered conversion if any of the codecs doesn't support pipes
+        or there are multiple outputs
+    :param analyze: if true, MD5, peak and loudness are computed while encoding (per track if the meta
+        has a cuesheet) and stored as meta.analysis, default to pipeline.analyze. Streaming is disabled
+        in this case since the audio doesn't go through Python.
+    :param verify: if true, outputs are decoded and compared with the input audio, default to pipeline.verify.
+        Streaming is disabled in this case as well.
+    :param check_only: if true, the outputs already exist and only the analysis and verification are done
+    :param config: config snapshot of the job, default to the global config
+    '''
+    config = config if config is not None else global_config
+    icodec = _get_codec(file_in, config=config)
+    outputs = _get_outputs(file_out, codec_out, config)
 
     if meta is None:
         meta = DiscMeta.from_mutagen(icodec.mutagen(file_in))
 
-    if not dry_run:
-        wave_in = await icodec.decode_async(file_in,
-            progress_callback=lambda p: progress_callback(p / 2)
-            if progress_callback else None)
-
-        # get absolute data
-        buf = wave_in.getfp().file
-        if isinstance(buf, BytesIO):
-            data = buf.getvalue()
-        else:
-            buf.seek(0)
-            data = buf.read()
-            buf.close()
+    if dry_run:
+        return
 
-        await ocodec.encode_async(file_out, data,
-            progress_callback=lambda p: progress_callback(p / 2 + 0.5)
-            if progress_callback else None)
+    if analyze is None:
+        analyze = config.pipeline.analyze
+    if verify is None:
+        verify = config.pipeline.verify
+    if check_only:
+        streaming = False
+    if streaming and not (analyze or verify) and len(outputs) == 1 and icodec.pipeable and outputs[0][1].pipeable:
+        file_out, ocodec = outputs[0]
+        await codecs.transcode_pipe_async(icodec, file_in, ocodec, file_out,
+            progress_callback=progress_callback,
+            chunk_size=config.pipeline.chunk_size)
 
         mutag = ocodec.mutagen(file_out)
         meta.to_mutagen(mutag)
         mutag.save()
+    else:
+        params = None
+        if icodec._decode_through_pipe:
+            params = await asyncio.get_running_loop().run_in_executor(None, icodec.probe, file_in)
+        if params is not None:
+            # read the decoder output as it's decoded, the length is checked against the probed one
+            stream = codecs.DecodingWaveStream([partial(icodec.decode_stream_async, file_in)], params[:3], [params[3]])
+            encode_progress = progress_callback
+        else:
+            wave_in = await icodec.decode_async(file_in,
+                progress_callback=lambda p: progress_callback(p / 2)
+                if progress_callback else None)
+            stream = codecs.MergedWaveStream([wave_in])
+            encode_progress = lambda p: progress_callback(p / 2 + 0.5) if progress_callback else None
+
+        process = _check_outputs if check_only else _encode_outputs
+        await process(stream, outputs, meta, progress_callback=encode_progress, analyze=analyze, verify=verify)
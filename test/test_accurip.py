@@ -0,0 +1,40 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from fluss.accurip import AccurateRipCache, parse_accurip, verify_accurip_batch
+from fluss.config import global_config
+
+mismatch_log = Path(__file__).parent / "discid-mismatch.accurip"
+
+def test_parse_accurip():
+    assert parse_accurip(mismatch_log.read_bytes()).fail
+
+@pytest.mark.skipif(sys.platform == "win32", reason="stub ARCue is a shell script")
+def test_verify_batch(tmp_path, monkeypatch):
+    # stub ARCue prints the same log and counts invocations
+    counter = tmp_path / "count"
+    arcue = tmp_path / "arcue"
+    arcue.write_text("#!/bin/sh\necho >> '%s'\ncat '%s'\n" % (counter, mismatch_log))
+    arcue.chmod(0o755)
+    monkeypatch.setitem(global_config.path, "arcue", str(arcue))
+
+    images = []
+    for i in range(3):
+        image = tmp_path / ("disc%d.flac" % i)
+        image.write_bytes(bytes([i]) * 100)
+        images.append(image)
+    images.append(tmp_path / "missing.flac")
+
+    cache_path = tmp_path / "accurip.json"
+    summary = asyncio.run(verify_accurip_batch(images, max_workers=2, cache=AccurateRipCache(cache_path)))
+    assert (summary["total"], summary["failed"], summary["errors"], summary["cached"]) == (4, 3, 1, 0)
+    assert counter.read_text().count("\n") == 3
+
+    images[0].write_bytes(b"changed") # only the changed image is verified again
+    summary = asyncio.run(verify_accurip_batch(images, cache=AccurateRipCache(cache_path)))
+    assert (summary["failed"], summary["cached"]) == (3, 2)
+    assert counter.read_text().count("\n") == 4
+    assert summary["results"][1]["tracks"] == {}
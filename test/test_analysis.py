@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from fluss import codecs
+from fluss.analysis import AudioAnalysis
+from fluss.utils import merge_tracks
+
+np = pytest.importorskip("numpy")
+
+def _sine(seconds, framerate=44100, level=-23., nchannels=2) -> bytes:
+    t = np.arange(int(seconds * framerate)) / framerate
+    samples = (10 ** (level / 20) * np.sin(2 * np.pi * 1000 * t) * 32767).astype('<i2')
+    return np.repeat(samples[:, None], nchannels, axis=1).tobytes()
+
+@pytest.mark.parametrize("framerate", [44100, 48000])
+def test_stream_analyzer(framerate):
+    from fluss.analysis import StreamAnalyzer
+
+    # EBU Tech 3341 case 1: stereo 1kHz sine at -23 dBFS should read -23 LUFS, followed by a quieter track
+    loud, quiet = _sine(10, framerate), _sine(5, framerate, level=-33.)
+    analyzer = StreamAnalyzer(2, 2, framerate, [len(loud) // 4])
+    data = loud + quiet
+    for i in range(0, len(data), 65536):
+        analyzer.update(data[i:i + 65536])
+    result = analyzer.result()
+
+    assert len(result.tracks) == 2
+    assert result.tracks[0].loudness == pytest.approx(-23., abs=0.1)
+    assert result.tracks[1].loudness == pytest.approx(-33., abs=0.1)
+    assert result.tracks[0].gain == pytest.approx(5., abs=0.1)
+    assert result.tracks[0].md5 == hashlib.md5(loud).hexdigest()
+    assert result.md5 == hashlib.md5(data).hexdigest()
+    assert result.peak == pytest.approx(10 ** (-23 / 20), abs=1e-3)
+
+def test_merge_analyze(tmp_path, monkeypatch):
+    pytest.importorskip("soundfile")
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.pipeline, "flac_backend", "soundfile")
+
+    data = [_sine(3), _sine(2, level=-33.)]
+    files = [tmp_path / "01.flac", tmp_path / "02.flac"]
+    for f, d in zip(files, data):
+        asyncio.run(codecs.flac().encode_async(f, codecs._wave_header(2, 2, 44100, len(d) // 4) + d))
+
+    fout = tmp_path / "merged.flac"
+    meta = asyncio.run(merge_tracks(files, fout, analyze=True))
+    assert [t.md5 for t in meta.analysis.tracks] == [hashlib.md5(d).hexdigest() for d in data]
+
+    tags = codecs.flac.mutagen(fout).tags
+    assert tags['REPLAYGAIN_ALBUM_GAIN'] == ["%.2f dB" % meta.analysis.gain]
+    assert 'REPLAYGAIN_TRACK_GAIN' not in tags
+
+    # analysis of an existing output without encoding it again, the result survives saving and loading
+    monkeypatch.setattr(codecs.flac, "encode_stream_async", None)
+    checked = asyncio.run(merge_tracks(files, fout, analyze=True, check_only=True))
+    assert checked.analysis.to_dict() == meta.analysis.to_dict()
+    loaded = AudioAnalysis.from_dict(meta.analysis.to_dict())
+    assert loaded.to_dict() == meta.analysis.to_dict() and loaded.gain == pytest.approx(meta.analysis.gain, abs=0.01)
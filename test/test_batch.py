@@ -0,0 +1,92 @@
+import asyncio
+import os
+
+from addict import Dict as edict
+
+from fluss.apps import batch
+from fluss.jobs import DONE, JobQueue
+from fluss.progress import ProgressBus
+
+def test_resume_batch(tmp_path, monkeypatch):
+    input_root, output_root = tmp_path / "input", tmp_path / "output"
+    for album in ["album1", "album2"]:
+        (input_root / album).mkdir(parents=True)
+        (input_root / album / "01.wav").write_bytes(b"")
+    (input_root / "album1" / "notes.txt").write_text("notes")
+
+    executed, failing = [], {"01.flac"}
+    async def apply_target(target, album_dir, album_output, progress_callback=None):
+        executed.append("%s/%s" % (album_dir.name, target.output_name))
+        if album_dir.name == "album2" and target.output_name in failing:
+            raise RuntimeError("encoder crashed")
+        album_output.mkdir(parents=True, exist_ok=True)
+        (album_output / target.output_name).write_bytes(b"")
+    monkeypatch.setattr(batch, "_apply_target", apply_target)
+
+    recipe = edict(merge=False, audio_codec="flac", image_codec="", copy_suffixes=["txt"])
+    with JobQueue(tmp_path / "jobs.sqlite", max_attempts=2) as queue:
+        run = lambda **kwargs: asyncio.run(batch.run_batch(input_root, output_root, recipe, queue=queue, **kwargs))
+
+        assert len(run()) == 1
+        assert sorted(executed) == ["album1/01.flac", "album1/notes.txt", "album2/01.flac"]
+
+        # only the failed target is executed again
+        executed.clear()
+        failing.clear()
+        assert run() == []
+        assert executed == ["album2/01.flac"]
+        assert set(queue.summary(str(output_root.resolve()))) == {DONE}
+
+        # changed inputs and removed outputs are detected
+        executed.clear()
+        stat = os.stat(input_root / "album1" / "notes.txt")
+        os.utime(input_root / "album1" / "notes.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        (output_root / "album2" / "01.flac").unlink()
+        assert run() == []
+        assert sorted(executed) == ["album1/notes.txt", "album2/01.flac"]
+
+        executed.clear()
+        assert run() == [] and executed == []
+
+def test_publish_progress(tmp_path, monkeypatch):
+    input_root, output_root = tmp_path / "input", tmp_path / "output"
+    (input_root / "album").mkdir(parents=True)
+    (input_root / "album" / "01.wav").write_bytes(bytes(1000))
+    (input_root / "album" / "notes.txt").write_text("notes")
+
+    async def apply_target(target, album_dir, album_output, progress_callback=None):
+        if progress_callback is not None:
+            progress_callback(0.5)
+        album_output.mkdir(parents=True, exist_ok=True)
+        (album_output / target.output_name).write_bytes(b"")
+    monkeypatch.setattr(batch, "_apply_target", apply_target)
+
+    bus, events = ProgressBus(), []
+    bus.subscribe(events.append, interval=0)
+    recipe = edict(merge=False, audio_codec="flac", image_codec="", copy_suffixes=["txt"])
+    with JobQueue(tmp_path / "jobs.sqlite") as queue:
+        assert asyncio.run(batch.run_batch(input_root, output_root, recipe, queue=queue, bus=bus)) == []
+
+    progress = {(e.target, e.stage, e.fraction, e.bytes) for e in events}
+    assert ("album/01.flac", "encode", 0.5, 500) in progress
+    assert ("album/01.flac", "encode", 1., 1000) in progress
+    assert ("album/notes.txt", "execute", 1., 5) in progress
+
+def test_give_up_failed_targets(tmp_path, monkeypatch):
+    input_root, output_root = tmp_path / "input", tmp_path / "output"
+    (input_root / "album").mkdir(parents=True)
+    (input_root / "album" / "01.wav").write_bytes(b"")
+
+    executed = []
+    async def apply_target(target, album_dir, album_output, progress_callback=None):
+        executed.append(target.output_name)
+        raise RuntimeError("encoder crashed")
+    monkeypatch.setattr(batch, "_apply_target", apply_target)
+
+    recipe = edict(merge=False, audio_codec="flac", image_codec="", copy_suffixes=[])
+    with JobQueue(tmp_path / "jobs.sqlite", max_attempts=1) as queue:
+        run = lambda **kwargs: asyncio.run(batch.run_batch(input_root, output_root, recipe, queue=queue, **kwargs))
+        assert len(run()) == 1 and len(executed) == 1
+        failures = run()
+        assert len(failures) == 1 and str(failures[0][2]) == "encoder crashed" and len(executed) == 1
+        assert len(run(retry_failed=True)) == 1 and len(executed) == 2
@@ -1,33 +1,457 @@
 import asyncio
+import sys
+import wave
 from io import BytesIO
 from pathlib import Path
 
+import pytest
+
 import mutagen
 from fluss import codecs, cuesheet
 from fluss.cuesheet import Cuesheet
 from fluss.meta import DiscMeta
 from fluss.utils import merge_tracks
 
-def test_codecs():
-    wavfile = Path(r"c:/Users/cmput/Music/test.wav")
-    async def test_codec(type):
-        c = type()
-        await c.encode_async("temp." + type.suffix, wavfile.read_bytes(), progress_callback=lambda q: print("Encoding %.3f" % q))
-        w = await c.decode_async("temp." + type.suffix, progress_callback=lambda q: print("Decoding %.3f" % q))
-        print(w)
-
-    # asyncio.run(test_codec(codecs.monkeysaudio))
-    # asyncio.run(test_codec(codecs.flac))
-    # asyncio.run(test_codec(codecs.wavpack))
-    asyncio.run(test_codec(codecs.trueaudio))
-
-def test_combine_stream():
-    from mutagen.flac import FLAC
-    from mutagen.wavpack import WavPack
-
-    cue = Cuesheet.from_file(cue_file, encoding="gbk")
-    meta = asyncio.run(merge_tracks(files, "./temp.flac", cuesheet=cue, dry_run=False, progress_callback=lambda q: print(q)))
-    print(meta.cuesheet)
-
-if __name__ == "__main__":
-    test_combine_stream()
+@pytest.mark.parametrize("codec_t", [codecs.flac, codecs.wavpack, codecs.monkeysaudio,
+                                     codecs.trueaudio, codecs.tak, codecs.alac])
+def test_codecs(tmp_path, codec_t):
+    if not codec_t.available():
+        pytest.skip("%s is not available" % ", ".join(codec_t.binaries))
+
+    data = _synthetic_wave(44100)
+    fout = tmp_path / ("temp." + codec_t.suffix)
+    async def roundtrip():
+        c = codec_t()
+        await c.encode_async(fout, data, progress_callback=lambda q: print("Encoding %.3f" % q))
+        return await c.decode_async(fout, progress_callback=lambda q: print("Decoding %.3f" % q))
+
+    with asyncio.run(roundtrip()) as w:
+        assert bytes(w.readframes(w.getnframes())) == data[44:]
+
+class _pipe_codec(codecs.AudioCodec):
+    ''' codec that copies wave stream as is, used for testing pipes '''
+    suffix = "pipe"
+
+    def _encode_pipe_args(self, fout):
+        return [sys.executable, "-c", "import sys,shutil; shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1],'wb'))", fout]
+
+    def _decode_pipe_args(self, fin):
+        return [sys.executable, "-c", "import sys,shutil; shutil.copyfileobj(open(sys.argv[1],'rb'), sys.stdout.buffer)", fin]
+
+def _synthetic_wave(nframes=44100, nchannels=2, sampwidth=2, framerate=44100) -> bytes:
+    buf = BytesIO()
+    with wave.open(buf, "wb") as wave_out:
+        wave_out.setnchannels(nchannels)
+        wave_out.setsampwidth(sampwidth)
+        wave_out.setframerate(framerate)
+        wave_out.writeframes(bytes(i % 251 for i in range(nframes * nchannels * sampwidth)))
+    return buf.getvalue()
+
+def test_transcode_pipe(tmp_path):
+    data = _synthetic_wave()
+    fin, fout = tmp_path / "in.pipe", tmp_path / "out.pipe"
+    fin.write_bytes(data)
+
+    progress = []
+    asyncio.run(codecs.transcode_pipe_async(_pipe_codec(), fin, _pipe_codec(), fout,
+        progress_callback=progress.append, chunk_size=4096))
+    assert fout.read_bytes() == data
+    assert len(progress) > 1 and progress[-1] == 1.0
+
+def test_merge_streams(tmp_path):
+    data = [_synthetic_wave(1000), _synthetic_wave(3000)]
+    streams = [wave.open(BytesIO(data[0]), "rb"), 0.01, wave.open(BytesIO(data[1]), "rb")]
+
+    fout = tmp_path / "merged.wav"
+    with fout.open("wb") as f:
+        codecs.merge_streams(streams, f.fileno(), chunk_frames=256)
+
+    with wave.open(str(fout), "rb") as merged:
+        assert merged.getnframes() == 1000 + 441 + 3000
+        frames = merged.readframes(merged.getnframes())
+    assert frames == data[0][44:] + bytes(441 * 4) + data[1][44:]
+
+@pytest.mark.parametrize("sampwidth", [1, 2, 3])
+def test_flac_in_process(tmp_path, monkeypatch, sampwidth):
+    pytest.importorskip("soundfile")
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.pipeline, "flac_backend", "soundfile")
+
+    data = _synthetic_wave(4000, sampwidth=sampwidth)
+    fout = tmp_path / "out.flac"
+    progress = []
+    async def roundtrip():
+        codec = codecs.flac(["-5"])
+        await codec.encode_async(fout, data, progress_callback=progress.append)
+        return await codec.decode_async(fout)
+
+    pcm = asyncio.run(roundtrip())
+    assert progress[-1] == 1.0
+    assert pcm.getparams()[:4] == (2, sampwidth, 44100, 4000)
+    assert bytes(pcm.readframes(4000)) == data[44:]
+
+def test_mapped_pcm(tmp_path):
+    from fluss.pcm import MappedPCM
+
+    data = _synthetic_wave(1000, nchannels=2, sampwidth=3, framerate=48000)
+    fwav = tmp_path / "decoded.wav"
+    fwav.write_bytes(data)
+
+    wave_in = MappedPCM(fwav, delete=True)
+    assert wave_in.getparams()[:4] == (2, 3, 48000, 1000)
+    assert bytes(wave_in.readframes(10)) == data[44:44 + 60]
+    wave_in.setpos(990)
+    assert bytes(wave_in.readframes(100)) == data[-60:]
+    assert wave_in.readframes(100) == b""
+    wave_in.close()
+    assert not fwav.exists()
+
+def _synthetic_dsf(channels, dsd_rate=2822400, lsbfirst=False) -> bytes:
+    '''
+    Pack DSD bit streams (list of uint8 arrays of 0/1 for each channel) as a DSF file
+    '''
+    import struct
+    import numpy as np
+
+    nsamples = len(channels[0])
+    nblocks = -(-nsamples // (8 * 4096))
+    packed = [np.packbits(c, bitorder='little' if lsbfirst else 'big') for c in channels]
+    packed = [np.pad(p, (0, nblocks * 4096 - len(p))) for p in packed]
+    data = b"".join(packed[ch][b * 4096:(b + 1) * 4096].tobytes()
+                    for b in range(nblocks) for ch in range(len(channels)))
+
+    fmt = struct.pack('<4sQLLLLLLQLL', b'fmt ', 52, 1, 0, len(channels), len(channels), dsd_rate,
+                      1 if lsbfirst else 8, nsamples, 4096, 0)
+    data_chunk = struct.pack('<4sQ', b'data', 12 + len(data)) + data
+    return struct.pack('<4sQQQ', b'DSD ', 28, 28 + len(fmt) + len(data_chunk), 0) + fmt + data_chunk
+
+@pytest.mark.parametrize("lsbfirst", [False, True])
+def test_dsf_readframes(tmp_path, lsbfirst):
+    np = pytest.importorskip("numpy")
+    from fluss import _dsf
+
+    rng = np.random.default_rng(0)
+    bits = [rng.integers(0, 2, 8 * 10000, dtype=np.uint8) for _ in range(2)]
+    fdsf = tmp_path / "random.dsf"
+    fdsf.write_bytes(_synthetic_dsf(bits, lsbfirst=lsbfirst))
+
+    expected = np.stack([np.packbits(b) for b in bits], axis=1).tobytes()
+    with _dsf.open(str(fdsf)) as dsd_in:
+        assert dsd_in.getparams()[:4] == (2, 1, 2822400 // 8, 10000)
+        assert dsd_in.readframes(4000) + dsd_in.readframes(100000) == expected # cross block boundary
+        dsd_in.setpos(4095)
+        assert dsd_in.readframes(2) == expected[4095 * 2:4097 * 2]
+
+def test_dsf_decode(tmp_path, monkeypatch):
+    np = pytest.importorskip("numpy")
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.pipeline, "chunk_size", 4096)
+
+    # modulate a 1kHz sine with second order sigma-delta modulator
+    dsd_rate, pcm_rate, seconds = 2822400, 88200, 0.05
+    signal = 0.5 * np.sin(2 * np.pi * 1000 * np.arange(int(dsd_rate * seconds)) / dsd_rate)
+    bits = np.empty(len(signal), dtype=np.uint8)
+    i1 = i2 = y = 0.
+    for n, s in enumerate(signal):
+        i1 += s - y
+        i2 += i1 - y
+        y = 1. if i2 >= 0 else -1.
+        bits[n] = y > 0
+
+    fdsf = tmp_path / "sine.dsf"
+    fdsf.write_bytes(_synthetic_dsf([bits]))
+    with codecs.dsf().decode(str(fdsf)) as wave_in:
+        assert wave_in.getparams()[:4] == (1, 3, pcm_rate, int(pcm_rate * seconds))
+        pcm = wave_in.as_array()[:, 0] / 2 ** 23
+
+    expected = 0.5 * np.sin(2 * np.pi * 1000 * np.arange(len(pcm)) / pcm_rate)
+    assert np.max(np.abs(pcm[100:-100] - expected[100:-100])) < 0.01
+
+def test_dsf_merge(tmp_path):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("soundfile")
+    from fluss.config import snapshot
+
+    rng = np.random.default_rng(0)
+    files = []
+    for i, nsamples in enumerate([8 * 10000, 8 * 6000]):
+        f = tmp_path / ("%02d.dsf" % (i + 1))
+        f.write_bytes(_synthetic_dsf([rng.integers(0, 2, nsamples, dtype=np.uint8) for _ in range(2)]))
+        files.append(f)
+
+    config = snapshot(dict(pipeline=dict(dsd_pcm_rate=176400, flac_backend="soundfile")))
+    assert codecs.dsf().probe(str(files[0])) == (2, 3, 88200, 2500)
+    assert codecs.dsf(config=config).probe(str(files[0])) == (2, 3, 176400, 5000)
+    assert codecs.dsf()._decoded_size(str(files[0])) == 44 + 2 * 3 * 2500
+
+    fout = tmp_path / "merged.flac"
+    meta = asyncio.run(merge_tracks(files, fout, config=config))
+    assert mutagen.File(fout).info.total_samples == 8000
+    tracks = next(iter(meta.cuesheet.files.values()))
+    assert tracks[2].index01 == round(5000 / 176400 * 75)
+
+def test_decode_cache(tmp_path, monkeypatch):
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.decode_cache, "path", str(tmp_path / "cache"))
+    monkeypatch.setitem(global_config.decode_cache, "max_size", 2 ** 20)
+
+    class counting_codec(codecs.AudioCodec):
+        suffix = "count"
+        decoded = 0
+        async def _decode_async(self, fin, progress_callback=None):
+            counting_codec.decoded += 1
+            return wave.open(BytesIO(Path(fin).read_bytes()), "rb")
+
+    data = _synthetic_wave(1000)
+    fin = tmp_path / "in.count"
+    fin.write_bytes(data)
+
+    async def decode():
+        with await counting_codec().decode_async(fin) as wave_in:
+            return wave_in.readframes(wave_in.getnframes())
+
+    assert asyncio.run(decode()) == data[44:]
+    assert asyncio.run(decode()) == data[44:]
+    assert counting_codec.decoded == 1
+
+    fin.write_bytes(data[:-4]) # modified source should be decoded again
+    assert asyncio.run(decode()) == data[44:-4]
+    assert counting_codec.decoded == 2
+
+@pytest.mark.parametrize("window", [0, 1, 2])
+def test_combine_stream(tmp_path, monkeypatch, window):
+    pytest.importorskip("soundfile")
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.pipeline, "flac_backend", "soundfile")
+    monkeypatch.setitem(global_config.pipeline, "decode_window", window)
+
+    # two tracks with length in whole CD frames, the second one has a pregap of 28 CD frames
+    data = [_synthetic_wave(588 * 75 * 2), _synthetic_wave(588 * 30)]
+    files = [tmp_path / "01.flac", tmp_path / "02.flac"]
+    for f, d in zip(files, data):
+        asyncio.run(codecs.flac().encode_async(f, d))
+
+    cue = Cuesheet.from_file(Path(__file__).parent / "multi-files-explicit-gap.cue")
+    progress = []
+    meta = asyncio.run(merge_tracks(files, tmp_path / "merged.flac", cuesheet=cue, progress_callback=progress.append))
+    assert progress[-1] == 1.0
+
+    tracks = next(iter(meta.cuesheet.files.values()))
+    assert tracks[1].index01 == 0 and tracks[2].index01 == 150 + 28
+
+    with codecs.flac().decode(tmp_path / "merged.flac") as merged:
+        assert bytes(merged.frames) == data[0][44:] + bytes(588 * 28 * 4) + data[1][44:]
+
+def test_decoded_length_mismatch():
+    data = [_synthetic_wave(1000), _synthetic_wave(500)]
+
+    def source(d):
+        async def decode():
+            return wave.open(BytesIO(d))
+        return decode
+
+    async def merge(lengths):
+        stream = codecs.DecodingWaveStream([source(d) for d in data], (2, 2, 44100), lengths, chunk_frames=256)
+        return b"".join([bytes(chunk) async for chunk in stream.aiter_frames()])
+
+    assert asyncio.run(merge([1000, 500])) == data[0][44:] + data[1][44:]
+    with pytest.raises(ValueError, match="earlier"):
+        asyncio.run(merge([1000, 600]))
+    with pytest.raises(ValueError, match="longer"):
+        asyncio.run(merge([900, 500]))
+
+def test_probe_length(tmp_path):
+    import struct
+    from fluss.probe import probe_length
+
+    fwav = tmp_path / "in.wav"
+    fwav.write_bytes(_synthetic_wave(12345, framerate=48000))
+    assert probe_length(fwav) == (12345, 48000)
+
+    ftta = tmp_path / "in.tta"
+    ftta.write_bytes(struct.pack('<4sHHHII', b'TTA1', 1, 2, 16, 44100, 1234567) + bytes(64))
+    assert probe_length(ftta) == (1234567, 44100)
+
+    fwv = tmp_path / "in.wv"
+    fwv.write_bytes(struct.pack('<4sIHBBIIIII', b'wvpk', 1000, 0x410, 0, 1, 5, 0, 4096, 9 << 23, 0))
+    assert probe_length(fwv) == (2 ** 32 + 4, 44100)
+
+    soundfile = pytest.importorskip("soundfile")
+    fflac = tmp_path / "in.flac"
+    soundfile.write(str(fflac), soundfile.read(str(fwav))[0], 48000, format="FLAC")
+    assert probe_length(fflac) == (12345, 48000)
+
+def test_merge_exact_offsets(tmp_path):
+    # tracks that are not aligned to CD frames, offsets shouldn't drift due to rounding of each track
+    files = []
+    for i in range(8):
+        f = tmp_path / ("%02d.wav" % (i + 1))
+        f.write_bytes(_synthetic_wave(588 * 75 + 300))
+        files.append(f)
+
+    meta = asyncio.run(merge_tracks(files, tmp_path / "merged.wav", dry_run=True))
+    tracks = next(iter(meta.cuesheet.files.values()))
+    assert [tracks[i + 1].index01 for i in range(8)] == [round(i * (75 + 300 / 588)) for i in range(8)]
+
+def test_decode_pipe_transport(tmp_path, monkeypatch):
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.pipeline, "transport", "pipe")
+    monkeypatch.setitem(global_config.pipeline, "chunk_size", 4096)
+
+    data = _synthetic_wave(10000, sampwidth=3)
+    fin = tmp_path / "in.pipe"
+    fin.write_bytes(data)
+
+    progress = []
+    with asyncio.run(_pipe_codec().decode_async(fin, progress_callback=progress.append)) as wave_in:
+        assert wave_in.getparams()[:4] == (2, 3, 44100, 10000)
+        assert bytes(wave_in.readframes(10000)) == data[44:]
+    assert len(progress) > 1 and progress[-1] == 1.0
+
+def test_decode_pipe_unknown_size(tmp_path, monkeypatch):
+    import struct
+    from fluss.config import global_config
+    from fluss.scratch import get_scratch_space
+    monkeypatch.setitem(global_config.pipeline, "transport", "pipe")
+    monkeypatch.setitem(global_config.scratch, "path", str(tmp_path / "scratch"))
+
+    # streaming encoders mark the size as unknown, frames are spilled to a scratch file instead of memory
+    data = bytearray(_synthetic_wave(10000))
+    struct.pack_into('<I', data, 4, 0xFFFFFFFF)
+    struct.pack_into('<I', data, 40, 0xFFFFFFFF)
+    fin = tmp_path / "in.pipe"
+    fin.write_bytes(data)
+
+    space = get_scratch_space()
+    wave_in = asyncio.run(_pipe_codec().decode_async(fin))
+    assert wave_in.path.parent.parent == tmp_path / "scratch" and space.used > 0
+    assert wave_in.getnframes() == 10000
+    assert bytes(wave_in.readframes(10000)) == data[44:]
+    wave_in.close()
+    assert space.used == 0 and not wave_in.path.exists()
+
+class _failing_pipe_codec(_pipe_codec):
+    ''' codec whose decoder fails after writing the whole stream '''
+    def _decode_pipe_args(self, fin):
+        return [sys.executable, "-c", "import sys,shutil; shutil.copyfileobj(open(sys.argv[1],'rb'), sys.stdout.buffer); sys.exit(3)", fin]
+
+def test_decode_stream_pipe(tmp_path, monkeypatch):
+    from functools import partial
+    from fluss.config import global_config
+    from fluss.scratch import get_scratch_space
+    monkeypatch.setitem(global_config.pipeline, "chunk_size", 4096)
+    monkeypatch.setitem(global_config.pipeline, "pipe_buffers", 1)
+    monkeypatch.setitem(global_config.scratch, "path", str(tmp_path / "scratch"))
+
+    data = [_synthetic_wave(30000), _synthetic_wave(20000)]
+    files = [tmp_path / "01.pipe", tmp_path / "02.pipe"]
+    for f, d in zip(files, data):
+        f.write_bytes(d)
+
+    async def merge(codec):
+        # frames are read from the decoders through bounded buffers rather than scratch files
+        stream = codecs.DecodingWaveStream([partial(codec.decode_stream_async, f) for f in files],
+                                           (2, 2, 44100), [30000, 20000], chunk_frames=1000)
+        chunks = []
+        async for chunk in stream.aiter_frames():
+            assert get_scratch_space().used == 0
+            chunks.append(bytes(chunk))
+        return b"".join(chunks)
+
+    assert asyncio.run(merge(_pipe_codec())) == data[0][44:] + data[1][44:]
+    with pytest.raises(RuntimeError, match="returns 3"):
+        asyncio.run(merge(_failing_pipe_codec()))
+
+    async def close_early():
+        progress = []
+        wave_in = await _pipe_codec().decode_stream_async(files[0], progress_callback=progress.append)
+        assert isinstance(wave_in, codecs.transport.PipeWaveReader)
+        assert wave_in.getparams()[:4] == (2, 2, 44100, 30000)
+        assert len(await wave_in.readframes_async(100)) == 400
+        wave_in.close() # the decoder is killed, and the pumping thread exits
+        wave_in._thread.join(5)
+        assert not wave_in._thread.is_alive()
+
+    asyncio.run(close_early())
+
+def test_fanout_encode(tmp_path, monkeypatch):
+    pytest.importorskip("soundfile")
+    from fluss.config import global_config
+    monkeypatch.setitem(global_config.pipeline, "flac_backend", "soundfile")
+
+    data = [_synthetic_wave(588 * 100), _synthetic_wave(588 * 50)]
+    files = [tmp_path / "01.wav", tmp_path / "02.wav"]
+    for f, d in zip(files, data):
+        f.write_bytes(d)
+
+    outputs = [tmp_path / "fast.flac", tmp_path / "best.flac"]
+    progress = []
+    asyncio.run(merge_tracks(files, outputs, codec_out=["flac", "flac"], progress_callback=progress.append))
+    assert progress[-1] == 1.0
+
+    for fout in outputs:
+        with codecs.flac().decode(fout) as merged:
+            assert bytes(merged.frames) == data[0][44:] + data[1][44:]
+        tracks = next(iter(DiscMeta.from_mutagen(codecs.flac.mutagen(fout)).cuesheet.files.values()))
+        assert tracks[2].index01 == 100
+
+def test_verify_outputs(tmp_path, monkeypatch):
+    from fluss.utils import convert_track
+
+    class _lossy_codec(_pipe_codec):
+        ''' codec that drops the last frame when decoding '''
+        suffix = "lossy"
+
+        def _decode_pipe_args(self, fin):
+            return [sys.executable, "-c", "import sys; sys.stdout.buffer.write(open(sys.argv[1],'rb').read()[:-4])", fin]
+
+    monkeypatch.setitem(codecs.codec_from_name, "pipe", _pipe_codec)
+    monkeypatch.setitem(codecs.codec_from_name, "lossy", _lossy_codec)
+    monkeypatch.setattr(_pipe_codec, "mutagen", classmethod(lambda cls, fin: mutagen.wave.WAVE(fin)))
+    monkeypatch.setattr(DiscMeta, "to_mutagen", lambda self, mutag: None)
+
+    fin = tmp_path / "in.wav"
+    fin.write_bytes(_synthetic_wave(5000))
+    asyncio.run(convert_track(fin, tmp_path / "out.pipe", meta=DiscMeta(), verify=True))
+    with pytest.raises(RuntimeError, match="out.lossy"):
+        asyncio.run(convert_track(fin, [tmp_path / "out2.pipe", tmp_path / "out.lossy"], meta=DiscMeta(), verify=True))
+
+    # verification of existing outputs only, the failed one is removed
+    asyncio.run(convert_track(fin, tmp_path / "out.pipe", meta=DiscMeta(), verify=True, check_only=True))
+    (tmp_path / "out.lossy").write_bytes(fin.read_bytes())
+    with pytest.raises(RuntimeError, match="out.lossy"):
+        asyncio.run(convert_track(fin, tmp_path / "out.lossy", meta=DiscMeta(), verify=True, check_only=True))
+    assert (tmp_path / "out.pipe").exists() and not (tmp_path / "out.lossy").exists()
+
+@pytest.mark.skipif(sys.platform == "win32", reason="process groups are checked with signals")
+def test_cancel_kills_process_group(tmp_path):
+    import os
+    import time
+
+    # the codec is started by a shell, and it starts its own child as well
+    pidfile, fout = tmp_path / "child.pid", tmp_path / "partial.out"
+    script = ("import subprocess,sys; p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']); "
+              "open(sys.argv[1], 'w').write(str(p.pid)); open(sys.argv[2], 'wb').write(b'partial'); p.wait()")
+
+    async def run():
+        proc = await codecs._create_subprocess_shell(codecs.joint_command_args(
+            sys.executable, "-c", script, str(pidfile), str(fout)))
+        task = asyncio.ensure_future(_pipe_codec()._wait_process("test encoder", proc, cleanup=[fout]))
+        while not fout.exists():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert not fout.exists()
+
+    child = int(pidfile.read_text())
+    for _ in range(50):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("Child process of the codec is still running")
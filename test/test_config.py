@@ -0,0 +1,59 @@
+import pickle
+
+import pytest
+
+from fluss import codecs
+from fluss.apps.organizer.targets import TranscodeTrackTarget
+from fluss.config import ConfigSnapshot, global_config, snapshot
+from fluss.utils import _get_codec
+
+def test_snapshot_layers(tmp_path, monkeypatch):
+    monkeypatch.setitem(global_config.pipeline, "chunk_size", 4096)
+    (tmp_path / ".fluss.yaml").write_text("pipeline:\n  verify: true\n  decode_window: 4\n")
+
+    config = snapshot(dict(pipeline=dict(decode_window=8)), library=tmp_path)
+    assert config.pipeline.chunk_size == 4096 # from global config
+    assert config.pipeline.verify # from library
+    assert config.pipeline.decode_window == 8 # from job
+    assert config.pipeline.streaming == global_config.pipeline.streaming
+
+    # snapshots are not affected by later changes of global config
+    monkeypatch.setitem(global_config.pipeline, "chunk_size", 8192)
+    assert config.pipeline.chunk_size == 4096
+
+    with pytest.raises(TypeError):
+        config.pipeline.verify = False
+    with pytest.raises(TypeError):
+        config.audio_codecs.wavpack.update(type="flac")
+    with pytest.raises(KeyError):
+        config.pipeline["unknown_option"]
+    with pytest.raises(AttributeError):
+        config.pipeline.unknown_option
+    assert getattr(config.pipeline, "unknown_option", None) is None
+    assert not hasattr(config, "unknown_section") and hasattr(config, "pipeline")
+    assert isinstance(config.audio_codecs.wavpack.encode, tuple)
+
+    restored = pickle.loads(pickle.dumps(config))
+    assert isinstance(restored, ConfigSnapshot) and restored == config
+    assert config.layer(dict(pipeline=dict(verify=False))).pipeline.verify is False
+    assert config.pipeline.verify
+
+def test_jobs_with_different_presets():
+    fast = snapshot(dict(organizer=dict(output_codec=dict(audio="fast")),
+                         audio_codecs=dict(fast=dict(type="flac", encode=["-0"]))))
+    wave = snapshot(dict(organizer=dict(output_codec=dict(audio="raw")), audio_codecs=dict(raw=dict(type="wave"))))
+
+    assert TranscodeTrackTarget("01.wv", config=fast).output_name == "01.flac"
+    assert TranscodeTrackTarget("01.wv", config=wave).output_name == "01.wav"
+    assert "fast" not in global_config.audio_codecs
+
+    codec = _get_codec("out.wav", "raw", wave)
+    assert isinstance(codec, codecs.wav) and codec.config is wave
+
+def test_global_sections(tmp_path):
+    (tmp_path / ".fluss.yaml").write_text("scratch:\n  quota: 1000\n")
+    with pytest.raises(ValueError, match="scratch"):
+        snapshot(library=tmp_path)
+    with pytest.raises(ValueError, match="decode_cache"):
+        snapshot(dict(decode_cache=dict(max_size=0)))
+    assert snapshot().scratch.quota == global_config.scratch.quota # still readable from snapshots
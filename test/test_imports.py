@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+_heavy = ["yaml", "mutagen.flac", "mutagen.id3", "PySide6", "qasync"]
+
+def _imported(tmp_path, stmt):
+    code = "import json, sys; %s; print(json.dumps(sorted(sys.modules)))" % stmt
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    proc = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True,
+                          cwd=Path(__file__).parent.parent, env=env)
+    return set(json.loads(proc.stdout))
+
+def test_codecs_import_is_light(tmp_path):
+    modules = _imported(tmp_path, "import fluss.codecs")
+    assert not modules.intersection(_heavy)
+    assert not (tmp_path / ".fluss.yaml").exists() # config is not loaded until it's read
+
+def test_config_loaded_on_access(tmp_path):
+    modules = _imported(tmp_path, "from fluss.config import global_config; global_config.pipeline.streaming")
+    assert "yaml" in modules
+    assert (tmp_path / ".fluss.yaml").exists()
+
+def test_tag_types_resolved_lazily():
+    from fluss import codecs
+    from mutagen.apev2 import APEv2File
+    assert codecs.APETagFiles == (APEv2File,)
+    assert len(codecs.ID3TagFiles) == 3
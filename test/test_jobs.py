@@ -0,0 +1,89 @@
+import threading
+
+from fluss.jobs import DONE, FAILED, PENDING, RUNNING, JobQueue
+
+def test_dependencies_and_resume(tmp_path):
+    path = tmp_path / "jobs.sqlite"
+    with JobQueue(path, max_attempts=2) as queue:
+        queue.add("album", "cover", payload=dict(file="cover.jpg"))
+        queue.add("album", "disc1", output="disc1.wv", depends=["cover"])
+        queue.add("album", "disc2", output="disc2.wv", depends=["cover"])
+
+        job = queue.claim("album", worker="w1")
+        assert job.key == "cover" and job.status == RUNNING and job.attempts == 1
+        assert job.payload == dict(file="cover.jpg")
+        assert queue.claim("album", worker="w2") is None # blocked by the dependency
+        queue.complete(job.id, "cover.png")
+
+        job = queue.claim("album", worker="w1")
+        assert job.key == "disc1"
+        queue.fail(job.id, "encoder crashed")
+        assert queue.find("album", "disc1").status == PENDING # retried
+        assert queue.claim("album", key="disc1").attempts == 2
+        queue.fail(job.id, "encoder crashed")
+        assert queue.find("album", "disc1").status == FAILED
+
+        job = queue.claim("album", worker="w1")
+        assert job.key == "disc2" # left running when the worker is killed
+
+    # resume from the database
+    with JobQueue(path) as queue:
+        assert queue.summary("album") == {DONE: 1, FAILED: 1, RUNNING: 1}
+        queue.add("album", "cover") # existing jobs are kept
+        assert queue.find("album", "cover").status == DONE
+        assert queue.find("album", "cover").output == "cover.png"
+
+        assert queue.claim("album") is None # still leased
+        assert queue.recover("album", force=True) == 1
+        job = queue.claim("album")
+        assert job.key == "disc2" and job.attempts == 2
+        queue.complete(job.id)
+        done = queue.find("album", "disc2")
+        assert done.status == DONE and done.output == "disc2.wv" and done.elapsed >= 0
+
+        queue.add("album", "disc1", reset=True)
+        assert queue.find("album", "disc1").status == PENDING
+
+def test_concurrent_claims(tmp_path):
+    path = tmp_path / "jobs.sqlite"
+    with JobQueue(path) as queue:
+        for i in range(50):
+            queue.add("batch", "job%d" % i)
+
+    claimed = []
+    def worker(name):
+        with JobQueue(path) as queue: # separate connection for each worker
+            while True:
+                job = queue.claim("batch", worker=name)
+                if job is None:
+                    break
+                claimed.append(job.key)
+                queue.complete(job.id)
+
+    threads = [threading.Thread(target=worker, args=("w%d" % i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(claimed) == sorted("job%d" % i for i in range(50))
+
+def test_sync_release_retry(tmp_path):
+    with JobQueue(tmp_path / "jobs.sqlite", max_attempts=1) as queue:
+        queue.sync("album", "disc1", payload=dict(fingerprint="a"))
+        job = queue.claim("album")
+        queue.complete(job.id)
+        assert queue.sync("album", "disc1", payload=dict(fingerprint="a")).status == DONE # unchanged
+        assert queue.sync("album", "disc1", payload=dict(fingerprint="b")).status == PENDING # target changed
+
+        job = queue.claim("album")
+        assert queue.sync("album", "disc1", payload=dict(fingerprint="c")).status == RUNNING # never steal running jobs
+        queue.release(job.id) # cancelled
+        job = queue.claim("album")
+        assert job.attempts == 2 # the cancelled attempt is not counted
+        queue.fail(job.id, "encoder crashed")
+        assert queue.find("album", "disc1").status == FAILED
+        assert queue.sync("album", "disc1", payload=dict(fingerprint="b")).status == FAILED
+
+        assert queue.retry("album") == 1
+        assert queue.claim("album").key == "disc1"
@@ -0,0 +1,37 @@
+import json
+import logging
+import os
+
+from fluss.config import global_config
+from fluss.logs import log_file_path, setup_logging, stop_logging
+
+def test_json_log_per_process(tmp_path, monkeypatch):
+    monkeypatch.setitem(global_config.logging, "path", str(tmp_path / "fluss-{pid}.log"))
+    monkeypatch.setitem(global_config.logging, "format", "json")
+    monkeypatch.setitem(global_config.logging, "level", "INFO")
+    monkeypatch.setitem(global_config.logging, "levels", {"fluss.test.quiet": "WARNING"})
+
+    root = logging.getLogger()
+    level = root.level
+    setup_logging()
+    try:
+        args = ["a.flac"]
+        logging.getLogger("fluss.test").info("Encoding %s done", args)
+        args.append("changed") # arguments are merged when the record is queued
+        logging.getLogger("fluss.test").debug("filtered by level")
+        logging.getLogger("fluss.test.quiet").info("filtered by logger level")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("fluss.test").exception("Failed")
+    finally:
+        stop_logging()
+        root.setLevel(level)
+        logging.getLogger("fluss.test.quiet").setLevel(logging.NOTSET)
+
+    path = log_file_path()
+    assert path == tmp_path / ("fluss-%d.log" % os.getpid())
+    entries = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [e["message"] for e in entries] == ["Encoding ['a.flac'] done", "Failed"]
+    assert entries[0]["logger"] == "fluss.test" and entries[0]["level"] == "INFO"
+    assert "ValueError: boom" in entries[1]["exception"]
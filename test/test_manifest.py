@@ -0,0 +1,86 @@
+import asyncio
+import os
+
+from fluss.apps.organizer.manifest import TargetManifest
+from fluss.apps.organizer.targets import CopyTarget, TranscodeTextTarget
+
+def _run(target, input_root, output_root, manifest):
+    ''' execute the target like the organizer does, return whether it's executed '''
+    output = output_root / target.output_name
+    fingerprint = target.fingerprint(input_root)
+    if manifest.is_valid(output, fingerprint):
+        return False
+    asyncio.run(target.apply(input_root, output_root))
+    manifest.record(output, fingerprint)
+    manifest.save()
+    return True
+
+def test_skip_up_to_date(tmp_path):
+    input_root, output_root = tmp_path / "in", tmp_path / "out"
+    input_root.mkdir()
+    output_root.mkdir()
+    (input_root / "a.bin").write_bytes(b"1234")
+    (input_root / "b.txt").write_text("text", encoding="utf-8")
+
+    targets = [CopyTarget(["a.bin"]), TranscodeTextTarget(["b.txt"])]
+    manifest = TargetManifest(output_root)
+    assert all(_run(t, input_root, output_root, manifest) for t in targets)
+
+    # manifest is persisted
+    manifest = TargetManifest(output_root)
+    assert not any(_run(t, input_root, output_root, manifest) for t in targets)
+
+    # changed input
+    (input_root / "a.bin").write_bytes(b"12345")
+    assert _run(targets[0], input_root, output_root, manifest)
+    assert not _run(targets[1], input_root, output_root, manifest)
+    assert (output_root / "a.bin").read_bytes() == b"12345"
+
+    # changed settings
+    assert _run(TranscodeTextTarget(["b.txt"], encoding="gbk"), input_root, output_root, manifest)
+
+    # modified or missing output
+    stat = os.stat(output_root / "a.bin")
+    os.utime(output_root / "a.bin", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert _run(targets[0], input_root, output_root, manifest)
+    (output_root / "a.bin").unlink()
+    assert _run(targets[0], input_root, output_root, manifest)
+
+def test_missing_input(tmp_path):
+    target = CopyTarget(["missing.bin"])
+    assert target.fingerprint(tmp_path) is None
+    assert not TargetManifest(tmp_path).is_valid(tmp_path / "missing.bin", None)
+
+def test_pipeline_settings_in_fingerprint(tmp_path):
+    from fluss.apps.organizer.targets import MergeTracksTarget, TranscodeTrackTarget
+    from fluss.config import snapshot
+
+    (tmp_path / "01.dsf").write_bytes(b"")
+    base = snapshot(dict(organizer=dict(output_codec=dict(audio="flac"))))
+    for target_t, inputs in [(TranscodeTrackTarget, "01.dsf"), (MergeTracksTarget, ["01.dsf"])]:
+        fingerprint = target_t(inputs, config=base).fingerprint(tmp_path)
+        assert target_t(inputs, config=base).fingerprint(tmp_path) == fingerprint
+        config = base.layer(dict(pipeline=dict(dsd_pcm_rate=176400)))
+        assert target_t(inputs, config=config).fingerprint(tmp_path) != fingerprint
+
+        # checks are done again on the output rather than changing the fingerprint
+        config = base.layer(dict(pipeline=dict(verify=True, analyze=True)))
+        target = target_t(inputs, config=config)
+        assert target.fingerprint(tmp_path) == fingerprint
+        assert target.checks() == dict(analyze=True, verify=True)
+
+def test_record_checks(tmp_path):
+    output = tmp_path / "album.flac"
+    output.write_bytes(b"audio")
+    analysis = dict(md5="0" * 32, peak=0.5, loudness=-20.0, gain=2.0)
+
+    manifest = TargetManifest(tmp_path)
+    manifest.record(output, "fp", ["verify"], analysis)
+    manifest.save()
+
+    manifest = TargetManifest(tmp_path)
+    assert manifest.is_valid(output, "fp")
+    assert manifest.done_checks(output) == {"verify"}
+    assert manifest.analysis(output) == analysis
+    assert manifest.done_checks(tmp_path / "other.flac") == set()
+    assert manifest.analysis(tmp_path / "other.flac") is None
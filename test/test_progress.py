@@ -0,0 +1,59 @@
+import asyncio
+import random
+
+from fluss.progress import OutputProgressParser, ProgressBus
+from fluss.utils import _ProgressCombiner
+
+def test_parser_chunks():
+    output = b"".join(b"%3d%% complete, ratio" % p for p in [0, 10, 10, 55, 100])
+    reported = []
+    parser = OutputProgressParser(rb'1?[0-9]{0,2}(?=% complete)', lambda s: int(s) / 100,
+                                  reported.append, separator=b"ratio", keep=32)
+    for i in range(0, len(output), 7): # records are split across chunks
+        parser.feed(output[i:i + 7])
+    assert parser.close() == output[-32:]
+    assert reported == [0., 0.1, 0.55, 1.] # repeated progress is reported once
+
+def test_parser_marks():
+    reported = []
+    parser = OutputProgressParser(rb'[^1-9]\.|^\.', 0.25, reported.append, separator=b'.')
+    parser.feed(b"TAK 2.3.0 Progress: ...")
+    parser.feed(b"..")
+    parser.close()
+    assert reported == [0.25, 0.5, 0.75, 1.]
+
+def test_bus_throttle():
+    bus = ProgressBus()
+    received = []
+
+    async def run():
+        unsubscribe = bus.subscribe(received.append, interval=0.05)
+        for i in range(100):
+            bus.publish("a", "encode", i / 100, bytes=i)
+            bus.publish("b", "encode", i / 200)
+            await asyncio.sleep(0.001)
+        bus.publish("a", "encode", 1.)
+        await asyncio.sleep(0.1)
+        unsubscribe()
+
+    asyncio.run(run())
+    assert 4 <= len(received) < 20 # the first events, a few coalesced batches and the final event
+    last = {}
+    for event in received:
+        last[event.target] = event
+    assert last["a"].fraction == 1. and last["a"].eta == 0.
+    assert last["b"].fraction == 0.495 and last["b"].eta > 0
+    assert [e.bytes for e in received if e.target == "a"][:1] == [0]
+
+def test_combiner():
+    combined = []
+    current = [0.] * 5
+    combiner = _ProgressCombiner(list(range(5)), combined.append, range=[0, 0.5])
+    updaters = [combiner.get_updater(i) for i in range(5)]
+    rng = random.Random(0)
+    for _ in range(500):
+        i = rng.randrange(5)
+        current[i] = min(current[i] + rng.choice([0, 0.1, 0.25]), 1.)
+        updaters[i](current[i])
+        assert combined[-1] == min(current) / 2
+    assert len(combined) == len(set(combined)) # only changes are reported
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+from networkx import DiGraph
+from fluss.scheduler import GraphScheduler
+
+def _make_graph():
+    # cover -> disc1..3, two independent text targets
+    graph = DiGraph()
+    graph.add_nodes_from(["cover", "text1", "text2", "disc1", "disc2", "disc3"])
+    graph.add_edges_from([("cover", "disc1"), ("cover", "disc2"), ("cover", "disc3")])
+    return graph
+
+def test_parallel_execution():
+    finished = []
+    async def runner(node, progress):
+        await asyncio.sleep(0.1)
+        progress(0.5)
+        finished.append(node)
+
+    updates = []
+    scheduler = GraphScheduler(_make_graph(), runner, max_workers=8,
+        progress_callback=lambda n, p, total: updates.append(total))
+
+    start = time.time()
+    asyncio.run(scheduler.run())
+    elapsed = time.time() - start
+
+    assert elapsed < 0.35 # critical path is two nodes long
+    assert finished.index("cover") < min(finished.index(d) for d in ["disc1", "disc2", "disc3"])
+    assert scheduler.progress == 1. and updates[-1] == 1.
+
+def test_worker_budget():
+    running, peak = 0, 0
+    async def runner(node, progress):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    asyncio.run(GraphScheduler(_make_graph(), runner, max_workers=2).run())
+    assert peak == 2
+
+def test_failure_cancels_others():
+    cancelled = []
+    async def runner(node, progress):
+        if node == "text1":
+            raise RuntimeError("failed")
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(node)
+            raise
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(GraphScheduler(_make_graph(), runner, max_workers=8).run())
+    assert "disc1" not in cancelled and len(cancelled) > 0
@@ -0,0 +1,107 @@
+import asyncio
+
+from fluss.scratch import ScratchSpace, current_job
+
+def test_quota(tmp_path):
+    space = ScratchSpace([tmp_path], quota=100)
+    order = []
+
+    async def job(name, size, hold):
+        current_job.set(name)
+        scratch = await space.allocate(size, "decode_", ".wav")
+        order.append(name)
+        scratch.path.write_bytes(b"0" * size)
+        await asyncio.sleep(hold)
+        assert space.used <= 100 or space.used == size
+        usage = space.usage()
+        scratch.release()
+        return usage
+
+    async def run():
+        first = asyncio.ensure_future(job("a", 60, 0.1))
+        await asyncio.sleep(0.01)
+        return await asyncio.gather(first, job("b", 60, 0), job("c", 30, 0))
+
+    usage_a, usage_b, _ = asyncio.run(run())
+    assert order == ["a", "c", "b"] # b waits until a is released
+    assert usage_a == {"a": 60} # c is released before a wakes up
+    assert usage_b == {"b": 60}
+    assert space.used == 0 and space.usage() == {}
+    assert not any(p.is_file() and p.name != ".lock" for p in tmp_path.rglob("*"))
+
+def test_prefer_ram(tmp_path):
+    ram, disk = tmp_path / "ram", tmp_path / "disk"
+    space = ScratchSpace([ram, disk])
+    scratch = space.allocate_blocking(10)
+    assert scratch.path.parent.parent == ram
+    scratch.release()
+
+    space = ScratchSpace([ram, disk], min_free=2 ** 62) # no space on either device
+    scratch = space.allocate_blocking(10)
+    assert scratch.path.parent.parent == disk
+    scratch.release()
+
+def test_sweep(tmp_path):
+    orphan = tmp_path / "run-1-abc"
+    orphan.mkdir()
+    (orphan / ".lock").touch()
+    (orphan / "decode_1.wav").write_bytes(b"data")
+
+    space = ScratchSpace([tmp_path])
+    scratch = space.allocate_blocking(4)
+    scratch.path.write_bytes(b"data")
+    assert space.sweep() == 1
+    assert not orphan.exists()
+    assert scratch.path.exists() # directory of a running process is kept
+
+    # locked by another instance in this process
+    assert ScratchSpace([tmp_path]).sweep() == 0
+    assert scratch.path.exists()
+    scratch.release()
+
+def test_quota_smaller_than_album(tmp_path):
+    space = ScratchSpace([tmp_path], quota=100)
+
+    async def decode(size):
+        scratch = await space.allocate(size, "decode_", ".wav")
+        await asyncio.sleep(0.01)
+        scratch.release()
+
+    async def album(name, size):
+        current_job.set(name)
+        # the encoding temp file of the whole album is held while its tracks are decoded
+        encode_tmp = await space.allocate(size, "encode_", ".wav")
+        await asyncio.gather(decode(size // 2), decode(size // 2))
+        encode_tmp.release()
+
+    async def run():
+        await asyncio.wait_for(asyncio.gather(album("a", 150), album("b", 80)), 5)
+
+    asyncio.run(run())
+    assert space.used == 0
+
+def test_allocate_blocking(tmp_path):
+    import threading
+
+    space = ScratchSpace([tmp_path], quota=100)
+    token = current_job.set("a")
+    held = space.allocate_blocking(80)
+    timer = threading.Timer(0.1, held.release)
+    timer.start()
+    current_job.set("b")
+    scratch = space.allocate_blocking(60) # waits for the release on the other thread
+    assert held._released and space.used == 60
+    scratch.release()
+    timer.join()
+    current_job.reset(token)
+
+    async def in_loop():
+        held = await space.allocate(80)
+        current_job.set("c")
+        scratch = space.allocate_blocking(60) # the loop can't be blocked, the quota is exceeded
+        assert space.used == 140
+        held.release()
+        scratch.release()
+
+    asyncio.run(in_loop())
+    assert space.used == 0
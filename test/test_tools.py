@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+from fluss.config import global_config
+from fluss.tools import ToolRegistry
+
+@pytest.mark.skipif(sys.platform == "win32", reason="stub flac is a shell script")
+def test_resolve_and_cache(tmp_path, monkeypatch):
+    # stub flac prints its usage and counts invocations
+    counter = tmp_path / "count"
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    flac = bindir / "flac"
+    flac.write_text("#!/bin/sh\necho >> '%s'\necho 'flac - Command-line FLAC encoder/decoder version 1.5.0'\n"
+                    "echo '  -j, --threads=#'\n" % counter)
+    flac.chmod(0o755)
+    monkeypatch.setitem(global_config.path, "flac", "")
+    monkeypatch.setenv("PATH", str(bindir))
+
+    cache_path = tmp_path / "tools.json"
+    registry = ToolRegistry(cache_path)
+    info = registry.require("flac")
+    assert (info.path, info.version, info.features) == (flac.resolve(), "1.5.0", ["threads"])
+    assert registry.get("flac") is info
+    assert registry.get("wavpack") is None
+    with pytest.raises(FileNotFoundError):
+        registry.require("takc")
+
+    assert ToolRegistry(cache_path).require("flac").version == "1.5.0" # loaded from cache
+    assert counter.read_text().count("\n") == 1
+
+    st = flac.stat() # a replaced binary is probed again
+    os.utime(flac, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert ToolRegistry(cache_path).capabilities()["tools"]["flac"]["features"] == ["threads"]
+    assert counter.read_text().count("\n") == 2